@@ -0,0 +1,87 @@
+'''
+Benchmark of the discovery and download path of the buildserver against a
+local mock buildbot (flashtool.tests.mockbuildbot).
+
+Every step is timed cold (empty working directory) and warm (catalogs and
+artifact cache of the cold run). Run from the repository root:
+
+    python benchmarks/bench_discovery.py --builds 2000 --latency 0.005
+'''
+__author__ = 'mahieke'
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flashtool.server.buildserver import Buildserver
+from flashtool.tests.mockbuildbot import MockBuildbot
+
+
+def run(mock, working_dir, dest, args):
+    '''
+    Runs all steps once and returns a list of tuples (step, seconds, requests).
+    '''
+    results = []
+
+    def step(name, function, *params):
+        requests = len(mock.requests)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = function(*params)
+        results.append((name, time.perf_counter() - start, len(mock.requests) - requests))
+        return value
+
+    server = Buildserver(mock.address, mock.port, mock.platforms, dest=dest, cache_dir=working_dir,
+                         workers=args.workers, batch_size=args.batch_size, segments=args.segments)
+    platform = mock.platforms[0]
+
+    step('get_builders_info', server.get_builders_info)
+    builds = step('get_builds_info', server.get_builds_info)
+    file_info = step('get_build_info', server.get_build_info, builds, ['linux'], platform)
+    files = step('get_files_path', server.get_files_path, file_info, '', [('linux', ['boot', 'root'])], True)
+    for f_type, path in files[0][1]:
+        step('get_file ({})'.format(f_type), server.get_file, path)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archs', type=int, default=2, help='number of architecture builders')
+    parser.add_argument('--boards', type=int, default=4, help='number of platforms per architecture')
+    parser.add_argument('--builds', type=int, default=1000, help='number of builds per builder')
+    parser.add_argument('--artifact-size', type=int, default=16 * 1024 * 1024, help='size of an artifact in bytes')
+    parser.add_argument('--latency', type=float, default=0.002, help='latency of each answer in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='parallel requests of the buildserver')
+    parser.add_argument('--batch-size', type=int, default=50, help='builds per request')
+    parser.add_argument('--segments', type=int, default=4, help='segments of large downloads')
+    args = parser.parse_args()
+
+    working_dir = tempfile.mkdtemp(prefix='flashtool_bench_')
+    dest = os.path.join(working_dir, 'products')
+    os.makedirs(dest)
+
+    try:
+        with MockBuildbot(args.archs, args.boards, args.builds, args.builds // 5, artifact_size=args.artifact_size,
+                          latency=args.latency) as mock:
+            cold = run(mock, working_dir, dest, args)
+            warm = run(mock, working_dir, dest, args)
+    finally:
+        shutil.rmtree(working_dir)
+
+    print('{:<20} {:>10} {:>9} {:>10} {:>9}'.format('step', 'cold [s]', 'requests', 'warm [s]', 'requests'))
+    for (name, t_cold, r_cold), (_, t_warm, r_warm) in zip(cold, warm):
+        print('{:<20} {:>10.4f} {:>9} {:>10.4f} {:>9}'.format(name, t_cold, r_cold, t_warm, r_warm))
+    print('{:<20} {:>10.4f} {:>9} {:>10.4f} {:>9}'.format('total', sum(r[1] for r in cold), sum(r[2] for r in cold),
+                                                          sum(r[1] for r in warm), sum(r[2] for r in warm)))
+
+
+if __name__ == '__main__':
+    main()
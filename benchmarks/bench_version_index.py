@@ -0,0 +1,98 @@
+'''
+Microbenchmark for the version resolution of the buildserver.
+
+Compares the former scan of the whole file list per version with the
+version index (flashtool.server.buildserver.index_versions) on a synthetic
+catalog. Run from the repository root:
+
+    python benchmarks/bench_version_index.py --builds 1000 5000 10000
+'''
+__author__ = 'mahieke'
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flashtool.server.buildserver import index_versions
+
+
+def synthetic_files(builds, types=('boot', 'root', 'config')):
+    '''
+    File list of one product with the given number of builds. Every tenth
+    build misses its last file type.
+    '''
+    files = []
+    for num in range(builds):
+        for f_type in types[:-1] if num % 10 == 0 else types:
+            files.append('linux/bbb/linux_4.{}_{}_{}.tar.gz'.format(num % 7, num, f_type))
+
+    return files
+
+
+def scan(files, reg_name, types):
+    '''
+    Version resolution as done before the index: one scan over all files per version.
+    '''
+    re_file = re.compile('.*{}.*'.format(reg_name))
+    matched_files = list(filter(lambda f_name: re_file.match(f_name), files))
+    versions = sorted(set([f[:f.rfind('_')] for f in matched_files]))
+
+    ret_val = []
+    for version in versions:
+        types_per_file = set(map(lambda t: t.split('_')[-1].split('.')[0], filter(lambda f: version in f, matched_files)))
+        if set(types) == types_per_file:
+            ret_val.append(version)
+
+    version = ret_val[-1]
+    return [next(f for f in matched_files if re.match('{}_{}.*'.format(version, t), f)) for t in types]
+
+
+def indexed(files, reg_name, types):
+    re_file = re.compile('.*{}.*'.format(reg_name))
+    index = index_versions(filter(lambda f_name: re_file.match(f_name), files))
+    versions = sorted(v for v, t in index.items() if set(t) == set(types))
+
+    return [index[versions[-1]][t] for t in types]
+
+
+def measure(function, *args, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--builds', type=int, nargs='+', default=[1000, 5000, 10000, 20000],
+                        help='number of builds of the synthetic catalogs')
+    parser.add_argument('--scan-max', type=int, default=10000,
+                        help='largest catalog for the former scan, which grows quadratically')
+    parser.add_argument('--regex', default='',
+                        help='regular expression for the version')
+    args = parser.parse_args()
+
+    types = ['boot', 'root', 'config']
+    print('{:>8} {:>8} {:>12} {:>12} {:>8}'.format('builds', 'files', 'scan [s]', 'index [s]', 'speedup'))
+    for builds in args.builds:
+        files = synthetic_files(builds, types)
+        t_index, r_index = measure(indexed, files, args.regex, types)
+
+        if builds <= args.scan_max:
+            t_scan, r_scan = measure(scan, files, args.regex, types, repeat=1)
+            assert r_scan == r_index, 'results differ: {} != {}'.format(r_scan, r_index)
+            print('{:>8} {:>8} {:>12.4f} {:>12.4f} {:>7.0f}x'.format(builds, len(files), t_scan, t_index, t_scan / t_index))
+        else:
+            print('{:>8} {:>8} {:>12} {:>12.4f} {:>8}'.format(builds, len(files), '-', t_index, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,9 +19,13 @@ from flashtool.configmanager import ConfigManager
 from flashtool.server import cfgserver
 from flashtool.setup import Setup
 import flashtool.utility as util
-from flashtool.server.buildserver import Buildserver, BuildserverConnectionError
+from flashtool.server.buildserver import get_buildserver, BuildserverConnectionError
+from flashtool.server.mirror import Mirror
+from flashtool.server.watch import Watcher
 import flashtool.setup.udev.mmc as udev
 from flashtool.setup.constants import mkfs_check
+import flashtool.setup.devlayout.bmap as bmap
+from flashtool.setup.deploy.personalise import load_card_params, personalise_device
 
 __author__ = 'mahieke'
 
@@ -62,12 +66,28 @@ class Flashtool():
             'help': [
                 '  Address or URL to a buildbot server. Optional Port must be set as next parameter.',
                 '  Port of the web frontend of the buildbot server'
-            ]},
+            ],
+            'optional': OrderedDict([
+                ('api', ('0.8', '  API of the buildbot server: 0.8 (json interface) or 2 (REST API of buildbot nine)')),
+                ('workers', ('8', '  Number of parallel requests to the buildbot server')),
+                ('batch_size', ('50', '  Number of builds which are requested from the buildbot server at once')),
+                ('pool_size', ('8', '  Number of keep-alive connections to the buildbot server')),
+                ('timeout', ('10', '  Timeout in seconds for requests to the buildbot server')),
+                ('retries', ('3', '  Number of retries for failed requests to the buildbot server')),
+                ('segments', ('4', '  Number of parallel connections for downloads of large files')),
+            ])},
         'Local': {
             'keywords': ['products'],
             'help': [
                 '  Local path where flashtool should save downloaded products if option is selected.'
-            ]},
+            ],
+            'optional': OrderedDict([
+                ('cache_quota', ('0', '  Maximum size of downloaded products (e.g. 20GB). Least recently used '
+                                      'products will be deleted. Products saved to the local path (-L) are '
+                                      'never deleted. 0 means no limit.')),
+                ('golden_images', ('3', '  Number of golden images (setup --golden) which are kept. '
+                                        '0 means no limit.')),
+            ])},
     }
 
     platform_cfg = 'platforms'
@@ -164,7 +184,19 @@ class Flashtool():
                                              'If none is selected, information for all platforms will be printed.'
         )
         list_builds_parser.add_argument('--limit', metavar='N',
-                                        help='Print top N entries'
+                                        type=int,
+                                        help='Print only the newest N builds of each product. The history on the '
+                                             'server is scanned from the newest build and stops early.'
+        )
+        list_builds_parser.add_argument('-o', '--offline',
+                                        action='store_true',
+                                        default=False,
+                                        help='Do not contact the buildbot server. The builds are listed from the '
+                                             'information of former runs.'
+        )
+        list_builds_parser.add_argument('--max-age', metavar='DAYS',
+                                        type=float,
+                                        help='Print only builds which are not older than DAYS days.'
         )
 
         # list_builds_parser.add_argument('-w', '--where',
@@ -204,14 +236,13 @@ class Flashtool():
 
         setup_group_general = setup_parser.add_argument_group('General options')
 
-        # setup_group_general.add_argument('-s', '--source',
-        #                                 choices=['local', 'remote'],
-        #                                 default='remote',
-        #                                 nargs='?',
-        #                                 help='Select if product should be fetched from a local directory or from '
-        #                                      'the buildbot build server. The path or URL to the local directory or '
-        #                                      'server must be defined in the configuration file \'flashtool.cfg\'.'
-        # )
+        setup_group_general.add_argument('-s', '--source',
+                                         choices=['local', 'remote'],
+                                         default='remote',
+                                         help='Select if product should be fetched from a local directory or from '
+                                              'the buildbot build server. The path or URL to the local directory or '
+                                              'server must be defined in the configuration file \'flashtool.cfg\'.'
+        )
 
         setup_group_general.add_argument('-a', '--auto', action='store_true',
                                          default=False,
@@ -227,6 +258,47 @@ class Flashtool():
                                               'the directory which is configured in the cfg file (Attribute Local).'
         )
 
+        setup_group_general.add_argument('-o', '--offline',
+                                         action='store_true',
+                                         default=False,
+                                         help='Do not contact the buildbot server. Only products which were '
+                                              'downloaded before can be used.'
+        )
+
+        setup_group_general.add_argument('-S', '--stream',
+                                         action='store_true',
+                                         default=False,
+                                         help='Tarballs which are extracted on a partition are streamed from the '
+                                              'server directly on the partition without storing them first. '
+                                              'Products which are already downloaded are read from disk.'
+        )
+
+        setup_group_general.add_argument('-i', '--image', metavar='FILE',
+                                         help='Run the recipe into a sparse image file instead of a mmc device. '
+                                              'No mmc device is needed, the image can be written to mmc devices '
+                                              'afterwards.'
+        )
+
+        setup_group_general.add_argument('-G', '--golden',
+                                         action='store_true',
+                                         default=False,
+                                         help='Build an image of the recipe and the selected products once and '
+                                              'write it to the mmc device. Later setups with the same recipe and '
+                                              'products only write the cached image and give the filesystems new '
+                                              'uuids.'
+        )
+
+        setup_group_general.add_argument('-c', '--card', metavar='FILE',
+                                         help='Yaml file with the values of the card (hostname, root_password, '
+                                              'root_password_hash, machine_id, uuids). Without it the user is '
+                                              'asked for the root password.'
+        )
+
+        setup_group_general.add_argument('--image-size', metavar='SIZE',
+                                         help='Size of the image file, e.g. "4G". Needed if a partition of the '
+                                              'recipe has the size max. Default is the sum of the partitions.'
+        )
+
         setup_group1 = setup_parser.add_argument_group('Product Group 1 [linux, uboot, misc]',
                                                        description='The argument of an option will be interpreted as '
                                                                    'regex .*{string}.*. If this string matches for '
@@ -273,6 +345,199 @@ class Flashtool():
 
         setup_parser.set_defaults(func=self.__setup)
 
+        # station
+        station_parser = subparser.add_parser('station',
+                                              help='Setup all cards which are plugged into the card readers of a '
+                                                   'flashing station in parallel. The products are downloaded once '
+                                                   'for all cards.'
+        )
+        station_parser.add_argument('platform',
+                                    help='Specifies the platform which should be setuped'
+        )
+        station_parser.add_argument('-d', '--devices', metavar='DEVICE',
+                                    nargs='+',
+                                    help='Dev paths of the cards. If none are given, all removable disks and SD '
+                                         'cards are used which have no mounted partition.'
+        )
+        station_parser.add_argument('-j', '--jobs', metavar='N',
+                                    type=int,
+                                    help='Number of cards which are set up at once. Default is all cards.'
+        )
+        station_parser.add_argument('-s', '--source',
+                                    choices=['local', 'remote'],
+                                    default='remote',
+                                    help='Select if product should be fetched from a local directory or from '
+                                         'the buildbot build server.'
+        )
+        station_parser.add_argument('-a', '--auto', action='store_true',
+                                    default=False,
+                                    help='Fetch the latest file if an argument for a product matches for multiple '
+                                         'files. The cards are overwritten without asking only if they are given '
+                                         'with -d.'
+        )
+        station_parser.add_argument('-L', '--Local',
+                                    action='store_true',
+                                    default=False,
+                                    help='Store all downloaded files at the directory which is configured in the '
+                                         'cfg file (Attribute Local).'
+        )
+        station_parser.add_argument('-o', '--offline',
+                                    action='store_true',
+                                    default=False,
+                                    help='Do not contact the buildbot server.'
+        )
+        station_parser.add_argument('-G', '--golden',
+                                    action='store_true',
+                                    default=False,
+                                    help='Build an image of the recipe and the selected products once and write '
+                                         'it to all cards (see \'setup --golden\').'
+        )
+        station_parser.add_argument('-c', '--card', metavar='FILE',
+                                    action='append',
+                                    help='Yaml file with the values of a card. A single file is used for all cards, '
+                                         'each card gets the hostname of the file with the suffix -SLOT, a random '
+                                         'machine id and new filesystem uuids. Otherwise the option is given once '
+                                         'per card in the order of the slots. '
+                                         'Without it the user is asked once for the root password.'
+        )
+        station_parser.add_argument('--image-size', metavar='SIZE',
+                                    help='Size of the golden image, e.g. "4G".'
+        )
+
+        station_products_group = station_parser.add_argument_group('Products',
+                                                                   description='Select products like for '
+                                                                               '\'setup\'. The default value for '
+                                                                               'an option is \'\'')
+        station_products_group.add_argument('-l', '--linux', metavar='version', default='',
+                                            help='Set linux kernel version.')
+        station_products_group.add_argument('-u', '--uboot', metavar='version', default='',
+                                            help='Set uboot version.')
+        station_products_group.add_argument('-m', '--misc', metavar='version', default='', help='Select misc files.')
+        station_products_group.add_argument('-r', '--rootfs', metavar='name', default='', help='Select rootfs')
+
+        station_parser.set_defaults(func=self.__station)
+
+        # mirror
+        mirror_parser = subparser.add_parser('mirror',
+                                             help='Download products from the buildbot server into the local products '
+                                                  'directory, which can be used with \'setup --source local\'.'
+        )
+        mirror_parser.add_argument('platform',
+                                   metavar='platform',
+                                   nargs='?',
+                                   help='Specify a platform name. If none is selected, products for all platforms '
+                                        'will be mirrored.'
+        )
+        mirror_parser.add_argument('--limit', metavar='N',
+                                   type=int,
+                                   default=1,
+                                   help='Mirror the newest N builds of each product. 0 mirrors all builds. '
+                                        'Default is 1.'
+        )
+        mirror_parser.add_argument('--regex',
+                                   help='Mirror only products whose path on the server matches the regular expression.'
+        )
+        mirror_parser.add_argument('-j', '--jobs', metavar='N',
+                                   type=int,
+                                   default=2,
+                                   help='Number of parallel downloads. Default is 2.'
+        )
+        mirror_parser.add_argument('--prune',
+                                   action='store_true',
+                                   default=False,
+                                   help='Remove products of the mirrored platforms which were not selected.'
+        )
+
+        mirror_products_group = mirror_parser.add_argument_group('Products (optional)',
+                                                                  description='Select products which should be '
+                                                                              'mirrored. If none is selected, all '
+                                                                              'products will be mirrored.')
+        mirror_products_group.add_argument('-l', '--linux', action='store_true', help='Mirror linux kernels.')
+        mirror_products_group.add_argument('-u', '--uboot', action='store_true', help='Mirror uboot.')
+        mirror_products_group.add_argument('-r', '--rootfs', action='store_true', help='Mirror rootfs.')
+        mirror_products_group.add_argument('-m', '--misc', action='store_true', help='Mirror misc files.')
+
+        mirror_parser.set_defaults(func=self.__mirror)
+
+        # watch
+        watch_parser = subparser.add_parser('watch',
+                                            help='Poll the buildbot server and download new builds of the configured '
+                                                 'platforms in the background, so \'setup\' starts with filled caches.'
+        )
+        watch_parser.add_argument('platform',
+                                  metavar='platform',
+                                  nargs='?',
+                                  help='Specify a platform name. If none is selected, all platforms with a recipe '
+                                       'file will be watched.'
+        )
+        watch_parser.add_argument('--interval', metavar='SECONDS',
+                                  type=int,
+                                  default=300,
+                                  help='Seconds between two checks of the server. Default is 300.'
+        )
+        watch_parser.add_argument('--limit', metavar='N',
+                                  type=int,
+                                  default=1,
+                                  help='Keep the newest N builds of each product downloaded. Default is 1.'
+        )
+        watch_parser.add_argument('--once',
+                                  action='store_true',
+                                  default=False,
+                                  help='Check the server only once, e.g. for a cron job.'
+        )
+        watch_parser.add_argument('-j', '--jobs', metavar='N',
+                                  type=int,
+                                  default=2,
+                                  help='Number of parallel downloads. Default is 2.'
+        )
+        watch_parser.add_argument('-L', '--Local',
+                                  action='store_true',
+                                  default=False,
+                                  help='Download the files into the local products directory (like \'setup -L\') '
+                                       'instead of the temporary directory.'
+        )
+
+        watch_products_group = watch_parser.add_argument_group('Products (optional)',
+                                                                description='Select products which should be '
+                                                                            'watched. If none is selected, all '
+                                                                            'products will be watched.')
+        watch_products_group.add_argument('-l', '--linux', action='store_true', help='Watch linux kernels.')
+        watch_products_group.add_argument('-u', '--uboot', action='store_true', help='Watch uboot.')
+        watch_products_group.add_argument('-r', '--rootfs', action='store_true', help='Watch rootfs.')
+        watch_products_group.add_argument('-m', '--misc', action='store_true', help='Watch misc files.')
+
+        watch_parser.set_defaults(func=self.__watch)
+
+        # write_image
+        write_image_parser = subparser.add_parser('write_image',
+                                                  help='Write an image file which was created with \'setup --image\' '
+                                                       'to a mmc device. Only blocks with data are written.'
+        )
+        write_image_parser.add_argument('image',
+                                        help='Path of the image file'
+        )
+        write_image_parser.add_argument('-d', '--device',
+                                        help='Path of the target device. If none is given, the mmc device is '
+                                             'recognized like in \'setup\'.'
+        )
+        write_image_parser.add_argument('-c', '--card', metavar='FILE',
+                                        help='Personalise the card after writing with the values of the yaml file '
+                                             '(hostname, root_password, root_password_hash, machine_id, uuids).'
+        )
+        write_image_parser.add_argument('--no-verify',
+                                        action='store_true',
+                                        default=False,
+                                        help='Do not compare the checksums of the block map while writing.'
+        )
+        write_image_parser.add_argument('--zero',
+                                        action='store_true',
+                                        default=False,
+                                        help='Zero the unmapped ranges of the device. Only needed for images which '
+                                             'were not created by flashtool, it writes the whole size of the image.'
+        )
+
+        write_image_parser.set_defaults(func=self.__write_image)
+
         fs_check_parser = subparser.add_parser('check_mmc',
                                             help='Filesystem check on partitions of a mmc device'
         )
@@ -347,7 +612,8 @@ class Flashtool():
         if section not in list(self.flashtool_conf.keys()):
             raise KeyError('Section {} is not valid for flashtool config.'.format(section))
 
-        if option not in self.flashtool_conf[section]['keywords']:
+        if option not in self.flashtool_conf[section]['keywords'] and \
+                option not in self.flashtool_conf[section].get('optional', {}):
             raise KeyError('Option {} is not valid for the section {} of the flashtool config'.format(option, section))
 
         try:
@@ -411,11 +677,15 @@ class Flashtool():
             action_values = ['linux', 'uboot', 'rootfs', 'misc']
 
 
-        print('  Retrieving information from Server {}:{}...'.format(self.get_conf('Buildbot','server'), self.get_conf('Buildbot', 'port')))
-        buildbot = Buildserver(self.get_conf('Buildbot', 'server'), self.get_conf('Buildbot', 'port'),
-                               list(map(lambda entry: entry[0], self.get_platforms())))
+        if args.offline:
+            print('  Retrieving information of Server {}:{} from cache...'.format(self.get_conf('Buildbot','server'), self.get_conf('Buildbot', 'port')))
+        else:
+            print('  Retrieving information from Server {}:{}...'.format(self.get_conf('Buildbot','server'), self.get_conf('Buildbot', 'port')))
+        buildbot = get_buildserver(self.conf['Buildbot'], list(map(lambda entry: entry[0], self.get_platforms())),
+                                   cache_dir=self.working_dir, offline=args.offline)
 
-        build_info = buildbot.get_builds_info()
+        max_age = args.max_age * 24 * 60 * 60 if args.max_age is not None else None
+        build_info = buildbot.get_builds_info(limit=args.limit, max_age=max_age, products=action_values)
         print('  Processing json information...');
         builds = buildbot.get_build_info(build_info, action_values, args.platform)
 
@@ -449,6 +719,73 @@ class Flashtool():
 
                 print('')
 
+    def __mirror(self, args):
+        '''
+        Downloads products from the buildbot server into the local products directory.
+        :param args: Parsed arguments from argparse
+        :return: None
+        '''
+        self.check_working_dir()
+        actions = self.__get_args(args, ['linux', 'uboot', 'misc', 'rootfs'])
+        action_values = [a for a in actions if getattr(args, a)]
+
+        if not action_values:
+            action_values = ['linux', 'uboot', 'rootfs', 'misc']
+
+        dest = self.get_conf('Local', 'products')
+        if not os.path.exists(dest):
+            os.makedirs(dest, mode=0o777)
+
+        print('  Mirror products of Server {}:{} to {}...'.format(self.get_conf('Buildbot', 'server'),
+                                                                 self.get_conf('Buildbot', 'port'), dest))
+        buildbot = get_buildserver(self.conf['Buildbot'], list(map(lambda entry: entry[0], self.get_platforms())),
+                                   dest, self.working_dir)
+
+        result = Mirror(buildbot, args.jobs).mirror(action_values, args.platform, args.limit or None,
+                                                    args.regex, args.prune)
+
+        print('')
+        print(Fore.GREEN + '  {} downloaded, {} already present, {} removed'
+              .format(len(result['downloaded']), len(result['present']), len(result['pruned'])))
+        if result['failed']:
+            print(Fore.RED + '  {} failed:'.format(len(result['failed'])))
+            for path in result['failed']:
+                print(Fore.RED + '    {}'.format(path))
+
+    def __watch(self, args):
+        '''
+        Polls the buildbot server and downloads new builds into the cache which is used by setup.
+        :param args: Parsed arguments from argparse
+        :return: None
+        '''
+        self.check_working_dir()
+        actions = self.__get_args(args, ['linux', 'uboot', 'misc', 'rootfs'])
+        action_values = [a for a in actions if getattr(args, a)]
+
+        if not action_values:
+            action_values = ['linux', 'uboot', 'rootfs', 'misc']
+
+        platforms = list(map(lambda entry: entry[0], self.get_platforms()))
+        if args.platform and args.platform not in platforms:
+            print(Fore.RED + 'Failure')
+            print('  The given platform {} is not configured with a recipe file.'.format(args.platform))
+            exit(1)
+
+        dest = None
+        if args.Local:
+            dest = self.get_conf('Local', 'products')
+            if not os.path.exists(dest):
+                os.makedirs(dest, mode=0o777)
+
+        print('  Watch Server {}:{} for new builds of {} every {} seconds...'
+              .format(self.get_conf('Buildbot', 'server'), self.get_conf('Buildbot', 'port'),
+                      args.platform or ', '.join(platforms), args.interval))
+        buildbot = get_buildserver(self.conf['Buildbot'], platforms, dest, self.working_dir,
+                                   util.to_byte(self.get_conf('Local', 'cache_quota')))
+
+        watcher = Watcher(buildbot, action_values, args.limit or None, args.interval, args.jobs, args.platform)
+        watcher.run(1 if args.once else None)
+
     def __setup(self, args):
         '''
         Setup routine entry point. Will check the command line input first and starts
@@ -464,18 +801,87 @@ class Flashtool():
                           args.platform, args.auto)
         )
 
+        yaml_path = self.__get_recipe_file(args.platform)
+        if not yaml_path:
+            return
+
+        if args.source == 'local':
+            url = {'dir': self.get_conf('Local', 'products')}
+        else:
+            url = self.conf['Buildbot']
+
+        user_dest = None
+        if args.Local:
+            user_dest = self.get_conf('Local', 'products')
+            if not os.path.exists(user_dest):
+                os.mkdir(user_dest, mode=0o777)
+
+        setup = Setup(url, action_values, yaml_path, args.auto, args.platform, user_dest, self.working_dir,
+                      util.to_byte(self.get_conf('Local', 'cache_quota')), args.stream, args.offline,
+                      args.image, util.to_byte(args.image_size) if args.image_size else None, args.golden,
+                      int(self.get_conf('Local', 'golden_images')),
+                      load_card_params(args.card) if args.card else None)
+        setup.setup()
+
+    def __station(self, args):
+        '''
+        Sets up all cards of a flashing station in parallel.
+        :param args: Parsed arguments from argparse
+        :return: None
+        '''
+        from flashtool.setup.station import Station, StationError
+
+        self.check_working_dir()
+        action_values = self.__get_args(args, ['linux', 'uboot', 'misc', 'rootfs'])
+
+        yaml_path = self.__get_recipe_file(args.platform)
+        if not yaml_path:
+            return
+
+        if args.source == 'local':
+            url = {'dir': self.get_conf('Local', 'products')}
+        else:
+            url = self.conf['Buildbot']
+
+        user_dest = None
+        if args.Local:
+            user_dest = self.get_conf('Local', 'products')
+            if not os.path.exists(user_dest):
+                os.mkdir(user_dest, mode=0o777)
+
+        try:
+            station = Station(url, action_values, yaml_path, args.auto, args.platform, args.devices, user_dest,
+                              self.working_dir, util.to_byte(self.get_conf('Local', 'cache_quota')), args.offline,
+                              args.golden, int(self.get_conf('Local', 'golden_images')),
+                              util.to_byte(args.image_size) if args.image_size else None,
+                              [load_card_params(card) for card in args.card] if args.card else None, args.jobs)
+            results = station.setup()
+        except StationError as e:
+            print(Fore.RED + '{}'.format(e.message))
+            exit(1)
+
+        if any(result['state'] != 'done' for result in results):
+            exit(1)
+
+    def __get_recipe_file(self, platform):
+        '''
+        Returns the recipe file of a platform. The user is prompted to select a
+        recipe if there are multiple files for the platform.
+        :param platform: name of the platform
+        :return: path of the recipe file, None if there is none
+        '''
         supported_platforms = self.get_platforms()
 
         try:
-            match = next(filter(lambda f: f == args.platform, map(lambda x: x[0], supported_platforms)))
+            match = next(filter(lambda f: f == platform, map(lambda x: x[0], supported_platforms)))
         except StopIteration:
             print(Fore.RED + 'Failure')
-            print('  The given platform {} is not configured with a recipe file.'.format(args.platform))
+            print('  The given platform {} is not configured with a recipe file.'.format(platform))
             exit(1)
 
         if not match:
             print(Fore.RED + 'FAILURE:')
-            print(Fore.RED + 'Recipe for platform "{}" could not be found.'.format(args.platform))
+            print(Fore.RED + 'Recipe for platform "{}" could not be found.'.format(platform))
             message = ''
             if supported_platforms:
                 message += 'You have to execute command ' + Fore.YELLOW + '"conf update"'
@@ -485,19 +891,19 @@ class Flashtool():
             message += Fore.RESET + ' to get the latest recipes from the repository.'
             print(message)
 
-            message = 'Or you must define a new recipe file ' + Fore.YELLOW + "{}.yml".format(args.platform)
+            message = 'Or you must define a new recipe file ' + Fore.YELLOW + "{}.yml".format(platform)
             message += Fore.RESET + ' at directory ' + Fore.YELLOW + '"{}/{}" or repository "{}".' \
                 .format(self.working_dir, self.platform_cfg, self.get_conf('Recipes', 'server'))
 
             print(message)
 
-            return
+            return None
         else:
-            platform, files = next(filter(lambda f: f[0] == args.platform, supported_platforms))
+            platform, files = next(filter(lambda f: f[0] == platform, supported_platforms))
             if len(files) == 1:
                     yaml_path = files[0]
             elif len(files) > 1:
-                print('There are multiple recipe files for platform {}.'.format(args.platform))
+                print('There are multiple recipe files for platform {}.'.format(platform))
                 i = 0
                 for t in files:
                     print('{}:  {}'.format(i, files[i]))
@@ -507,24 +913,9 @@ class Flashtool():
             else:
                 print(Fore.RED + 'ERROR:')
                 print('Unexpected Error occured: THIS SHOULD NEVER HAPPEN!!!')
+                return None
 
-
-        # if args.source == 'local':
-        #     url = {'dir': self.conf['Local']['products']}
-        #     # TODO: delete statement when implemented
-        #     print(Fore.RED + 'Option \'-s local\' \'--source local\' is not implemented yet!')
-        #     exit(1)
-        # else:
-        url = self.conf['Buildbot']
-
-        user_dest = None
-        if args.Local:
-            user_dest = self.get_conf('Local', 'products')
-            if not os.path.exists(user_dest):
-                os.mkdir(user_dest, mode=0o777)
-
-        setup = Setup(url, action_values, yaml_path, args.auto, args.platform, user_dest)
-        setup.setup()
+        return yaml_path
 
     def __list_platforms(self, args):
         '''
@@ -616,6 +1007,51 @@ class Flashtool():
         return retVal
 
 
+    def __write_image(self, args):
+        '''
+        Writes the mapped blocks of an image file to a mmc device.
+        :param args: Parsed arguments from argparse
+        :return: None
+        '''
+        if not os.path.isfile(args.image):
+            print(Fore.RED + 'Image file {} does not exist.'.format(args.image))
+            exit(1)
+
+        bmap_file = bmap.bmap_path(args.image)
+        if os.path.isfile(bmap_file):
+            block_map = bmap.load_bmap(bmap_file)
+        else:
+            print(Fore.YELLOW + '  Image has no block map, create {}...'.format(bmap_file))
+            block_map = bmap.generate_bmap(args.image)
+            bmap.save_bmap(block_map, bmap_file)
+
+        if args.device:
+            device = args.device
+            answer = util.user_prompt('Do you want to continue? This will overwrite {}'.format(device),
+                                      'Answer', 'YyNn')
+            if re.match('[Nn]', answer):
+                print(Fore.RED + 'ABORT!')
+                exit(0)
+        else:
+            device = udev.get_mmc_device()[0]['path']
+
+        mapped = block_map['mapped'] / (1024.0 * 1024.0)
+        print('  Write {:.1f} of {:.1f} MBytes of {} to {}'
+              .format(mapped, block_map['image_size'] / (1024.0 * 1024.0), args.image, device))
+
+        def reporthook(written, total):
+            print('\r  {:.1f}/{:.1f} MBytes'.format(written / (1024.0 * 1024.0), mapped), end='')
+
+        bmap.write_image(args.image, device, block_map, verify=not args.no_verify, reporthook=reporthook,
+                         zero=args.zero)
+        print('')
+
+        if args.card:
+            from flashtool.setup.devlayout.blockdev import get_partitions
+            print(Fore.YELLOW + '  Personalise {}'.format(device))
+            personalise_device(get_partitions(device), load_card_params(args.card))
+        print(Fore.GREEN + '  Image written!')
+
     def __fs_check(self,args):
         '''
         Routine to check the filesystem of the partitions of a device.
@@ -40,6 +40,7 @@ class ConfigManager():
             self.__parser.read(self.file)
 
             if self.__is_valid_config(config_options):
+                self.__set_defaults(config_options)
                 return self.__parser
 
 
@@ -74,12 +75,20 @@ class ConfigManager():
                 self.__parser.add_section(section)
 
             options = config_options[section]['keywords']
+            optional = config_options[section].get('optional', {})
             log.info('  Required options for section [{:15}]: {}'.format(section, ','.join(options)))
 
-            if self.__delete_unused_options(options, section):
+            if self.__delete_unused_options(options + list(optional.keys()), section):
                 changed = True
 
-            for option in zip(options, config_options[section]['help']):
+            for option, default in optional.items():
+                if not self.__parser.has_option(section, option):
+                    log.info('  Optional option "{}" is not set: DEFAULT {}'.format(option, default[0]))
+                    self.__parser.set(section, option, default[0])
+                    changed = True
+
+            helps = config_options[section]['help'] + [v[1] for v in optional.values()]
+            for option in zip(options + list(optional.keys()), helps):
                 value = self.__parser.get(section, option[0], fallback=None)
                 if value is not None:
                     if overwrite:
@@ -146,6 +155,21 @@ class ConfigManager():
         return is_valid
 
 
+    def __set_defaults(self, config_options):
+        '''
+        Sets the default value for every optional option which is not
+        given in the config.
+
+        :param config_options: Dict with tuples of section:[options...]
+        :return: None
+        '''
+        for section in config_options.keys():
+            for option, default in config_options[section].get('optional', {}).items():
+                if not self.__parser.has_option(section, option):
+                    log.debug('  Option [{}]->{} is not set, use default "{}"'.format(section, option, default[0]))
+                    self.__parser.set(section, option, default[0])
+
+
     def __delete_unused_options(self, used_options, section):
         '''
         Deletes all options of a section which are unused
@@ -0,0 +1,205 @@
+__author__ = 'mahieke'
+
+import hashlib
+import json
+import logging as log
+import os
+import threading
+import time
+from collections import Counter
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256sum(path):
+    '''
+    Returns the sha256 hex digest of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ArtifactCache():
+    '''
+    Managed store for downloaded artifacts below a root directory. The index
+    {root}/.cache_index records size, sha256 digest, mtime and last usage of every
+    artifact. A digest is only computed again if the mtime of the file changed,
+    so reusing a verified artifact costs one stat call.
+
+    Artifacts with the same content are stored only once (hard links), and the
+    least recently used artifacts are evicted if the cache exceeds its quota.
+    '''
+    def __init__(self, root, quota=0):
+        '''
+        :param root: directory which holds the artifacts
+        :param quota: maximum size of the cache in bytes, 0 for no limit
+        '''
+        self.root = root.rstrip('/')
+        self.quota = quota
+        self.index_file = '{}/.cache_index'.format(self.root)
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.RLock()
+
+        if os.path.isfile(self.index_file) and os.path.getsize(self.index_file) > 0:
+            try:
+                with open(self.index_file) as f:
+                    self.entries = json.load(f)
+            except ValueError as e:
+                log.warning('Cache index {} is corrupt and will be rebuilt: {}'.format(self.index_file, e))
+
+    def path(self, artifact):
+        return '{}/{}'.format(self.root, artifact)
+
+    def lookup(self, artifact, size=None):
+        '''
+        Returns the local path of a cached artifact if it is intact, otherwise None.
+        A broken artifact is removed from the cache.
+
+        :param artifact: path of the artifact relative to the root directory
+        :param size: expected size of the artifact, None if unknown
+        :return: local path or None
+        '''
+        path = self.path(artifact)
+
+        with self.lock:
+            if not os.path.isfile(path):
+                self.__remove_entry(artifact)
+                return None
+
+            stat = os.stat(path)
+            entry = self.entries.get(artifact)
+
+            if size is not None and stat.st_size != size:
+                log.warning('Cached artifact {} has size {} instead of {}'.format(artifact, stat.st_size, size))
+                self.remove(artifact)
+                return None
+
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                digest = sha256sum(path)
+
+                if entry is not None and entry['sha256'] != digest:
+                    log.warning('Cached artifact {} does not match its digest'.format(artifact))
+                    self.remove(artifact)
+                    return None
+
+                if entry is None and size is None:
+                    # nothing to verify an unknown file against
+                    return None
+
+                self.entries[artifact] = {'size': stat.st_size, 'sha256': digest, 'mtime': stat.st_mtime}
+
+            self.entries[artifact]['last_used'] = time.time()
+            self.changed = True
+
+        return path
+
+    def add(self, artifact, digest=None):
+        '''
+        Records a new artifact, which was stored at path(artifact). If an artifact with
+        the same content is already cached, the new file is replaced by a hard link.
+
+        :param artifact: path of the artifact relative to the root directory
+        :param digest: sha256 digest of the artifact if already known
+        :return: local path of the artifact
+        '''
+        path = self.path(artifact)
+        if digest is None:
+            digest = sha256sum(path)
+
+        with self.lock:
+            same = self.find(digest)
+            if same and same != artifact:
+                try:
+                    tmp = '{}.link'.format(path)
+                    os.link(self.path(same), tmp)
+                    os.replace(tmp, path)
+                except OSError as e:
+                    log.debug('Could not link {} to {}: {}'.format(artifact, same, e))
+
+            stat = os.stat(path)
+            self.entries[artifact] = {
+                'size': stat.st_size,
+                'sha256': digest,
+                'mtime': stat.st_mtime,
+                'last_used': time.time(),
+            }
+            self.changed = True
+
+            self.evict(keep=[artifact])
+
+        return path
+
+    def digest(self, artifact):
+        entry = self.entries.get(artifact)
+        return entry['sha256'] if entry else None
+
+    def find(self, digest):
+        '''
+        Returns an artifact with the given digest or None.
+        '''
+        for artifact, entry in self.entries.items():
+            if entry['sha256'] == digest and os.path.isfile(self.path(artifact)):
+                return artifact
+
+        return None
+
+    def remove(self, artifact):
+        with self.lock:
+            path = self.path(artifact)
+            if os.path.isfile(path):
+                os.remove(path)
+            self.__remove_entry(artifact)
+
+    def size(self):
+        '''
+        Returns the size of all cached artifacts. Hard linked artifacts are counted once.
+        '''
+        return sum({e['sha256']: e['size'] for e in self.entries.values()}.values())
+
+    def evict(self, keep=()):
+        '''
+        Removes least recently used artifacts until the cache fits into its quota.
+
+        :param keep: artifacts which must not be removed
+        '''
+        if not self.quota:
+            return
+
+        with self.lock:
+            # hard linked artifacts only free their space with the last link
+            links = Counter(e['sha256'] for e in self.entries.values())
+            total = self.size()
+
+            for artifact, entry in sorted(self.entries.items(), key=lambda e: e[1].get('last_used', 0)):
+                if total <= self.quota:
+                    break
+                if artifact in keep:
+                    continue
+
+                log.info('Evict artifact {} from cache'.format(artifact))
+                self.remove(artifact)
+                links[entry['sha256']] -= 1
+                if not links[entry['sha256']]:
+                    total -= entry['size']
+
+    def save(self):
+        if not self.changed:
+            return
+
+        with self.lock:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = '{}.tmp'.format(self.index_file)
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.index_file)
+            self.changed = False
+
+    def __remove_entry(self, artifact):
+        if artifact in self.entries:
+            del self.entries[artifact]
+            self.changed = True
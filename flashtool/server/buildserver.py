@@ -1,20 +1,43 @@
 __author__ = 'mahieke'
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import *
+from requests.packages.urllib3.util.retry import Retry
 from colorama import Fore
 import logging as log
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import base64
+import binascii
+import copy
+import hashlib
 import os
 import re
 import sys
-from urllib.request import urlretrieve
-from urllib.request import urlopen
-from urllib.error import HTTPError
-from urllib.error import URLError
+import threading
+import time
 import json
 
 import flashtool.utility as util
+from flashtool.server.catalog import BuildCatalog, ArtifactCatalog, ResponseCache, DirectoryIndex
+from flashtool.server.artifactcache import ArtifactCache
+
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_RETRIES = 3
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_MAX_BACKOFF = 30
+DEFAULT_SEGMENTS = 4
+SEGMENT_MIN_SIZE = 64 * 1024 * 1024
+PREFETCH_WORKERS = 2
+DEFAULT_API = '0.8'
+# files of unfinished downloads and of the artifact cache
+PARTIAL_SUFFIXES = ('.part', '.segments', '.tmp', '.link')
+# products of the platform builders, rootfs products have builders of their own
+BUILD_PRODUCTS = ['linux', 'uboot', 'misc']
 
 
 class BuildserverConnectionError(Exception):
@@ -41,8 +64,296 @@ class BuildserverFilesNotFound(Exception):
         return repr(self.message)
 
 
-class Buildserver():
-    def __init__(self, address, port, configured_platforms, dest=None):
+class ArtifactStream():
+    '''
+    Readable file object for an artifact which computes size and sha256 digest
+    of the data while it is read.
+    '''
+    def __init__(self, fileobj, name, size=None, digest=None, on_close=None, on_verified=None):
+        '''
+        :param fileobj: underlying file object
+        :param name: name of the artifact
+        :param size: expected size, None if unknown
+        :param digest: expected sha256 digest, None if unknown
+        :param on_close: function which is called on close
+        :param on_verified: function(digest) which is called after a successful verify
+        '''
+        self.fileobj = fileobj
+        self.name = name
+        self.size = size
+        self.digest = digest
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+        self.on_close = on_close
+        self.on_verified = on_verified
+
+    def read(self, n=-1):
+        data = self.fileobj.read(n)
+        self.received += len(data)
+        self.sha256.update(data)
+        return data
+
+    def verify(self):
+        '''
+        Reads the rest of the stream and checks size and digest of the artifact.
+        Raises BuildserverPackageError if they do not match.
+
+        :return: sha256 hex digest of the artifact
+        '''
+        while self.read(DOWNLOAD_CHUNK_SIZE):
+            pass
+
+        if self.size is not None and self.received != self.size:
+            raise BuildserverPackageError('Received {} of {} Bytes of {}'.format(self.received, self.size, self.name))
+
+        digest = self.sha256.hexdigest()
+        if self.digest is not None and digest != self.digest:
+            raise BuildserverPackageError('Digest of {} does not match'.format(self.name))
+
+        if self.on_verified:
+            self.on_verified(digest)
+
+        return digest
+
+    def close(self):
+        self.fileobj.close()
+        if self.on_close:
+            self.on_close()
+
+
+def parse_digest(headers):
+    '''
+    Returns the sha256 hex digest which a server announces in the headers of an
+    artifact (Repr-Digest, Digest or X-Checksum-Sha256), None if there is none.
+
+    :param headers: response headers
+    :return: sha256 hex digest or None
+    '''
+    for header in ('Repr-Digest', 'Digest'):
+        for value in headers.get(header, '').split(','):
+            algorithm, _, encoded = value.strip().partition('=')
+            if algorithm.lower() == 'sha-256':
+                try:
+                    return binascii.hexlify(base64.b64decode(encoded.strip(':'), validate=True)).decode()
+                except (binascii.Error, ValueError):
+                    log.debug('Invalid {} header: {}'.format(header, value))
+
+    checksum = headers.get('X-Checksum-Sha256', '').strip().lower()
+    if re.match('^[0-9a-f]{64}$', checksum):
+        return checksum
+
+    return None
+
+
+def has_enough_builds(found, required, limit, built=()):
+    '''
+    Decides if a scan of a build history, which runs from the newest build
+    downwards, can stop.
+
+    :param found: dictionary {key: [entries]} of the builds which were found
+    :param required: keys which must be found, a scan stops only if each of them
+                     and each key which was found has limit builds
+    :param limit: number of builds per key
+    :param built: products which the builder built before. A required key (platform, product)
+                  is only waited for if its product was built before or in the scan, so a
+                  product which the builder never builds does not make the scan read the
+                  whole history.
+    :return: True if the scan can stop
+    '''
+    products = set(built) | set(key[1] for key in found if isinstance(key, tuple))
+    keys = set(key for key in required if not isinstance(key, tuple) or key[1] in products) | set(found)
+    return bool(keys) and all(len(found.get(key, ())) >= limit for key in keys)
+
+
+def get_buildserver(cfg, configured_platforms, dest=None, cache_dir=None, cache_quota=0, offline=False):
+    '''
+    Creates a Buildserver object from the Buildbot section of the flashtool config.
+
+    :param cfg: Buildbot section of the flashtool config (server, port, api, workers, batch_size,
+                pool_size, timeout, retries, segments)
+    :param configured_platforms: Valid platforms
+    :param dest: Local destination for downloaded files
+    :param cache_dir: Directory for persistent build information (working directory)
+    :param cache_quota: Maximum size in bytes of the downloaded artifacts, 0 for no limit.
+    :param offline: serve everything from the catalogs in cache_dir without contacting the server
+    :return: Buildserver object
+    '''
+    api = str(cfg.get('api', DEFAULT_API)).strip()
+    if api not in BUILDSERVER_APIS:
+        raise BuildserverConnectionError('Buildbot api "{}" is not supported. Supported apis: {}'
+                                         .format(api, ', '.join(BUILDSERVER_APIS.keys())))
+
+    return BUILDSERVER_APIS[api](cfg['server'], cfg['port'], configured_platforms, dest,
+                       workers=int(cfg.get('workers', DEFAULT_WORKERS)),
+                       batch_size=int(cfg.get('batch_size', DEFAULT_BATCH_SIZE)),
+                       pool_size=int(cfg.get('pool_size', DEFAULT_POOL_SIZE)),
+                       timeout=float(cfg.get('timeout', DEFAULT_TIMEOUT)),
+                       retries=int(cfg.get('retries', DEFAULT_RETRIES)),
+                       segments=int(cfg.get('segments', DEFAULT_SEGMENTS)),
+                       cache_dir=cache_dir, cache_quota=cache_quota, offline=offline)
+
+
+class BuildsInfo():
+    '''
+    Collects the files of builds in the nested structure of get_builds_info:
+    {platform: {product: [files]}}, rootfs: {platform: {'rootfs': {name: [files]}}}
+    '''
+    def __init__(self):
+        self.builds = OrderedDict()
+
+    def append_to_builds(self, platform, product, files):
+        if platform and product and files:
+            if self.builds.get(platform):
+                if self.builds[platform].get(product):
+                    self.builds[platform][product].extend(files)
+                else:
+                    self.builds[platform].update({product: list(files)})
+            else:
+                self.builds.update({platform: OrderedDict({product: list(files)})})
+
+    def append_to_rfsbuilds(self, platform, file_type, files):
+        if platform and file_type and files:
+            if self.builds.get(platform):
+                if self.builds[platform].get('rootfs'):
+                    if self.builds[platform]['rootfs'].get(file_type):
+                        self.builds[platform]['rootfs'][file_type].extend(files)
+                    else:
+                        self.builds[platform]['rootfs'].update({file_type: list(files)})
+                else:
+                    self.builds[platform].update({
+                        'rootfs': OrderedDict({file_type: list(files)})
+                    })
+            else:
+                self.builds.update({
+                    platform: OrderedDict({
+                        'rootfs': OrderedDict({
+                            file_type: list(files)
+                        })
+                    })
+                })
+
+
+def load_local_info(path):
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_local_info(path, info):
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp, path)
+
+
+def index_versions(files):
+    '''
+    Creates an index of the versions of a product. A file name consists of
+    version and file type: {version}_{type}.{extension}, e.g.
+    linux/bbb/linux_4.1_12_boot.tar.gz has the version linux/bbb/linux_4.1_12
+    and the type boot.
+
+    :param files: iterable of file names
+    :return: dictionary {version: {type: file}}. The first file of a type wins.
+    '''
+    index = {}
+    for f in files:
+        split = f.rfind('_')
+        types = index.setdefault(f[:split], {})
+        types.setdefault(f[split + 1:].split('.')[0], f)
+
+    return index
+
+
+class FileSelection():
+    '''
+    Selection of the files of a product version, shared by Buildserver and LocalBuilds.
+    '''
+    def get_versions_filterd_by_types(self, files, versions, types):
+        '''
+        Returns a list with versions which provide exactly the given file types.
+        :param files: list of file names
+        :param versions: list of versions
+        :param types: list of file types
+        :return: list of versions
+        '''
+        index = index_versions(files)
+
+        return [version for version in versions if set(index.get(version, {})) == set(types)]
+
+
+    def get_files_path(self, file_info, reg_name, file_types, auto):
+        '''
+        Selects one version per product which matches reg_name and provides all file types.
+
+        :param file_info: information of get_build_info
+        :param reg_name: regex for the version
+        :param file_types: list of tuples (product, [file types])
+        :param auto: flag, take the newest version instead of asking the user
+        :return: list of tuples (product, [(file type, file)])
+        '''
+        selected = {}
+        for platform, products_info in file_info.items():
+            for product, unsorted_files in products_info.items():
+                f_types = next(filter(lambda x: product in x[0], file_types))
+
+                if product == 'rootfs':
+                    files = ['rootfs/{}/{}'.format(k, e) for k,v in unsorted_files.items() for e in v]
+                else:
+                    files = ['{}/{}/{}'.format(product, platform, e) for e in unsorted_files]
+
+                str_match = '.*{}.*'.format(reg_name)
+                re_file = re.compile(str_match)
+                index = index_versions(filter(lambda f_name: re_file.match(f_name), files))
+                wanted = set(f_types[1])
+                versions = sorted(version for version, types in index.items() if set(types) == wanted)
+
+                #sort via date stamp of file
+
+                if len(versions) > 1:
+                    print(
+                    Fore.YELLOW + '  Found multiple versions for product {} with regex {}'.format(product, str_match))
+
+                    if auto:
+                        if product == 'rootfs' and str_match == '.*.*':
+                            print(Fore.GREEN + '  [AUTO-MODE] Take newest factory built.')
+                            filtered_versions = list(filter(lambda x: 'factory' in x,versions))
+                            version = filtered_versions[-1]
+                        else:
+                            # take newest
+                            print(Fore.GREEN + '  [AUTO-MODE] Take newest built.')
+                            version = versions[-1]
+                    else:
+                        i = 0
+                        for f in versions:
+                            print('    [{}]: {}'.format(i, f.split('/')[-1]))
+                            i += 1
+
+                        print('')
+                        selection = int(util.user_select('  [MANUAL-MODE] Please select a file:', 0, i))
+                        version = versions[selection]
+                elif len(versions) == 1:
+                    print(Fore.YELLOW + '  Found one version for product {} with regex {}'.format(product, str_match))
+                    version = versions[0]
+                else:
+                    raise BuildserverFilesNotFound('Could not find files for product {} (types: {}, platform {})'
+                                                   .format(product, f_types[1], platform))
+
+                print(Fore.GREEN + '  -> Selected version: {}:'.format(version.split('/')[-1]))
+                selected[product] = index[version]
+
+        ret_val = []
+        for product, f_types in file_types:
+            ret_val.append((product, [(f_type, selected[product][f_type]) for f_type in f_types]))
+
+        return ret_val
+
+
+class Buildserver(FileSelection):
+    def __init__(self, address, port, configured_platforms, dest=None, workers=DEFAULT_WORKERS,
+                 batch_size=DEFAULT_BATCH_SIZE, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, segments=DEFAULT_SEGMENTS, cache_dir=None, cache_quota=0, offline=False):
         '''
         Interface for a buildbot build server. This class provides methods to get information
         about the builds on the server.
@@ -50,6 +361,19 @@ class Buildserver():
         :param address: Address to the buildbot server.
         :param port: Port for the buildbot server web interface.
         :param configured_platforms: Valid platforms
+        :param dest: Local destination for downloaded files
+        :param workers: Maximum number of parallel requests to the buildbot server
+        :param batch_size: Number of builds which are requested with one request
+        :param pool_size: Number of keep-alive connections to the buildbot server
+        :param timeout: Timeout in seconds for connecting and reading from the buildbot server
+        :param retries: Number of retries for failed requests
+        :param segments: Number of parallel range requests for downloads of large files
+        :param cache_dir: Directory for the persistent build and artifact catalogs. Nothing is
+                          persisted if None.
+        :param cache_quota: Maximum size in bytes of the downloaded artifacts, 0 for no limit.
+                            Files in dest are never evicted.
+        :param offline: Never contact the server. Builds and files are served from the catalogs
+                        and the artifact cache.
         '''
         address = address.rstrip('/').rstrip(':')
         if port is '':
@@ -64,203 +388,506 @@ class Buildserver():
             'builds': None,
         }
         self.configured_platforms = configured_platforms
-
-        try:
-            r = requests.get(self.url, timeout=1)
-            if r.status_code != 200:
-                raise BuildserverConnectionError('Can\'t connect to server. Status code {}'.format(r.status_code))
-        except ConnectionError as e:
-            raise BuildserverConnectionError(
-                'Can\'t connect to server. Response: {}, Request: {}'.format(e.response, e.request))
-        except Timeout as e:
-            raise BuildserverConnectionError('Connection timed out.\n' + Fore.RED + 'Info: {}'.format(e.message))
-
-        log.debug('Buildserver url "{}" is valid.'.format(self.url))
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+
+        self.catalog = None
+        artifacts_file = None
+        responses_file = None
+        if cache_dir:
+            self.catalog = BuildCatalog('{}/.builds'.format(cache_dir.rstrip('/')), self.url)
+            artifacts_file = '{}/.artifacts'.format(cache_dir.rstrip('/'))
+            responses_file = '{}/.http_cache'.format(cache_dir.rstrip('/'))
+
+        self.artifacts = ArtifactCatalog(artifacts_file, self.url)
+        self.responses = ResponseCache(responses_file, self.url)
+
+        # all requests share the keep-alive connections of one session
+        self.timeout = timeout
+        self.retries = retries
+        self.segments = max(1, int(segments))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, pool_size),
+                              pool_maxsize=max(pool_size, self.workers, self.segments),
+                              max_retries=Retry(total=retries, backoff_factor=0.5,
+                                                status_forcelist=(500, 502, 503, 504)))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # the connection is not checked before the first request, so answers from the
+        # catalogs need no server
+        self.offline = offline
 
         self.loaded_files = []
 
+        # background downloads, see prefetch
+        self.fetches = {}
+        self.fetch_lock = threading.Lock()
+        self.fetch_executor = None
+        self.abort = threading.Event()
+
         self.dest = dest
 
+        # downloaded artifacts are managed by the artifact cache. The local products (dest)
+        # are a mirror, not a cache, so only the temporary download cache has a quota.
         if dest:
-            self.json_file = '{}/.platforms'.format(self.dest)
-            if not os.path.exists(self.json_file):
-                open(self.json_file, 'a').close()
-
-            if os.path.getsize(self.json_file) > 0:
-                self.local_platform_info = json.load(open(self.json_file))
-            else:
-                self.local_platform_info = {}
+            self.cache = ArtifactCache(dest.rstrip('/'))
+        else:
+            self.cache = ArtifactCache('/tmp/flashtool', cache_quota)
 
+        if dest:
+            # relations of platforms and rootfs to architectures for LocalBuilds
+            self.json_file = '{}/.platforms'.format(self.dest)
+            self.local_platform_info = load_local_info(self.json_file)
+            self.rootfs_file = '{}/.rootfs'.format(self.dest)
+            self.local_rootfs_info = load_local_info(self.rootfs_file)
 
-    def get_file(self, file_path):
+    def get_file(self, file_path, quiet=False, abort=None):
         '''
         Downloads files from the buildserver to the local destination. If dest is None the default path
-        will be at /tmp.
-        :param files: files per file_type
-        :param dest:
-        :return:
+        will be at /tmp. The file is downloaded to {file}.part first, an interrupted download is resumed
+        with a range request. The file is only moved to its final name if its size matches the size on
+        the server.
+
+        :param file_path: path of the file on the server
+        :param quiet: no output and no progress, used for background downloads
+        :param abort: threading.Event which aborts the download if it is set
+        :return: tuple with local path and size of the file
         '''
+        out = print if not quiet else lambda *args, **kwargs: None
+
+        def reporthook(received, totalsize):
+            now = time.time()
+            if not progress:
+                progress.extend([now, received])
+            elapsed = now - progress[0]
+            rate = (received - progress[1]) / elapsed / (1024.0 * 1024.0) if elapsed > 0 else 0.0
 
-        def reporthook(blocknum, blocksize, totalsize):
-            percentage = (min(100, float(blocknum * blocksize) / totalsize * 100))
+            if totalsize <= 0:
+                print('     {} Bytes ({:.2f} MB/s)'.format(received, rate), end='\r'),
+                sys.stdout.flush()
+                return
+
+            percentage = (min(100, float(received) / totalsize * 100))
 
             if 1023 < totalsize < 1024 * 1024:
                 size = float(totalsize/1024.0)
-                print('     {:3.1f}% of {:5.4f} kBytes'.format(percentage, size), end='\r'),
+                print('     {:3.1f}% of {:5.4f} kBytes ({:.2f} MB/s)'.format(percentage, size, rate), end='\r'),
             elif 1024 * 1024 < totalsize:
                 size = float(totalsize / (1024.0 * 1024.0))
-                print('     {:3.1f}% of {:5.4f} MBytes'.format(percentage, size), end='\r'),
+                print('     {:3.1f}% of {:5.4f} MBytes ({:.2f} MB/s)'.format(percentage, size, rate), end='\r'),
             else:
-                print('     {:3.1f}% of {} Bytes'.format(percentage, totalsize), end='\r'),
+                print('     {:3.1f}% of {} Bytes ({:.2f} MB/s)'.format(percentage, totalsize, rate), end='\r'),
 
             sys.stdout.flush()
 
+        # start time and bytes at start for the throughput
+        progress = []
+
         def file_exists(file_name):
             return os.path.isfile(file_name)
 
-        ret_val = []
-        if not self.dest:
-            dest = '/tmp/flashtool'
-        else:
-            dest = self.dest.rstrip('/')
+        dest = self.cache.root
 
         url = '{}/{}'.format(self.url, file_path)
         file_name = file_path.split('/')[-1]
-        product = file_path.split('/')[0]
         dest_name = '{}/{}'.format(dest, '/'.join(file_path.split('/')[:-1]))
         dest_file = '{}/{}'.format(dest_name, file_name)
+        part_file = '{}.part'.format(dest_file)
 
-        if not os.path.isdir(dest_name):
-            os.makedirs(dest_name)
+        os.makedirs(dest_name, exist_ok=True)
 
-        if not file_exists(dest_file):
-            print('    DOWNLOAD FILE:\n'
-                  '    URL:  {}\n'
-                  '    FILE: {}\n'.format(url, file_name))
-            try:
-                urlretrieve(url, dest_file, reporthook)
-            except KeyboardInterrupt:
-                print(Fore.YELLOW + '   User aborted download')
-                os.remove(dest_file)
-                raise
-            except Exception as e:
-                print(Fore.RED + '   An Error occured while downloading.')
-                print(Fore.RED + '   {}'.format(repr(e)))
-                os.remove(dest_file)
-                raise
+        size = self.get_file_size(file_path)
+        reference = self.get_file_info(file_path).get('sha256')
 
+        if file_exists(dest_file) and self.__cached(file_path, size, reference):
+            out(Fore.YELLOW + '   FILE {} WAS ALREADY DOWNLOADED:'.format(file_name))
         else:
-            print(Fore.YELLOW + '   FILE {} WAS ALREADY DOWNLOADED:'.format(file_name))
+            if self.offline:
+                raise BuildserverConnectionError('Offline mode: file {} was not downloaded before'.format(file_path))
 
+            if file_exists(dest_file):
+                out(Fore.YELLOW + '   FILE {} IS INCOMPLETE OR BROKEN, DOWNLOAD IT AGAIN'.format(file_name))
+
+            out('    DOWNLOAD FILE:\n'
+                  '    URL:  {}\n'
+                  '    FILE: {}\n'.format(url, file_name))
+
+            if file_exists(part_file):
+                out(Fore.YELLOW + '   Resume download at {} Bytes'.format(os.stat(part_file).st_size))
+
+            if quiet:
+                reporthook = None
+
+            segmented = self.segments > 1 and size is not None and size >= SEGMENT_MIN_SIZE and \
+                self.get_file_info(file_path).get('ranges') and \
+                (not file_exists(part_file) or file_exists('{}.segments'.format(part_file)))
+
+            attempt = 0
+            while True:
+                try:
+                    if segmented:
+                        segmented = self.__retrieve_segmented(url, part_file, size, reporthook, abort)
+
+                    if not segmented:
+                        self.__retrieve(url, part_file, size, reporthook, abort)
+                    break
+                except KeyboardInterrupt:
+                    out(Fore.YELLOW + '   User aborted download. The download will be resumed next time.')
+                    raise
+                except (BuildserverConnectionError, BuildserverPackageError, RequestException, IOError) as e:
+                    attempt += 1
+                    if attempt > self.retries:
+                        out(Fore.RED + '   An Error occured while downloading.')
+                        out(Fore.RED + '   {}'.format(repr(e)))
+                        raise
+
+                    delay = min(DOWNLOAD_MAX_BACKOFF, 2 ** (attempt - 1))
+                    out('')
+                    out(Fore.YELLOW + '   Download interrupted ({}). Resume in {} seconds [{}/{}]'
+                          .format(e, delay, attempt, self.retries))
+                    time.sleep(delay)
+
+            os.replace(part_file, dest_file)
+            out('')
+            out('     Verify file...')
+            self.cache.add(file_path)
+            self.__verified(file_path, reference)
+
+        self.cache.save()
 
         return dest_file, os.stat(dest_file).st_size
 
-    def get_file_size(self, file):
-        url = '{}/{}'.format(self.url, file)
-        meta = dict(urlopen(url).info())
+    def prefetch(self, file_path):
+        '''
+        Starts the download of a file in the background. Each file is only downloaded once,
+        further calls return the same future.
 
-        return meta["Content-Length"]
+        :param file_path: path of the file on the server
+        :return: future with the result of get_file
+        '''
+        with self.fetch_lock:
+            future = self.fetches.get(file_path)
+            if future is None:
+                if self.fetch_executor is None:
+                    self.fetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+                future = self.fetch_executor.submit(self.get_file, file_path, True, self.abort)
+                self.fetches[file_path] = future
 
-    def get_versions_filterd_by_types(self, files, versions, types):
+        return future
+
+    def cancel_prefetch(self):
         '''
-        Returns a list with versions.
-        :param files:
-        :param versions:
-        :param types:
-        :return:
+        Aborts all background downloads. Partial files are kept and resumed by the next download.
         '''
-        ret_val = []
-        for version in versions:
-            types_per_file = set(map(lambda t: t.split('_')[-1].split('.')[0], filter(lambda f: version in f, files)))
+        with self.fetch_lock:
+            if self.fetch_executor is None:
+                return
+            self.abort.set()
+            for future in self.fetches.values():
+                future.cancel()
+            self.fetch_executor.shutdown(wait=False)
+            self.fetch_executor = None
+            self.fetches = {}
+            self.abort = threading.Event()
+
+    def open_stream(self, file_path):
+        '''
+        Opens a file of the buildserver for reading as stream without storing it on disk.
+        If the file is in the artifact cache, the cached file is read instead. The data
+        is hashed while it is read, see ArtifactStream.
 
-            if set(types) == types_per_file:
-                ret_val.append(version)
+        :param file_path: path of the file on the server
+        :return: ArtifactStream object
+        '''
+        size = self.get_file_size(file_path)
+        reference = self.get_file_info(file_path).get('sha256')
 
-        return ret_val
+        path = self.cache.path(file_path)
+        if os.path.isfile(path) and self.__cached(file_path, size, reference):
+            print(Fore.YELLOW + '   READ FILE {} FROM CACHE'.format(file_path.split('/')[-1]))
+            return ArtifactStream(open(path, 'rb'), file_path, size, self.cache.digest(file_path))
 
+        url = '{}/{}'.format(self.url, file_path)
+        print('    STREAM FILE:\n'
+              '    URL:  {}\n'.format(url))
 
-    def get_files_path(self, file_info, reg_name, file_types, auto):
+        r = self._try_request('get', url, stream=True)
+        r.raise_for_status()
+        # remove transfer encodings, the tarball itself is decompressed by the reader
+        r.raw.decode_content = True
+
+        return ArtifactStream(r.raw, file_path, size, reference, r.close,
+                              lambda digest: self.__record_digest(file_path, digest))
+
+    def __cached(self, file_path, size, reference):
+        '''
+        Checks an artifact of the cache against its size and the reference digest of
+        the server. An artifact which does not match the reference is removed.
         '''
+        if not self.cache.lookup(file_path, size):
+            return False
+
+        if reference and self.cache.digest(file_path) != reference:
+            log.warning('Cached artifact {} does not match the digest of the server'.format(file_path))
+            self.cache.remove(file_path)
+            return False
 
-        :param file_info:
-        :param reg_name:
-        :param file_types:
-        :param auto:
-        :return:
+        return True
+
+    def __verified(self, file_path, reference):
         '''
-        for platform, products_info in file_info.items():
-            for product, unsorted_files in products_info.items():
-                f_types = next(filter(lambda x: product in x[0], file_types))
+        Checks a downloaded artifact against the reference digest of the server and
+        records its digest. Raises BuildserverPackageError if it does not match.
+        '''
+        digest = self.cache.digest(file_path)
+        if reference and digest != reference:
+            self.cache.remove(file_path)
+            raise BuildserverPackageError('Digest of {} does not match the digest of the server'
+                                          .format(file_path))
 
-                if product == 'rootfs':
-                    files = ['rootfs/{}/{}'.format(k, e) for k,v in unsorted_files.items() for e in v]
-                else:
-                    files = ['{}/{}/{}'.format(product, platform, e) for e in unsorted_files]
+        self.__record_digest(file_path, digest)
 
-                str_match = '.*{}.*'.format(reg_name)
-                re_file = re.compile(str_match)
-                matched_files = list(filter(lambda f_name: re_file.match(f_name), files))
-                versions = sorted(set([f[:f.rfind('_')] for f in matched_files]))
+    def __record_digest(self, file_path, digest):
+        # later transfers and cache hits of the artifact are checked against it
+        self.artifacts.set_digest(file_path, digest)
+        self.artifacts.save()
 
-                versions = self.get_versions_filterd_by_types(matched_files, versions, f_types[1])
+    def get_file_size(self, file):
+        info = self.get_file_info(file)
 
-                #sort via date stamp of file
+        if not info['available']:
+            raise BuildserverFilesNotFound('File {} is not available on the server'.format(file))
 
-                if len(versions) > 1:
-                    print(
-                    Fore.YELLOW + '  Found multiple versions for product {} with regex {}'.format(product, str_match))
+        return info['size']
 
-                    if auto:
-                        if product == 'rootfs' and str_match == '.*.*':
-                            print(Fore.GREEN + '  [AUTO-MODE] Take newest factory built.')
-                            filtered_versions = list(filter(lambda x: 'factory' in x,versions))
-                            version = filtered_versions[-1]
-                        else:
-                            # take newest
-                            print(Fore.GREEN + '  [AUTO-MODE] Take newest built.')
-                            version = versions[-1]
-                    else:
-                        i = 0
-                        for f in versions:
-                            print('    [{}]: {}'.format(i, f.split('/')[-1]))
-                            i += 1
+    def __retrieve(self, url, part_file, size=None, reporthook=None, abort=None):
+        '''
+        Downloads url to part_file through the session of the buildserver. If part_file
+        already exists, only the missing bytes are requested with a range request.
+
+        :param url: url of the file
+        :param part_file: local path for the partial file
+        :param size: expected size of the file, None if unknown
+        :param reporthook: function(received, totalsize) to report the progress
+        :param abort: threading.Event which aborts the download if it is set
+        :return: None
+        '''
+        offset = os.stat(part_file).st_size if os.path.isfile(part_file) else 0
 
-                        print('')
-                        selection = int(util.user_select('  [MANUAL-MODE] Please select a file:', 0, i))
-                        version = versions[selection]
-                elif len(versions) == 1:
-                    print(Fore.YELLOW + '  Found one version for product {} with regex {}'.format(product, str_match))
-                    version = versions[0]
-                else:
-                    raise BuildserverFilesNotFound('Could not find files for product {} (types: {}, platform {})'
-                                                   .format(product, f_types[1], platform))
+        if size is not None and offset == size:
+            return
+        if size is not None and offset > size:
+            offset = 0
 
-                print(Fore.GREEN + '  -> Selected version: {}:'.format(version.split('/')[-1]))
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        r = self._try_request('get', url, stream=True, headers=headers)
+        try:
+            if r.status_code == 200:
+                # server ignored the range request
+                offset = 0
+            elif r.status_code != 206:
+                r.raise_for_status()
+                raise BuildserverPackageError('Unexpected status code {} for {}'.format(r.status_code, url))
+
+            if size is None and r.headers.get('Content-Length') is not None:
+                size = offset + int(r.headers['Content-Length'])
+
+            received = offset
+            with open(part_file, 'ab' if offset else 'wb') as f:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if abort and abort.is_set():
+                        raise KeyboardInterrupt
+                    f.write(chunk)
+                    received += len(chunk)
+                    if reporthook:
+                        reporthook(received, size or -1)
+        finally:
+            r.close()
 
-        ret_val = []
-        for product, f_types in file_types:
-            f_info = []
-            for f_type in f_types:
-                f_info.append((f_type, next(f_name for f_name in matched_files if re.match('{}_{}.*'.format(version, f_type), f_name))))
-            ret_val.append((product, f_info))
+        if size is not None and received != size:
+            raise BuildserverPackageError('Downloaded {} of {} Bytes from {}'.format(received, size, url))
 
-        return ret_val
+    def __retrieve_segmented(self, url, part_file, size, reporthook=None, abort=None):
+        '''
+        Downloads url to part_file with several parallel range requests. The file is
+        preallocated and every segment writes its data directly at its offset. The progress
+        of each segment is stored in {part_file}.segments, so an interrupted download can be
+        resumed.
+
+        :param url: url of the file
+        :param part_file: local path for the partial file
+        :param size: size of the file
+        :param reporthook: function(received, totalsize) to report the progress
+        :param abort: threading.Event which aborts the download if it is set
+        :return: False if the server does not support range requests, otherwise True
+        '''
+        state_file = '{}.segments'.format(part_file)
 
-    def is_file_available(self, path_to_file):
+        segments = None
+        if os.path.isfile(state_file):
+            try:
+                with open(state_file) as f:
+                    segments = json.load(f)
+            except ValueError:
+                segments = None
+
+        if not segments or not os.path.isfile(part_file) or os.stat(part_file).st_size != size:
+            # segments as [start, end (exclusive), received]
+            bounds = [size * i // self.segments for i in range(self.segments + 1)]
+            segments = [[bounds[i], bounds[i + 1], 0] for i in range(self.segments) if bounds[i] < bounds[i + 1]]
+
+            fd = os.open(part_file, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+            try:
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        no_ranges = threading.Event()
+
+        def save_state():
+            with lock:
+                tmp = '{}.tmp'.format(state_file)
+                with open(tmp, 'w') as f:
+                    json.dump(segments, f)
+                os.replace(tmp, state_file)
+
+        def report():
+            if reporthook:
+                reporthook(sum(seg[2] for seg in segments), size)
+
+        def fetch(seg, fd):
+            start, end = seg[0] + seg[2], seg[1]
+            if start >= end:
+                return
+
+            r = self._try_request('get', url, stream=True,
+                                   headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+            try:
+                if r.status_code != 206:
+                    r.raise_for_status()
+                    no_ranges.set()
+                    stop.set()
+                    return
+
+                pos = start
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if abort and abort.is_set():
+                        raise KeyboardInterrupt
+                    if stop.is_set():
+                        return
+                    chunk = chunk[:end - pos]
+                    os.pwrite(fd, chunk, pos)
+                    pos += len(chunk)
+                    with lock:
+                        seg[2] = pos - seg[0]
+                    report()
+                    if pos >= end:
+                        break
+            finally:
+                r.close()
+
+            if pos != end:
+                raise BuildserverPackageError('Segment {}-{} of {} is incomplete'.format(seg[0], seg[1], url))
+
+        if reporthook:
+            print('     Download in {} segments'.format(len(segments)))
+        save_state()
+
+        fd = os.open(part_file, os.O_WRONLY)
         try:
-            urlopen('{}/{}'.format(self.url,path_to_file))
-        except HTTPError as e:
-            log.warning('Could not retrieve file {} from server: Code {}'.format(path_to_file, e.code))
-            return False
-        except URLError as e:
-            log.warning('Could not retrieve file {} from server: Code {}'.format(path_to_file, e.args))
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                futures = [executor.submit(fetch, seg, fd) for seg in segments]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    stop.set()
+                    raise
+        finally:
+            os.close(fd)
+            save_state()
+
+        if no_ranges.is_set():
+            log.info('Server ignored range request for {}. Fall back to a single stream.'.format(url))
+            print(Fore.YELLOW + '   Server does not support segmented downloads.')
+            os.remove(state_file)
+            os.remove(part_file)
             return False
 
+        os.remove(state_file)
         return True
 
+    def is_file_available(self, path_to_file):
+        return self.get_file_info(path_to_file)['available']
+
+    def get_file_info(self, path_to_file):
+        '''
+        Returns availability, size and last modification of a file on the server. The
+        information is retrieved with a HEAD request and cached in the artifact catalog.
+
+        :param path_to_file: path of the file on the server
+        :return: dictionary with keys available, size, last_modified, ranges, sha256 and checked
+        '''
+        info = self.artifacts.get(path_to_file, expire=not self.offline)
+        if info:
+            return info
+
+        if self.offline:
+            cached = self.cache.entries.get(path_to_file)
+            if cached:
+                return {'available': True, 'size': cached['size'], 'last_modified': None, 'ranges': False,
+                        'sha256': None, 'checked': None}
+            return {'available': False, 'size': None, 'last_modified': None, 'ranges': False, 'sha256': None,
+                    'checked': None}
+
+        url = '{}/{}'.format(self.url, path_to_file)
+        try:
+            r = self._try_request('head', url, allow_redirects=True)
+            if r.status_code == 405:
+                # server does not support HEAD requests
+                r = self._try_request('get', url, stream=True)
+                r.close()
+        except BuildserverConnectionError as e:
+            # connection problems are not cached
+            log.warning('Could not retrieve file {} from server: Code {}'.format(path_to_file, e.message))
+            return {'available': False, 'size': None, 'last_modified': None, 'ranges': False, 'sha256': None,
+                    'checked': None}
+
+        if r.status_code != 200:
+            log.warning('Could not retrieve file {} from server: Code {}'.format(path_to_file, r.status_code))
+            return self.artifacts.add(path_to_file, False)
+
+        size = r.headers.get('Content-Length')
+        return self.artifacts.add(path_to_file, True, int(size) if size is not None else None,
+                                  r.headers.get('Last-Modified'), r.headers.get('Accept-Ranges') == 'bytes',
+                                  parse_digest(r.headers))
+
     def get_build_info(self, builds, wanted_products, wanted_platform=None):
         ret_val = OrderedDict()
 
+        # check availability of all files concurrently, the results are cached
+        paths = []
+        for platform, build_info in builds.items():
+            if wanted_platform and platform != wanted_platform:
+                continue
+
+            for product, files_info in build_info.items():
+                if product in wanted_products:
+                    if product == 'rootfs':
+                        paths.extend('rootfs/{}/{}'.format(t, f) for t, fs in files_info.items() for f in fs)
+                    else:
+                        paths.extend('{}/{}/{}'.format(product, platform, e) for e in files_info)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.get_file_info, paths))
+        self.artifacts.save()
+
         for platform,build_info in builds.items():
             if wanted_platform:
                 if platform != wanted_platform:
@@ -293,107 +920,188 @@ class Buildserver():
 
         return ret_val
 
-    def get_builds_info(self, force_new=False):
+    def get_builds_info(self, force_new=False, limit=None, max_age=None, products=None):
         '''
-        Get all built software.
+        Get all built software. Without limit and max_age the whole history of all
+        builders is fetched. Otherwise the history is scanned from the newest build
+        downwards and the scan of a builder stops as soon as limit successful builds
+        of each configured platform and product were found, a build is older than
+        max_age or the history ends. Only these builds are returned then.
+
+        :param force_new: ignore the builds of a former call
+        :param limit: number of newest builds per platform and product, None for all
+        :param max_age: maximum age of the builds in seconds, None for all
+        :param products: products which a scan with limit must find for each platform,
+                         all products if None
+        :return: dictionary {platform: {product: [files]}}, rootfs products are
+                 dictionaries {rootfs name: [files]}
         '''
+        windowed = limit is not None or max_age is not None
+        cutoff = time.time() - max_age if max_age is not None else None
 
-        def get_json(buildername, build_num):
-            json_path = 'json/builders/{}/builds/{}'.format(buildername, build_num)
-            return self.__get_json_data(json_path)
+        def get_json(buildername, build_nums):
+            # one request returns all selected builds, keyed by build number
+            json_path = 'json/builders/{}/builds'.format(buildername)
+            return self._get_json_data(json_path, ['select={}'.format(n) for n in build_nums])
+
+        def get_entries(buildername, build_nums):
+            if self.catalog is not None:
+                missing = [n for n in build_nums if not self.catalog.has_build(buildername, n)]
+            else:
+                missing = list(build_nums)
+
+            # unknown builds are skipped in offline mode
+            builds_info = get_json(buildername, missing) if missing and not self.offline else {}
+
+            entries = []
+            for build_num in build_nums:
+                if build_num not in missing:
+                    entries.append(self.catalog.get_build(buildername, build_num))
+                    continue
+
+                build = builds_info.get(str(build_num), {})
+                # keep only the fields which are used
+                build = {k: build[k] for k in ('text', 'properties', 'times') if k in build}
+                entry = to_entry(build, build_num)
+
+                # a build without data was removed from the build history of the server
+                # (buildHorizon) or is broken, it is recorded like a failed build
+                if self.catalog is not None and not self.offline and is_finished(build):
+                    self.catalog.add_build(buildername, build_num, entry)
+
+                entries.append(entry)
+
+            return entries
+
+        def fetch_builds(executor, buildername, last_build, is_rootfs):
+            if windowed:
+                return [executor.submit(scan_builds, buildername, last_build, is_rootfs)]
+
+            # builds are requested in batches of batch_size build numbers
+            return [executor.submit(get_entries, buildername, range(first, min(first + self.batch_size, last_build + 1)))
+                    for first in range(0, last_build + 1, self.batch_size)]
+
+        def scan_builds(buildername, last_build, is_rootfs):
+            # newest batch first, stop if every configured platform and product has enough builds
+            required = self._required_builds(buildername, products)
+            built = self._built_products(buildername)
+            found = OrderedDict()
+            too_old = False
+            for last in range(last_build, -1, -self.batch_size):
+                for entry in reversed(get_entries(buildername, range(max(0, last - self.batch_size + 1), last + 1))):
+                    if not entry:
+                        continue
+
+                    if cutoff is not None and entry.get('finished') is not None and entry['finished'] < cutoff:
+                        too_old = True
+                        break
+
+                    if not is_rootfs and entry['platform'] not in self.valid_platforms:
+                        continue
+
+                    found.setdefault(entry['platform'] if is_rootfs else (entry['platform'], entry['product']), [])\
+                        .append(entry)
+
+                if too_old or (limit is not None and has_enough_builds(found, required, limit, built)):
+                    break
+
+            entries = [e for product_entries in found.values() for e in product_entries[:limit]]
+            # oldest build first like a full scan
+            return sorted(entries, key=lambda e: e['number'])
+
+        def is_finished(builds_info):
+            # running builds have no end time yet
+            times = builds_info.get('times')
+            return not times or times[1] is not None
+
+        def to_entry(builds_info, build_num):
+            # only deal with build which are built succesfully
+            if not (builds_info.get('text') and builds_info['text'][0] == 'build'
+                    and builds_info['text'][1] == 'successful'):
+                return None
+
+            # flatten properties to a list with strings
+            props = [x for y in builds_info['properties'] for x in y]
+
+            return {
+                'number': build_num,
+                'platform': get_from_flatten_list(props, 'platform'),
+                'product': get_from_flatten_list(props, 'product'),
+                'upload_files': get_from_flatten_list(props, 'upload_files'),
+                'finished': (builds_info.get('times') or [None, None])[1],
+            }
 
         def get_from_flatten_list(flatten_list, what):
             for item in flatten_list:
                 if item == what:
                     return flatten_list[flatten_list.index(item) + 1]
 
-        class builds_info_helper():
-            def __init__(self):
-                self.builds = OrderedDict()
-
-            def append_to_builds(self, platform, product, files):
-                if platform and product and files:
-                    if self.builds.get(platform):
-                        if self.builds[platform].get(product):
-                            self.builds[platform][product].extend(files)
-                        else:
-                            self.builds[platform].update({product: files})
-                    else:
-                        self.builds.update({platform: OrderedDict({product: files})})
-
-            def append_to_rfsbuilds(self, platform, file_type, files):
-                if platform and file_type and files:
-                    if self.builds.get(platform):
-                        if self.builds[platform].get('rootfs'):
-                            if self.builds[platform]['rootfs'].get(file_type):
-                                self.builds[platform]['rootfs'][file_type].extend(files)
-                            else:
-                                self.builds[platform]['rootfs'].update({file_type: files})
-                        else:
-                            self.builds[platform].update({
-                                'rootfs': OrderedDict({file_type: files})
-                            })
-                    else:
-                        self.builds.update({
-                            platform: OrderedDict({
-                                'rootfs': OrderedDict({
-                                    file_type: files
-                                })
-                            })
-                        })
-
         platforms = self.info['platforms']
 
-        if not force_new:
+        if not force_new and not windowed:
             if self.info['builds']:
                 return self.info['builds']
 
         if not platforms or force_new:
             platforms = self.get_platforms_info(force_new)
 
-        builds = builds_info_helper()
-
-        # get architectures from platforms and iterate through them
-        for platform, arch in platforms:
-            # Get all builders which contain the string of arch in it
-            builders = ((x[0], x[1]['last_build']) for x in (
-                    e for e in self.info['builders'] if arch == e[0]
-            ))
-            # get build information from builders
-            for buildername, last_build in builders:
-                for build_num in range(0,last_build + 1):
-                    builds_info = get_json(buildername, build_num)
-
-                    # only deal with build which are built succesfully
-                    if builds_info.get('text') and builds_info['text'][0] == 'build' and builds_info['text'][1] == 'successful':
-                        # flatten properties to a list with strings
-                        props = [x for y in builds_info['properties'] for x in y]
-                        cfg_platform = get_from_flatten_list(props, 'platform')
-
-                        if cfg_platform in self.valid_platforms:
-                            product = get_from_flatten_list(props, 'product')
-                            files = get_from_flatten_list(props, 'upload_files')
-
-                            builds.append_to_builds(platform, product, files)
-
+        builds = BuildsInfo()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Requests for all builders are queued at once, the results are merged
+            # afterwards in the order of the jobs to keep the result deterministic.
+            # The history of a builder is fetched only once, even if several platforms
+            # share its architecture.
+            jobs = []
+            fetched = {}
+
+            def builder_futures(buildername, last_build, is_rootfs):
+                if buildername not in fetched:
+                    fetched[buildername] = fetch_builds(executor, buildername, last_build, is_rootfs)
+                return fetched[buildername]
+
+            # get architectures from platforms and iterate through them
+            for platform, arch in platforms:
+                # Get all builders which contain the string of arch in it
+                builders = ((x[0], x[1]['last_build']) for x in (
+                        e for e in self.info['builders'] if arch == e[0]
+                ))
+                for buildername, last_build in builders:
+                    jobs.append((platform, False, builder_futures(buildername, last_build, False)))
+
+                rootfs_builders = list(map(lambda x: (x[0], x[1]['last_build']),
+                    filter(lambda e: 'rootfs_{}'.format(arch) == e[0], self.info['builders'])
+                ))
+
+                for buildername, last_build in rootfs_builders:
+                    jobs.append((platform, True, builder_futures(buildername, last_build, True)))
 
-            rootfs_builders = list(map(lambda x: (x[0], x[1]['last_build']),
-                filter(lambda e: 'rootfs_{}'.format(arch) == e[0], self.info['builders'])
-            ))
-
-            for buildername, last_build in rootfs_builders:
-                for build_num in range(0, last_build + 1):
-                    builds_info = get_json(buildername, build_num)
+            try:
+                for platform, is_rootfs, futures in jobs:
+                    for entry in (e for future in futures for e in future.result()):
+                        if not entry:
+                            continue
+
+                        # the builder of an architecture builds all of its platforms, each entry
+                        # belongs to its own platform only. Rootfs builds fit every platform.
+                        if is_rootfs:
+                            builds.append_to_rfsbuilds(platform, entry['platform'], entry['upload_files'])
+                        elif entry['platform'] == platform:
+                            builds.append_to_builds(platform, entry['product'], entry['upload_files'])
+            except BaseException:
+                for futures in fetched.values():
+                    for future in futures:
+                        future.cancel()
+                raise
+            finally:
+                if self.catalog is not None:
+                    self.catalog.save()
 
-                    # only deal with build which are built succesfully
-                    if builds_info.get('text') and builds_info['text'][0] == 'build' and builds_info['text'][1] == 'successful':
-                        # flatten properties to a list with strings
-                        props = [x for y in builds_info['properties'] for x in y]
-                        rootfs_name = get_from_flatten_list(props, 'platform')
-                        files = get_from_flatten_list(props,  'upload_files')
-                        builds.append_to_rfsbuilds(platform, rootfs_name, files)
+            self._save_rootfs_info((name, [e for future in futures for e in future.result()])
+                                   for name, futures in fetched.items() if name.startswith('rootfs_'))
 
-        self.info['builds'] = builds.builds
+        if not windowed:
+            self.info['builds'] = builds.builds
 
         return builds.builds
 
@@ -431,14 +1139,92 @@ class Buildserver():
         self.info['platforms'] = platforms
 
         if self.dest:
-            for arch, platform in platforms:
-                if not self.local_platform_info.get(platform):
-                    self.local_platform_info[platform] = arch
+            for platform, arch in platforms:
+                self.local_platform_info[platform] = arch
 
-            json.dump(self.local_platform_info, open(self.json_file, 'w'))
+            save_local_info(self.json_file, self.local_platform_info)
 
         return platforms
 
+    def _required_builds(self, buildername, products=None):
+        '''
+        Returns the keys which a scan of a builder with limit must find: (platform, product)
+        for the configured platforms of the builder and the rootfs names which are known for
+        a rootfs builder. If the build catalog holds the whole history of the builder, a
+        platform or product which never had a build there is not required.
+
+        :param buildername: name of the builder
+        :param products: products which must be found, all products if None
+        :return: list of keys
+        '''
+        if buildername.startswith('rootfs_'):
+            if products is not None and 'rootfs' not in products:
+                return []
+            arch = buildername[len('rootfs_'):]
+            required = [name for name, a in (self.local_rootfs_info.items() if self.dest else []) if a == arch]
+        else:
+            archs = self._platform_archs()
+            required = [(platform, product) for platform in self.valid_platforms
+                        if archs.get(platform, buildername) == buildername
+                        for product in (products if products is not None else BUILD_PRODUCTS) if product != 'rootfs']
+
+        built = self._catalog_keys(buildername)
+        if built is not None:
+            required = [key for key in required if key in built]
+
+        return required
+
+    def _catalog_keys(self, buildername):
+        '''
+        Returns the keys of all successful builds of a builder in the build catalog, None
+        if the catalog does not hold the whole history of the builder.
+        '''
+        if self.catalog is None or not self._catalog_complete(buildername):
+            return None
+
+        is_rootfs = buildername.startswith('rootfs_')
+        return set(e['platform'] if is_rootfs else (e['platform'], e['product'])
+                   for e in self.catalog.data.get(buildername, {}).values() if e)
+
+    def _built_products(self, buildername):
+        '''
+        Returns the products of the builds of a builder in the build catalog.
+        '''
+        if self.catalog is None:
+            return set()
+
+        return set(e['product'] for e in self.catalog.data.get(buildername, {}).values() if e)
+
+    def _catalog_complete(self, buildername):
+        # every build number up to the newest recorded one is in the catalog
+        recorded = self.catalog.data.get(buildername, {})
+        return bool(recorded) and len(recorded) == self.catalog.last_build(buildername) + 1
+
+    def _platform_archs(self):
+        '''
+        Returns the known architectures of the configured platforms {platform: architecture}.
+        The schedulers name the architecture of every platform which has builds.
+        '''
+        archs = {platform: None for platform in self.valid_platforms}
+        archs.update(self.info['platforms'] or [])
+        return archs
+
+    def _save_rootfs_info(self, rootfs_builds):
+        '''
+        Records the architecture of rootfs builds in {dest}/.rootfs for LocalBuilds.
+
+        :param rootfs_builds: iterable of tuples (rootfs builder name, entries)
+        '''
+        if not self.dest:
+            return
+
+        for buildername, entries in rootfs_builds:
+            for entry in entries:
+                if entry and entry['platform']:
+                    self.local_rootfs_info[entry['platform']] = buildername[len('rootfs_'):]
+
+        save_local_info(self.rootfs_file, self.local_rootfs_info)
+
     def get_builders_info(self, force_new=False):
         '''
         Tries to get information about all online builders.
@@ -450,11 +1236,12 @@ class Buildserver():
 
             # collect builders info
             builders = []
-            for item in root_json['builders'].values():
-                info = self.__builder_info(item)
-                if info:
-                    builders.append(info)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for info in executor.map(self.__builder_info, root_json['builders'].values()):
+                    if info:
+                        builders.append(info)
 
+            self.responses.save()
             self.info['builders'] = builders
 
             return builders
@@ -464,7 +1251,7 @@ class Buildserver():
         Returns JSON data from buildserver from {server-url}/json
         '''
         root_json_path = 'json'
-        return self.__get_json_data(root_json_path)
+        return self._get_json_data(root_json_path, conditional=True)
 
     def __builder_info(self, info):
         '''
@@ -489,22 +1276,31 @@ class Buildserver():
             arch = retVal[0]
             # get number of last build
             json_path = 'json/builders/{}/builds/-1'.format(arch)
-            json_data = self.__get_json_data(json_path)
+            json_data = self._get_json_data(json_path, conditional=True)
             retVal[1]['last_build'] = json_data['number']
             return retVal
 
-    def __get_json_data(self, what, opts=None):
+    def _get_json_data(self, what, opts=None, conditional=False):
         '''
         Tries to get json data from :attribute url:/:param what: via request call.
         (read json api buildbot for further information)
 
         :param what: path to specific json data of the buildbot buildserver
         :param opts: list with buildbot options as string (pattern ["{option1}={value}",...])
+        :param conditional: request the data conditionally with the validators of the response cache
         :return: Json data as dictionary
         '''
-        if not opts:
-            opts = []
-        r = self.__try_request('get', '{}/{}/?{}'.format(self.url, what, '&'.join(opts)).rstrip('?'))
+        url = self._json_url(what, opts or [])
+
+        if self.offline and conditional and self.responses.get(url):
+            return copy.deepcopy(self.responses.get(url)['body'])
+
+        headers = self.responses.headers(url) if conditional else {}
+        r = self._try_request('get', url, headers=headers)
+
+        if r.status_code == 304 and self.responses.get(url):
+            log.debug('{} was not modified'.format(url))
+            return copy.deepcopy(self.responses.get(url)['body'])
 
         if r.status_code != 200:
             raise BuildserverConnectionError('Can\'t connect to server. Status code {}'.format(r.status_code))
@@ -514,36 +1310,258 @@ class Buildserver():
             json_string = r.json()
         except Exception as e:
             raise BuildserverConnectionError(
-                'Can\'t get json data from server.' + Fore.RED + ' Info: {}'.format(e.message))
+                'Can\'t get json data from server.' + Fore.RED + ' Info: {}'.format(e))
+
+        if conditional:
+            self.responses.add(url, r.headers.get('ETag'), r.headers.get('Last-Modified'), json_string)
+            json_string = copy.deepcopy(json_string)
 
         return json_string
 
-    def __try_request(self, request, url):
+    def _json_url(self, what, opts):
+        return '{}/{}/?{}'.format(self.url, what, '&'.join(opts)).rstrip('?')
+
+    def _try_request(self, request, url, **kwargs):
         '''
         Tries a http request on a given url and returns the requested data.
-        Exceptions will be handled and raised if an Error occurs
+        Exceptions will be handled and raised if an Error occurs. All requests
+        share the connection pool of the session.
 
-        :param request: Request type. (Supported types: get and post)
+        :param request: Request type. (Supported types: get, head and post)
+        :param url: url for the request
+        :param kwargs: additional arguments for the request of the session
         '''
         supported_requests = {
-            'get': requests.get,
-            'post': requests.post
+            'get': self.session.get,
+            'head': self.session.head,
+            'post': self.session.post
         }
 
-        retVal = None
+        kwargs.setdefault('timeout', self.timeout)
+
+        if self.offline:
+            raise BuildserverConnectionError('Offline mode: {} is not available locally'.format(url))
 
         try:
-            try:
-                retVal = supported_requests[request](url)
-            except KeyError:
-                raise BuildserverConnectionError(Fore.RED + 'Request type "{}" is not supported! Supported requests: {}'
-                                                 .format(request, list(supported_requests.keys())))
+            return supported_requests[request](url, **kwargs)
+        except KeyError:
+            raise BuildserverConnectionError(Fore.RED + 'Request type "{}" is not supported! Supported requests: {}'
+                                             .format(request, list(supported_requests.keys())))
+        except RetryError as e:
+            # the server kept answering with a server error (5xx)
+            raise BuildserverConnectionError('Can\'t connect to server. {}'.format(e))
         except ConnectionError as e:
-            raise BuildserverConnectionError('Can\'t connect to server. {}, {}'.format(e.error, e.request))
+            raise BuildserverConnectionError('Can\'t connect to server. {}, {}'.format(e, e.request))
         except Timeout as e:
-            raise BuildserverConnectionError('Connection timed out.\n' + Fore.RED + 'Info: {}'.format(e.message))
-        finally:
-            return retVal
+            raise BuildserverConnectionError('Connection timed out.\n' + Fore.RED + 'Info: {}'.format(e))
+
+class BuildserverNine(Buildserver):
+    '''
+    Interface for a buildbot nine build server, which uses the REST API (api/v2).
+    Filtering is done by the server: only complete and successful builds are
+    requested, newest first and with the used fields only. Rootfs builders
+    are named rootfs_{architecture} like on the 0.8 server.
+    '''
+    api = 'api/v2'
+    build_properties = ['platform', 'product', 'upload_files']
+
+    def get_builders_info(self, force_new=False):
+        '''
+        Tries to get information about all builders.
+
+        :return: List of tuples ({builder name}, {'builderid': id})
+        '''
+        if not force_new and self.info['builders']:
+            return self.info['builders']
+
+        json_data = self._get_json_data('{}/builders'.format(self.api), ['field=builderid', 'field=name'],
+                                        conditional=True)
+        self.responses.save()
+
+        self.info['builders'] = [(b['name'], {'builderid': b['builderid']}) for b in json_data['builders']]
+        return self.info['builders']
+
+    def get_platforms_info(self, force_new=False):
+        '''
+        The REST API does not provide the branch filters of the schedulers, so the
+        platform of a builder is taken from the platform property of its builds.
+
+        :return: List of tuples ({platform}, {architecture})
+        '''
+        if force_new or not self.info['platforms']:
+            self.get_builds_info(force_new)
+
+        return self.info['platforms']
+
+    def get_builds_info(self, force_new=False, limit=None, max_age=None, products=None):
+        '''
+        Get the successful builds of all builders. See Buildserver.get_builds_info.
+        '''
+        windowed = limit is not None or max_age is not None
+        cutoff = time.time() - max_age if max_age is not None else None
+
+        if not force_new and not windowed and self.info['builds']:
+            return self.info['builds']
+
+        builders = self.get_builders_info(force_new)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(name, executor.submit(self.__fetch_builds, name, info['builderid'], limit, cutoff,
+                                              self._required_builds(name, products),
+                                              self._built_products(name)))
+                       for name, info in builders]
+            try:
+                entries = [(name, future.result()) for name, future in futures]
+            except BaseException:
+                for _, future in futures:
+                    future.cancel()
+                raise
+            finally:
+                if self.catalog is not None:
+                    self.catalog.save()
+
+        platforms = []
+        builds = BuildsInfo()
+        for name, builder_entries in entries:
+            if name.startswith('rootfs_'):
+                continue
+            for entry in builder_entries:
+                if entry['platform'] in self.valid_platforms:
+                    if (entry['platform'], name) not in platforms:
+                        platforms.append((entry['platform'], name))
+                    builds.append_to_builds(entry['platform'], entry['product'], entry['upload_files'])
+
+        for name, builder_entries in entries:
+            if not name.startswith('rootfs_'):
+                continue
+            for platform in (p for p, arch in platforms if 'rootfs_{}'.format(arch) == name):
+                for entry in builder_entries:
+                    builds.append_to_rfsbuilds(platform, entry['platform'], entry['upload_files'])
+
+        self.info['platforms'] = platforms
+        if self.dest:
+            for platform, arch in platforms:
+                self.local_platform_info[platform] = arch
+            save_local_info(self.json_file, self.local_platform_info)
+        self._save_rootfs_info((name, e) for name, e in entries if name.startswith('rootfs_'))
+
+        if not windowed:
+            self.info['builds'] = builds.builds
+
+        return builds.builds
+
+    def _catalog_complete(self, buildername):
+        # builds which completed before the last gapless scan are all in the catalog
+        return self.catalog.scanned_until(buildername) is not None
+
+    def _platform_archs(self):
+        '''
+        The platforms of the builders are only known from their builds, a platform whose
+        builder is not known yet must be found on every builder.
+        '''
+        archs = {}
+        if self.dest:
+            archs.update(self.local_platform_info)
+        archs.update(self.info['platforms'] or [])
+        return archs
+
+    def __fetch_builds(self, name, builderid, limit, cutoff, required=(), built=()):
+        '''
+        Returns the entries of the successful builds of a builder, oldest first. Builds
+        which completed before the last complete scan (see BuildCatalog.scanned_until)
+        are taken from the build catalog. Builds are selected by their completion time,
+        not by their number, so a build which finishes after a build with a higher
+        number is found as well.
+
+        :param name: name of the builder
+        :param builderid: id of the builder
+        :param limit: number of newest builds per platform and product, None for all
+        :param cutoff: time stamp of the oldest build, None for all
+        :param required: keys which must have limit builds before the scan stops, see has_enough_builds
+        :param built: products which the builder built before, see has_enough_builds
+        :return: list of entries (see BuildCatalog)
+        '''
+        scanned = self.catalog.scanned_until(name) if self.catalog is not None else None
+
+        opts = ['complete=true', 'results=0', 'order=-number', 'field=number', 'field=complete_at',
+                'field=properties'] + ['property={}'.format(p) for p in self.build_properties]
+        if cutoff is not None and (scanned is None or cutoff >= scanned):
+            opts.append('complete_at__gt={}'.format(int(cutoff)))
+        elif scanned is not None:
+            # builds which completed in the same second as the last scan might be new
+            opts.append('complete_at__ge={}'.format(int(scanned)))
+
+        # only a scan down to the last complete scan fills the catalog without gaps
+        gapless = cutoff is None or (scanned is not None and cutoff < scanned)
+
+        is_rootfs = name.startswith('rootfs_')
+        found = OrderedDict()
+        numbers = set()
+
+        def key(entry):
+            return entry['platform'] if is_rootfs else (entry['platform'], entry['product'])
+
+        def add(entry):
+            if entry['number'] not in numbers:
+                numbers.add(entry['number'])
+                found.setdefault(key(entry), []).append(entry)
+
+        def enough():
+            return limit is not None and has_enough_builds(found, required, limit, built)
+
+        offset = 0
+        newest = scanned
+        while not self.offline:
+            json_data = self._get_json_data('{}/builders/{}/builds'.format(self.api, builderid),
+                                            opts + ['limit={}'.format(self.batch_size), 'offset={}'.format(offset)])
+            for build in json_data['builds']:
+                props = build.get('properties', {})
+                entry = {
+                    'number': build['number'],
+                    'platform': props.get('platform', [None])[0],
+                    'product': props.get('product', [None])[0],
+                    'upload_files': props.get('upload_files', [None])[0],
+                    'finished': build.get('complete_at'),
+                }
+                if self.catalog is not None:
+                    self.catalog.add_build(name, build['number'], entry)
+                if entry['finished'] is not None:
+                    newest = max(newest or 0, entry['finished'])
+                add(entry)
+
+            if len(json_data['builds']) < self.batch_size:
+                if self.catalog is not None and gapless and newest is not None:
+                    self.catalog.set_scanned(name, newest)
+                break
+            if enough():
+                break
+            offset += self.batch_size
+
+        if self.catalog is not None and not enough():
+            # older builds from the catalog, newest first
+            for number in sorted((int(n) for n in self.catalog.data.get(name, {})), reverse=True):
+                entry = self.catalog.get_build(name, number)
+                if not entry:
+                    continue
+                if cutoff is not None and entry.get('finished') is not None and entry['finished'] < cutoff:
+                    continue
+                add(entry)
+                if enough():
+                    break
+
+        entries = [e for product_entries in found.values()
+                   for e in sorted(product_entries, key=lambda e: e['number'], reverse=True)[:limit]]
+        return sorted(entries, key=lambda e: e['number'])
+
+    def _json_url(self, what, opts):
+        return '{}/{}?{}'.format(self.url, what, '&'.join(opts)).rstrip('?')
+
+
+BUILDSERVER_APIS = OrderedDict([
+    ('0.8', Buildserver),
+    ('2', BuildserverNine),
+])
+
 
 class LocalBuildsError(Exception):
     def __init__(self, message):
@@ -553,56 +1571,165 @@ class LocalBuildsError(Exception):
         return repr(self.message)
 
 
-#TODO: Local Builds need a additional files with relationships between architectures and platforms
-class LocalBuilds():
-    def __init__(self, path, configured_platforms):
-        '''
-        Interface for all builds at a given path.
+class LocalBuilds(FileSelection):
+    '''
+    Interface for the products in a local directory, e.g. the destination of
+    "setup --Local". It provides the same methods as Buildserver. The directory
+    has the layout of the buildbot server:
+
+        {path}/{product}/{platform}/{files}  for linux, uboot and misc
+        {path}/rootfs/{rootfs name}/{files}
+        {path}/.platforms                    {platform: architecture}
+        {path}/.rootfs                       {rootfs name: architecture}
+
+    The files of the directories are kept in an index, which is refreshed
+    incrementally by the mtime of the directories.
+    '''
+    products = ['linux', 'uboot', 'misc', 'rootfs']
 
-        :param path: Local path where product builds are .
+    def __init__(self, path, configured_platforms, cache_dir=None):
+        '''
+        :param path: Local path where product builds are.
+        :param configured_platforms: Valid platforms
+        :param cache_dir: Directory for the index. The index is stored in path if None.
         '''
         path = path.rstrip('/')
 
         self.path = path
 
+        if isinstance(configured_platforms, str):
+            configured_platforms = [configured_platforms]
         self.configured_platforms = configured_platforms
+        self.info = {'builds': None}
 
         if not os.path.isdir(path):
             raise LocalBuildsError('Local directory "{}" does not exist.'.format(path))
 
         log.debug('Local directory path "{}" is valid.'.format(self.path))
 
+        index_file = '{}/.local_index'.format(cache_dir.rstrip('/')) if cache_dir else '{}/.index'.format(path)
+        self.index = DirectoryIndex(index_file, path)
 
-    def get_builds_info(self, wanted_products, wanted_platform=None, force_new=False):
-        # TODO: adapt to directory structure of buildbot server
+    def get_builds_info(self, force_new=False, limit=None, max_age=None, products=None):
+        '''
+        Get all products in the local directory, in the structure of
+        Buildserver.get_builds_info. Listing the local directory is cheap, so limit,
+        max_age and products are accepted for compatibility and all products are returned.
+        '''
+        if not force_new and self.info['builds']:
+            return self.info['builds']
+
+        platform_info = load_local_info('{}/.platforms'.format(self.path))
+        rootfs_info = load_local_info('{}/.rootfs'.format(self.path))
 
-        builds = OrderedDict()
+        builds = BuildsInfo()
+        directories = []
+        for product in (e.name for e in self.__scandir(self.path) if e.is_dir() and e.name in self.products):
+            for entry in sorted(self.__scandir('{}/{}'.format(self.path, product)), key=lambda e: e.name):
+                if entry.name.startswith('.') or not entry.is_dir():
+                    continue
+
+                directory = '{}/{}'.format(product, entry.name)
+                directories.append(directory)
+                files = self.__files(directory, entry)
 
+                if product != 'rootfs':
+                    if entry.name in self.configured_platforms:
+                        builds.append_to_builds(entry.name, product, files)
+                    continue
+
+                # a rootfs belongs to all platforms of its architecture
+                for platform in self.configured_platforms:
+                    arch = rootfs_info.get(entry.name)
+                    if arch is None or platform_info.get(platform) in (None, arch):
+                        builds.append_to_rfsbuilds(platform, entry.name, files)
+
+        self.index.prune(directories)
         try:
-            products = filter(lambda f: f in ['linux', 'misc', 'uboot'], next(os.walk(self.path))[1])
-            rootfs = filter(lambda f: f in ['rootfs'], next(os.walk(self.path))[1])
-            local_platform_info = json.load(open('{}/.platforms'.format(self.path)))
-        except:
-            print('An error occured while retrieving file from {}/.platforms'.format(self.path))
-            raise
-
-        for product in products:
-            platforms = filter(lambda f: '.' not in f[0] and f in self.configured_platforms,
-                               next(os.walk('{}/{}'.format(self.path, product)))[1])
-
-            for platform in platforms:
-                files = filter(lambda f: '.' not in f[0],
-                               next(os.walk('{}/{}/{}'.format(self.path, product, platform)))[2])
-                if builds.get(platform):
-                    if builds[platform].get(product):
-                        builds[platform][product].extend(files)
-                    else:
-                        builds[platform].update({product: files})
-                else:
-                    builds.update(
-                        {platform: OrderedDict({product: files})}
-                    )
+            self.index.save()
+        except OSError as e:
+            log.warning('Could not save index {}: {}'.format(self.index.path, e))
+
+        self.info['builds'] = builds.builds
+
+        return builds.builds
+
+    def get_build_info(self, builds, wanted_products, wanted_platform=None):
+        '''
+        Returns the wanted products of builds. See Buildserver.get_build_info.
+        '''
+        ret_val = OrderedDict()
+        for platform, build_info in builds.items():
+            if wanted_platform and platform != wanted_platform:
+                continue
+
+            for product, files in build_info.items():
+                if product in wanted_products:
+                    ret_val.setdefault(platform, OrderedDict())[product] = files
+
+        return ret_val
+
+    def get_file(self, file_path, quiet=False, abort=None):
+        '''
+        Returns the local path and size of a file. Nothing is copied.
+        '''
+        path = '{}/{}'.format(self.path, file_path)
+        try:
+            return path, os.stat(path).st_size
+        except OSError as e:
+            raise BuildserverFilesNotFound('File {} is not available: {}'.format(path, e))
+
+    def open_stream(self, file_path):
+        path, size = self.get_file(file_path)
+        return ArtifactStream(open(path, 'rb'), file_path, size)
+
+    def prefetch(self, file_path):
+        '''
+        Local files need no download, the returned future is already done.
+        '''
+        future = Future()
+        try:
+            future.set_result(self.get_file(file_path))
+        except BuildserverFilesNotFound as e:
+            future.set_exception(e)
+        return future
+
+    def cancel_prefetch(self):
+        pass
+
+    def get_file_info(self, path_to_file):
+        path = '{}/{}'.format(self.path, path_to_file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return {'available': False, 'size': None, 'last_modified': None, 'ranges': False, 'sha256': None,
+                    'checked': None}
+
+        return {'available': True, 'size': stat.st_size, 'last_modified': stat.st_mtime, 'ranges': True,
+                'sha256': None, 'checked': None}
+
+    def is_file_available(self, path_to_file):
+        return self.get_file_info(path_to_file)['available']
+
+    def get_file_size(self, file):
+        info = self.get_file_info(file)
+
+        if not info['available']:
+            raise BuildserverFilesNotFound('File {} is not available in {}'.format(file, self.path))
+
+        return info['size']
+
+    def __files(self, directory, entry):
+        # a directory is only listed if it changed since the last run
+        mtime = entry.stat().st_mtime
+        files = self.index.files(directory, mtime)
+        if files is None:
+            files = sorted(e.name for e in self.__scandir(entry.path)
+                           if not e.name.startswith('.') and not e.name.endswith(PARTIAL_SUFFIXES) and e.is_file())
+            self.index.update(directory, mtime, files)
+
+        return files
 
-        for r in rootfs:
-            #TODO: go through directory structur
-            pass
\ No newline at end of file
+    def __scandir(self, path):
+        with os.scandir(path) as it:
+            return list(it)
@@ -0,0 +1,240 @@
+__author__ = 'mahieke'
+
+import json
+import logging as log
+import os
+import threading
+import time
+
+
+class JsonCatalog():
+    '''
+    Base class for catalogs which are persisted as json file. A catalog
+    belongs to one buildbot server and is rebuilt if the url or version
+    of the file does not match.
+    '''
+    version = 1
+
+    def __init__(self, path, url):
+        '''
+        :param path: location of the catalog file. Nothing is persisted if None.
+        :param url: url of the buildbot server the catalog belongs to
+        '''
+        self.path = path
+        self.url = url
+        self.data = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+        if path and os.path.isfile(path) and os.path.getsize(path) > 0:
+            try:
+                with open(path) as f:
+                    content = json.load(f)
+            except ValueError as e:
+                log.warning('Catalog {} is corrupt and will be rebuilt: {}'.format(path, e))
+                content = {}
+
+            if content.get('version') == self.version and content.get('url') == url:
+                self.data = content.get('data', {})
+            else:
+                log.info('Catalog {} does not belong to {}. Rebuild it.'.format(path, url))
+
+    def save(self):
+        '''
+        Writes the catalog to disk if it has changed. The file is replaced
+        atomically, so an interrupted run never leaves a broken catalog.
+        '''
+        if not self.changed or not self.path:
+            return
+
+        with self.lock:
+            tmp_path = '{}.tmp'.format(self.path)
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': self.version, 'url': self.url, 'data': self.data}, f)
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+        log.debug('Saved catalog {}'.format(self.path))
+
+
+class BuildCatalog(JsonCatalog):
+    '''
+    Persistent catalog of finished builds of a buildbot server. Finished builds
+    never change, so each build has to be fetched from the server only once.
+
+    Each entry of a successful build holds the build number, end time (finished)
+    and the properties platform, product and upload_files. Builds which finished
+    without success are recorded as None.
+
+    For the REST API the catalog also records until which completion time the
+    builds of a builder were fetched without gaps (key .scanned), later runs only
+    ask for builds which completed since.
+    '''
+    version = 2
+    scanned_key = '.scanned'
+
+    def has_build(self, builder, number):
+        return str(number) in self.data.get(builder, {})
+
+    def get_build(self, builder, number):
+        return self.data.get(builder, {}).get(str(number))
+
+    def add_build(self, builder, number, entry):
+        '''
+        Records a finished build.
+
+        :param builder: name of the builder
+        :param number: build number
+        :param entry: dictionary with platform, product and upload_files or None
+        '''
+        with self.lock:
+            self.data.setdefault(builder, {})[str(number)] = entry
+            self.changed = True
+
+    def last_build(self, builder):
+        '''
+        Returns the highest recorded build number of a builder or -1.
+        '''
+        numbers = [int(n) for n in self.data.get(builder, {}).keys()]
+        return max(numbers) if numbers else -1
+
+    def scanned_until(self, builder):
+        '''
+        Returns the completion time until which all builds of a builder are recorded,
+        None if the builder was never scanned completely.
+        '''
+        return self.data.get(self.scanned_key, {}).get(builder)
+
+    def set_scanned(self, builder, complete_at):
+        with self.lock:
+            self.data.setdefault(self.scanned_key, {})[builder] = complete_at
+            self.changed = True
+
+
+class ArtifactCatalog(JsonCatalog):
+    '''
+    Cache for the availability of artifacts on the buildbot server. Results
+    expire after ttl seconds: the upload of a missing artifact might not be
+    finished yet, and an available artifact might be deleted on the server.
+    In offline mode expired results are used, nothing can be checked then.
+
+    Each entry holds the keys available, size, last_modified, ranges, sha256 and
+    checked. sha256 is the reference digest of the artifact, announced by the server
+    or recorded after the first verified transfer. It is kept as long as size and
+    last modification of the artifact do not change.
+    '''
+    def __init__(self, path, url, ttl=600):
+        JsonCatalog.__init__(self, path, url)
+        self.ttl = ttl
+
+    def get(self, artifact, expire=True):
+        '''
+        Returns the cached entry of an artifact or None if it is unknown or expired.
+
+        :param expire: return expired entries as well if False
+        '''
+        entry = self.data.get(artifact)
+        if entry and expire and time.time() - entry['checked'] > self.ttl:
+            return None
+        return entry
+
+    def add(self, artifact, available, size=None, last_modified=None, ranges=False, sha256=None):
+        entry = {
+            'available': available,
+            'size': size,
+            'last_modified': last_modified,
+            'ranges': ranges,
+            'sha256': sha256,
+            'checked': time.time(),
+        }
+        with self.lock:
+            known = self.data.get(artifact)
+            if sha256 is None and available and known and known.get('sha256') and \
+                    (known['size'], known['last_modified']) == (size, last_modified):
+                entry['sha256'] = known['sha256']
+            self.data[artifact] = entry
+            self.changed = True
+
+        return entry
+
+    def set_digest(self, artifact, digest):
+        '''
+        Records the digest of a verified transfer, if the server announced none.
+        '''
+        with self.lock:
+            entry = self.data.get(artifact)
+            if entry and entry['available'] and not entry.get('sha256'):
+                entry['sha256'] = digest
+                self.changed = True
+
+
+class ResponseCache(JsonCatalog):
+    '''
+    Cache for json documents of the buildbot server which change rarely. The
+    validators ETag and Last-Modified are stored with each document, so it
+    can be requested conditionally and an unchanged document is answered with
+    304 Not Modified and no body. In offline mode the documents are used
+    without asking the server.
+
+    Each entry holds the keys etag, last_modified and body.
+    '''
+
+    def get(self, url):
+        return self.data.get(url)
+
+    def headers(self, url):
+        '''
+        Returns the headers for a conditional request of url.
+        '''
+        entry = self.data.get(url)
+        if not entry:
+            return {}
+
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def add(self, url, etag, last_modified, body):
+        '''
+        Records a document. Documents without validators can not be requested
+        conditionally, they are only used in offline mode.
+        '''
+        with self.lock:
+            self.data[url] = {'etag': etag, 'last_modified': last_modified, 'body': body}
+            self.changed = True
+
+
+class DirectoryIndex(JsonCatalog):
+    '''
+    Index of the file names in the directories of a local product tree. A
+    directory is only listed again if its mtime changed, which is the case
+    whenever a file was added, removed or renamed in it.
+
+    Each entry holds the keys mtime and files.
+    '''
+
+    def files(self, directory, mtime):
+        '''
+        Returns the indexed files of a directory or None if the index is outdated.
+        '''
+        entry = self.data.get(directory)
+        if entry and entry['mtime'] == mtime:
+            return entry['files']
+        return None
+
+    def update(self, directory, mtime, files):
+        with self.lock:
+            self.data[directory] = {'mtime': mtime, 'files': files}
+            self.changed = True
+
+    def prune(self, directories):
+        '''
+        Removes all directories from the index which are not in directories.
+        '''
+        with self.lock:
+            for directory in set(self.data) - set(directories):
+                del self.data[directory]
+                self.changed = True
@@ -0,0 +1,141 @@
+__author__ = 'mahieke'
+
+from colorama import Fore
+from concurrent.futures import ThreadPoolExecutor
+import logging as log
+import os
+import re
+
+from flashtool.server.buildserver import BuildserverConnectionError, BuildserverPackageError, PARTIAL_SUFFIXES
+
+DEFAULT_MIRROR_WORKERS = 2
+
+
+class Mirror():
+    '''
+    Copies artifacts of a buildserver into its local destination, so they can be
+    used with LocalBuilds (setup --source local) without the buildserver.
+    The buildserver must be created with the local products directory as dest.
+    '''
+
+    def __init__(self, builds, workers=DEFAULT_MIRROR_WORKERS):
+        '''
+        :param builds: Buildserver object with the local products directory as dest
+        :param workers: number of parallel downloads
+        '''
+        self.builds = builds
+        self.workers = max(1, int(workers))
+
+    def select(self, products, platform=None, limit=None, regex=None, force_new=False):
+        '''
+        Returns the paths of the artifacts which should be mirrored and the
+        directories which belong to the selection.
+
+        :param products: list of products (linux, uboot, misc, rootfs)
+        :param platform: only this platform, all configured platforms if None
+        :param limit: newest limit builds per platform and product, None for all
+        :param regex: only artifacts whose path matches regex
+        :param force_new: ask the buildserver for new builds instead of using the builds of a former call
+        :return: tuple with list of artifact paths and set of directories
+        '''
+        build_info = self.builds.get_builds_info(force_new=force_new, limit=limit, products=products)
+        file_info = self.builds.get_build_info(build_info, products, platform)
+
+        re_file = re.compile(regex) if regex else None
+        paths = []
+        directories = set()
+        for plat, products_info in file_info.items():
+            for product, files_info in products_info.items():
+                if product == 'rootfs':
+                    candidates = [('rootfs/{}'.format(t), f) for t, fs in files_info.items() for f in fs]
+                else:
+                    candidates = [('{}/{}'.format(product, plat), f) for f in files_info]
+
+                for directory, f in candidates:
+                    directories.add(directory)
+                    path = '{}/{}'.format(directory, f)
+                    if (re_file is None or re_file.search(path)) and path not in paths:
+                        paths.append(path)
+
+        return paths, directories
+
+    def mirror(self, products, platform=None, limit=None, regex=None, prune=False, force_new=False):
+        '''
+        Downloads all selected artifacts which are not yet present and verified.
+
+        :param products: list of products (linux, uboot, misc, rootfs)
+        :param platform: only this platform, all configured platforms if None
+        :param limit: newest limit builds per platform and product, None for all
+        :param regex: only artifacts whose path matches regex
+        :param prune: remove artifacts of the selected directories which were not selected
+        :param force_new: see select
+        :return: dictionary with lists of the paths which were present, downloaded, failed and pruned
+        '''
+        paths, directories = self.select(products, platform, limit, regex, force_new)
+        result = {'present': [], 'downloaded': [], 'failed': [], 'pruned': []}
+
+        to_fetch = []
+        for path in paths:
+            if os.path.isfile(self.builds.cache.path(path)) and \
+                    self.builds.cache.lookup(path, self.builds.get_file_size(path)):
+                result['present'].append(path)
+            else:
+                to_fetch.append(path)
+
+        print(Fore.YELLOW + '  {} artifacts selected, {} already present, {} to download'
+              .format(len(paths), len(result['present']), len(to_fetch)))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(path, executor.submit(self.builds.get_file, path, True)) for path in to_fetch]
+            try:
+                for i, (path, future) in enumerate(futures, 1):
+                    try:
+                        dest_file, size = future.result()
+                    except (BuildserverConnectionError, BuildserverPackageError, IOError) as e:
+                        log.warning('Mirror of {} failed: {}'.format(path, e))
+                        print(Fore.RED + '  [{}/{}] {} failed: {}'.format(i, len(futures), path, e))
+                        result['failed'].append(path)
+                        continue
+
+                    print('  [{}/{}] {} ({:.1f} MBytes)'.format(i, len(futures), path, size / (1024.0 * 1024.0)))
+                    result['downloaded'].append(path)
+            except BaseException:
+                for _, future in futures:
+                    future.cancel()
+                raise
+
+        if prune:
+            result['pruned'] = self.prune(directories, paths)
+
+        self.builds.cache.save()
+
+        return result
+
+    def prune(self, directories, keep):
+        '''
+        Removes artifacts from the given directories of the destination.
+
+        :param directories: directories relative to the destination
+        :param keep: artifacts which are kept
+        :return: list of removed artifacts
+        '''
+        keep = set(keep)
+        removed = []
+        for directory in sorted(directories):
+            path = self.builds.cache.path(directory)
+            if not os.path.isdir(path):
+                continue
+
+            with os.scandir(path) as it:
+                names = [e.name for e in it if e.is_file() and not e.name.startswith('.')]
+
+            for name in sorted(names):
+                artifact = '{}/{}'.format(directory, name)
+                if artifact in keep or name.endswith(PARTIAL_SUFFIXES):
+                    continue
+
+                print(Fore.YELLOW + '  Remove {}'.format(artifact))
+                self.builds.cache.remove(artifact)
+                removed.append(artifact)
+
+        return removed
@@ -0,0 +1,88 @@
+__author__ = 'mahieke'
+
+from colorama import Fore
+from datetime import datetime
+import logging as log
+import threading
+import time
+
+from flashtool.server.buildserver import BuildserverConnectionError
+from flashtool.server.mirror import Mirror, DEFAULT_MIRROR_WORKERS
+
+DEFAULT_WATCH_INTERVAL = 300
+
+
+class Watcher():
+    '''
+    Polls the buildserver for new builds of the configured platforms and downloads
+    their artifacts in the background, so a following setup finds the build
+    information in the catalogs and the files in the artifact cache.
+
+    A poll costs a conditional request for the root document and for the last build
+    of each builder. Builds which are known from the build catalog are not requested
+    again, only the artifacts of new builds are downloaded.
+    '''
+
+    def __init__(self, builds, products, limit=1, interval=DEFAULT_WATCH_INTERVAL, workers=DEFAULT_MIRROR_WORKERS,
+                 platform=None, regex=None):
+        '''
+        :param builds: Buildserver object, its artifact cache receives the downloads
+        :param products: list of products (linux, uboot, misc, rootfs)
+        :param limit: newest limit builds per platform and product which are kept available
+        :param interval: seconds between the start of two polls
+        :param workers: number of parallel downloads
+        :param platform: only this platform, all configured platforms if None
+        :param regex: only artifacts whose path matches regex
+        '''
+        self.builds = builds
+        self.products = products
+        self.limit = limit
+        self.interval = max(0, interval)
+        self.platform = platform
+        self.regex = regex
+        self.mirror = Mirror(builds, workers)
+        self.stop_event = threading.Event()
+
+    def poll(self):
+        '''
+        Checks the buildserver once and downloads the artifacts of new builds.
+
+        :return: dictionary like Mirror.mirror
+        '''
+        # every poll asks the server, also without limit, when the builds of the former poll
+        # would be returned otherwise. Unchanged builder documents are answered with 304 from
+        # the response cache.
+        return self.mirror.mirror(self.products, self.platform, self.limit, self.regex, force_new=True)
+
+    def run(self, rounds=None):
+        '''
+        Polls the buildserver until stop is called. Connection problems are logged
+        and the next poll is tried after the interval.
+
+        :param rounds: number of polls, None for no limit
+        :return: None
+        '''
+        done = 0
+        while not self.stop_event.is_set():
+            start = time.time()
+            print(Fore.YELLOW + '  [{}] Check for new builds'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            try:
+                result = self.poll()
+                if result['downloaded'] or result['failed']:
+                    print(Fore.GREEN + '  {} downloaded, {} failed'
+                          .format(len(result['downloaded']), len(result['failed'])))
+            except BuildserverConnectionError as e:
+                log.warning('Watch poll failed: {}'.format(e.message))
+                print(Fore.RED + '  {}'.format(e.message))
+
+            done += 1
+            if rounds is not None and done >= rounds:
+                break
+
+            self.stop_event.wait(max(0, self.interval - (time.time() - start)))
+
+    def stop(self):
+        '''
+        Ends run after the current poll.
+        '''
+        self.stop_event.set()
@@ -6,33 +6,57 @@ from flashtool.setup.recipe import RecipeImportException
 from flashtool.setup.recipe import RecipeContentException
 from flashtool.setup.recipe import load_recipes
 from flashtool.setup.deploy import get_setup_step
-from flashtool.server.buildserver import Buildserver, LocalBuilds
+from flashtool.server.buildserver import get_buildserver, LocalBuilds
+from flashtool.setup.devlayout.golden import DEFAULT_GOLDEN_IMAGES
 
 class Setup():
     '''
     Setup procedure for a platform.
     '''
 
-    def __init__(self, url, actions, recipe_file, auto, platform, user_dest=None):
+    def __init__(self, url, actions, recipe_file, auto, platform, user_dest=None, working_dir=None, cache_quota=0,
+                 stream=False, offline=False, image=None, image_size=None, golden=False,
+                 golden_keep=DEFAULT_GOLDEN_IMAGES, card_params=None):
         # get existing builds from local directory or
         if url.get('dir'):
-            self.builds = LocalBuilds(url['dir'], platform)
+            self.builds = LocalBuilds(url['dir'], platform, working_dir)
         else:
             # buildserver
-            self.builds = Buildserver(url['server'], url['port'], platform, user_dest)
+            self.builds = get_buildserver(url, platform, user_dest, working_dir, cache_quota, offline)
 
         self.__setup_chain = []
         recipes = load_recipes(recipe_file)
 
         for recipe in recipes:
-            setup_class = get_setup_step(recipe.__class__.__name__)
-
-            self.__setup_chain.append(setup_class(recipe, actions, self.builds, platform, auto))
+            options = {'stream': stream, 'card_params': card_params}
+            if image or golden:
+                # the mmc recipe is run into an image file instead of a device
+                if not hasattr(recipe, 'partitions'):
+                    raise RecipeContentException('Recipe {} can not be deployed to an image file.'
+                                                 .format(recipe.__class__.__name__))
+                options.update(image_size=image_size)
+
+            if golden:
+                # the image is built once and written to every card
+                setup_class = get_setup_step('golden')
+                options.update(recipe_file=recipe_file, golden_dir='{}/golden'.format(working_dir or '/tmp/flashtool'),
+                               golden_keep=golden_keep)
+            elif image:
+                setup_class = get_setup_step('image')
+                options.update(image=image)
+            else:
+                setup_class = get_setup_step(recipe.__class__.__name__)
+
+            self.__setup_chain.append(setup_class(recipe, actions, self.builds, platform, auto, **options))
 
 
     def setup(self):
-        for obj in self.__setup_chain:
-            obj.prepare()
-
-        for obj in self.__setup_chain:
-            obj.load()
+        try:
+            for obj in self.__setup_chain:
+                obj.prepare()
+
+            for obj in self.__setup_chain:
+                obj.load()
+        finally:
+            # setup steps start their downloads while they are constructed
+            self.builds.cancel_prefetch()
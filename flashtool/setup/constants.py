@@ -11,6 +11,13 @@ mkfs_support = {
     'btrfs': ['mkfs.btrfs', '-f', '-L']
 }
 
+# mkfs options which initialize the inode tables and the journal while formatting,
+# a filesystem in an image does not rely on zeroed blocks of the device
+mkfs_eager_init = {
+    'ext4': ['-E', 'lazy_itable_init=0,lazy_journal_init=0'],
+    'ext3': ['-E', 'lazy_itable_init=0,lazy_journal_init=0']
+}
+
 mkfs_check = {
     'vfat':  ['mkfs.vfat', '-v'],
     'fat32':  ['mkfs.vfat', '-v'],
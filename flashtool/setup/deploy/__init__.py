@@ -13,7 +13,7 @@ class Deploy():
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod
-    def __init__(self, recipe, actions, builds, platform, auto):
+    def __init__(self, recipe, actions, builds, platform, auto, **options):
         pass
 
     @abc.abstractmethod
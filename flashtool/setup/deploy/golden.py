@@ -0,0 +1,195 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+
+__author__ = 'mahieke'
+
+import flashtool.setup.udev.mmc as udev
+from flashtool.server.artifactcache import sha256sum
+from flashtool.setup.deploy import Deploy
+from flashtool.setup.deploy.image import ImageDeploy
+from flashtool.setup.deploy.mmc import MMCDeploy
+from flashtool.setup.deploy.mmc import confirm_overwrite
+from flashtool.setup.deploy.personalise import CardParams
+from flashtool.setup.deploy.personalise import personalise_device
+from flashtool.setup.devlayout.bmap import bmap_path
+from flashtool.setup.devlayout.bmap import load_bmap
+from flashtool.setup.devlayout.bmap import write_image
+from flashtool.setup.devlayout.golden import GoldenImageCache
+from flashtool.setup.devlayout.golden import DEFAULT_GOLDEN_IMAGES
+from flashtool.setup.devlayout.blockdev import get_partitions
+
+from colorama import Fore
+import os
+
+
+class GoldenDeploy(Deploy):
+    '''
+    Sets up a mmc device with a cached image of the recipe (golden image). The
+    image is built once with ImageDeploy for a recipe file and the selected
+    files. Every card is set up by writing the mapped blocks of the image,
+    followed by a personalisation of the card. The image itself holds no
+    values of a card: the root password is not set and the machine id is empty.
+    '''
+    def __init__(self, recipe, actions, builds, platform, auto, recipe_file=None, golden_dir=None,
+                 golden_keep=DEFAULT_GOLDEN_IMAGES, image_size=None, card_params=None, **options):
+        '''
+        :param recipe_file: path of the recipe file, part of the key of the image
+        :param golden_dir: directory of the golden images
+        :param golden_keep: number of golden images which are kept
+        :param image_size: size of the image in bytes, None for the sum of the partitions
+        :param card_params: CardParams object for the personalisation, the user is asked
+                            for the root password if None
+        '''
+        self.builds = builds
+        self.platform = platform
+        self.auto = auto
+        self.cache = GoldenImageCache(golden_dir, golden_keep)
+        self.recipe_file = recipe_file
+        self.recipe_digest = sha256sum(recipe_file)
+        self.recipe = recipe
+        self.card_params = card_params
+
+        # a new golden image is built here and moved into the cache when it is finished
+        self.build_image = '{}/build-{}.img'.format(self.cache.directory, os.getpid())
+        self.image_deploy = ImageDeploy(recipe, actions, builds, platform, auto, image=self.build_image,
+                                        image_size=image_size, card_params=CardParams({'machine_id': 'empty'}),
+                                        **options)
+        self.load_cfg = self.image_deploy.load_cfg
+        self.image = None
+
+    def prepare(self):
+        '''
+        Looks up the golden image of the recipe and the selected files and builds it
+        if it is not cached.
+        '''
+        print(Fore.YELLOW + '   +-{}-+'.format('-'*21))
+        print(Fore.YELLOW + '   | {} |'.format('PREPARE GOLDEN IMAGE'.ljust(21)))
+        print(Fore.YELLOW + '   +-{}-+'.format('-'*21))
+        print('')
+
+        files = [(f_info['file'], self.__digest(f_info['file']))
+                 for product in self.load_cfg.values() for f_info in product]
+        key = self.cache.key(self.recipe_digest, self.platform, self.image_deploy.image_size, files)
+
+        self.image = self.cache.lookup(key)
+        if self.image:
+            print(Fore.GREEN + '   Use golden image {}'.format(self.image))
+            print('')
+            return
+
+        print(Fore.YELLOW + '   No golden image for these files. Build it...')
+        print('')
+        try:
+            self.image_deploy.prepare()
+            self.image_deploy.load()
+        except BaseException:
+            for path in (self.build_image, bmap_path(self.build_image)):
+                if os.path.isfile(path):
+                    os.remove(path)
+            raise
+
+        self.image = self.cache.add(key, self.build_image, {
+            'recipe': self.recipe_file,
+            'platform': self.platform,
+            'files': files,
+        })
+        print(Fore.GREEN + '   Stored golden image {}'.format(self.image))
+        print('')
+
+    def load(self):
+        '''
+        Writes the golden image to the mmc device and personalises it.
+        '''
+        print(Fore.YELLOW + '   +-{}-+'.format('-'*21))
+        print(Fore.YELLOW + '   | {} |'.format('WRITE GOLDEN IMAGE'.ljust(21)))
+        print(Fore.YELLOW + '   +-{}-+'.format('-'*21))
+        print('')
+
+        device = udev.get_mmc_device(self.auto)[0]['path']
+        # the auto mode only skips the selection of products, the card is never overwritten unasked
+        confirm_overwrite(MMCDeploy.target)
+        self.write(device, self.card_params)
+        print(Fore.GREEN + '   MMC setup DONE!')
+
+    def write(self, device, card_params=None, progress=None, tmp_dir='/tmp/flashtool'):
+        '''
+        Writes the golden image, which was looked up or built by prepare, to a device
+        and personalises it, see write_golden_image.
+        '''
+        write_golden_image(self.image, device, card_params, self.rootfs_device(), progress, tmp_dir)
+
+    def personalise(self, device, card_params=None, tmp_dir='/tmp/flashtool'):
+        '''
+        Personalises a device with the golden image, see personalise_golden_image.
+        '''
+        personalise_golden_image(device, card_params, self.rootfs_device(), tmp_dir)
+
+    def rootfs_device(self):
+        '''
+        Returns the number of the partition which holds the rootfs, None if the recipe
+        does not say it.
+        '''
+        for f_info in self.load_cfg.get('rootfs', []):
+            if f_info['yaml'].device is not None:
+                return f_info['yaml'].device
+
+        return None
+
+    def __digest(self, file):
+        '''
+        Returns the sha256 of a file of the builds. The file is downloaded if it is not
+        present, the artifact cache of a buildserver knows the digest then.
+        '''
+        path, size = self.builds.prefetch(file).result()
+
+        cache = getattr(self.builds, 'cache', None)
+        digest = cache.digest(file) if cache is not None else None
+
+        return digest or self.cache.file_digest(path)
+
+
+def write_golden_image(image, device, card_params=None, rootfs=None, progress=None, tmp_dir='/tmp/flashtool'):
+    '''
+    Writes the mapped blocks of a golden image to a device and personalises it.
+
+    :param image: path of the golden image, its block map is next to it
+    :param device: path of the mmc device
+    :param card_params: CardParams object, the user is asked for the root password if None
+    :param rootfs: number of the rootfs partition, it is searched if None
+    :param progress: function(message) which is called at every step
+    :param tmp_dir: directory for the mount points
+    '''
+    progress = progress or (lambda message: None)
+    bmap = load_bmap(bmap_path(image))
+
+    mapped = bmap['mapped'] / (1024.0 * 1024.0)
+    print('   Write {:.1f} of {:.1f} MBytes to {}'.format(mapped, bmap['image_size'] / (1024.0 * 1024.0), device))
+    progress('write {:.1f} MBytes'.format(mapped))
+
+    def reporthook(written, total):
+        print('\r   {:.1f}/{:.1f} MBytes'.format(written / (1024.0 * 1024.0), mapped), end='')
+
+    write_image(image, device, bmap, reporthook=reporthook)
+    print('')
+
+    progress('personalise')
+    personalise_golden_image(device, card_params, rootfs, tmp_dir)
+
+
+def personalise_golden_image(device, card_params=None, rootfs=None, tmp_dir='/tmp/flashtool'):
+    '''
+    Applies the values of the card: new filesystem uuids, fstab, root password,
+    hostname and machine id.
+
+    :param device: path of the mmc device
+    :param card_params: CardParams object, the user is asked for the root password if None
+    :param rootfs: number of the rootfs partition, it is searched if None
+    :param tmp_dir: directory for the mount points
+    '''
+    print(Fore.YELLOW + '   Personalise {}'.format(device))
+    partitions = get_partitions(device)
+    personalise_device(partitions, card_params or CardParams(), partitions[rootfs] if rootfs is not None else None,
+                       ask_password=card_params is None, tmp_dir=tmp_dir)
+
+
+__entry__ = GoldenDeploy
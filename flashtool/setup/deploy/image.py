@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+
+__author__ = 'mahieke'
+
+from flashtool.setup.deploy.mmc import MMCDeploy
+from flashtool.setup.devlayout.image import get_image_size
+from flashtool.setup.devlayout.image import create_sparse_image
+from flashtool.setup.devlayout.image import attach_loop
+from flashtool.setup.devlayout.image import detach_loop
+from flashtool.setup.devlayout.image import get_partition_info
+from flashtool.setup.devlayout.bmap import generate_bmap
+from flashtool.setup.devlayout.bmap import save_bmap
+from flashtool.setup.devlayout.bmap import bmap_path
+
+from colorama import Fore
+import parted
+import os
+
+
+class ImageDeployError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
+
+
+class ImageDeploy(MMCDeploy):
+    '''
+    Runs a mmc recipe into a sparse image file instead of a mmc device. The
+    partitions are formatted and loaded through loop devices at their offsets
+    in the image, so no udev device is needed. The image can be written to a
+    mmc device afterwards.
+    '''
+    target = 'image file'
+    # the image is written without its holes, so the filesystems are fully initialized
+    lazy_init = False
+
+    def __init__(self, recipe, actions, builds, platform, auto, image=None, image_size=None, **options):
+        '''
+        :param image: path of the image file
+        :param image_size: size of the image in bytes, None for the sum of the partitions
+        '''
+        if not image:
+            raise ImageDeployError('No image file is given.')
+
+        self.image = os.path.abspath(image)
+        self.image_size = get_image_size(recipe.partitions, image_size)
+        self.__loops = []
+        self.__sizes = {}
+
+        MMCDeploy.__init__(self, recipe, actions, builds, platform, auto, **options)
+
+    def _get_device(self):
+        print('Image file: {} ({} MB)'.format(self.image, self.image_size / (1024 * 1024)))
+        return {'path': self.image, 'size': self.image_size}, []
+
+    def _confirm(self):
+        # a new image file overwrites nothing
+        if os.path.exists(self.image):
+            MMCDeploy._confirm(self)
+
+    def _init_device(self, path):
+        print(Fore.YELLOW + '   Create sparse image {}'.format(path))
+        create_sparse_image(path, self.image_size)
+
+    def _partition_paths(self, path, prepared):
+        '''
+        Attaches the whole image and each partition as loop device.
+        '''
+        if not os.path.isfile(path):
+            raise ImageDeployError('Image file {} does not exist.'.format(path))
+
+        device = parted.getDevice(path)
+        partitions = parted.newDisk(device).partitions
+
+        self.__release_loops()
+        dev_path = self.__attach(path)
+
+        self.__sizes = {}
+        paths = []
+        for part in partitions:
+            size = part.geometry.length * device.sectorSize
+            loop = self.__attach(path, part.geometry.start * device.sectorSize, size)
+            self.__sizes[loop] = size
+            paths.append(loop)
+
+        return dev_path, paths
+
+    def _get_load_info(self, partitions):
+        return [get_partition_info(part, self.__sizes.get(part)) for part in partitions]
+
+    def _release(self):
+        self.__release_loops()
+
+    def finish_deployment(self):
+        MMCDeploy.finish_deployment(self)
+
+        print(Fore.YELLOW + '   Create block map of image...')
+        bmap = generate_bmap(self.image)
+        save_bmap(bmap, bmap_path(self.image))
+        print(Fore.GREEN + '   Image {} is ready ({:.1f} of {:.1f} MBytes mapped).'
+              .format(self.image, bmap['mapped'] / (1024.0 * 1024.0), bmap['image_size'] / (1024.0 * 1024.0)))
+
+    def __attach(self, path, offset=0, size=None):
+        loop = attach_loop(path, offset, size)
+        print('   Attach {} (offset: {}) to {}'.format(path, offset, loop))
+        self.__loops.append(loop)
+        return loop
+
+    def __release_loops(self):
+        while self.__loops:
+            loop = self.__loops.pop()
+            print('   Detach {}'.format(loop))
+            detach_loop(loop)
+
+
+__entry__ = ImageDeploy
@@ -1,6 +1,11 @@
 __author__ = 'mahieke'
 from colorama import Fore
 
+from flashtool.server.buildserver import BuildserverFilesNotFound
+from flashtool.setup.deploy.personalise import ask_root_password
+from flashtool.setup.deploy.personalise import set_shadow_password
+import os
+
 def get_products_by_recipe_user_input(recipe, actions, builds, platform, auto):
     '''
     Returns a dictionary with information for each product. The information
@@ -17,7 +22,10 @@ def get_products_by_recipe_user_input(recipe, actions, builds, platform, auto):
     yaml_info = merge_load_recipe_with_user_input(recipe, actions)
     load_cfg = {}
 
-    build_info = builds.get_builds_info()
+    # auto mode takes the newest build, so only the newest build of each product is fetched first
+    limited = auto
+    build_info = builds.get_builds_info(limit=1, products=list(yaml_info.keys())) if limited \
+        else builds.get_builds_info()
 
     load_order = ['rootfs', 'uboot', 'linux', 'misc']
     for product in load_order:
@@ -38,7 +46,17 @@ def get_products_by_recipe_user_input(recipe, actions, builds, platform, auto):
 
         print(Fore.YELLOW + '   +-{}-+'.format('-'*(12+a)))
 
-        files = builds.get_files_path(file_info, reg_name, [(product, file_types)], auto)[0][1]
+        try:
+            files = builds.get_files_path(file_info, reg_name, [(product, file_types)], auto)[0][1]
+        except BuildserverFilesNotFound:
+            if not limited:
+                raise
+
+            print(Fore.YELLOW + '  Newest build does not match. Search the whole history.')
+            limited = False
+            build_info = builds.get_builds_info()
+            file_info = builds.get_build_info(build_info, [product], platform)
+            files = builds.get_files_path(file_info, reg_name, [(product, file_types)], auto)[0][1]
 
         load_cfg[product] = []
         for f_type, file in files:
@@ -112,12 +130,6 @@ def merge_load_recipe_with_user_input(load_recipe, user_actions):
     return yaml_info
 
 
-import crypt
-import getpass
-import subprocess
-import os
-import datetime
-
 def set_root_password(path_to_rootfs):
     '''
     User can set a root password for the linux system.
@@ -131,37 +143,4 @@ def set_root_password(path_to_rootfs):
     if not os.path.exists(path):
         raise FileNotFoundError('Could not find {}'.format(path))
 
-    pw = 'toor'
-    pw_check = ''
-
-    while True:
-        print('')
-        print('Please set a root password for the system or press enter for default password [default \'toor\']:')
-        pw = getpass.getpass()
-
-        if pw == '':
-            pw = 'toor'
-            break
-        else:
-            print('Please repeat the password')
-            pw_check = getpass.getpass()
-
-            if pw == pw_check:
-                break
-            else:
-                print('Password was not the same.')
-
-    subprocess.call(['sed', '-i', '1d', path])
-
-    # salt will be generated automatically
-    encrypted_pw = crypt.crypt(pw)
-
-    epoch = datetime.datetime.utcfromtimestamp(0)
-    today = datetime.datetime.today()
-    days = (today - epoch).days
-
-    shadow_string = 'root:{}:{}:::::\n'.format(encrypted_pw, days)
-
-    with open(path, 'a') as shadow:
-        shadow.write(shadow_string)
-
+    set_shadow_password(path_to_rootfs, ask_root_password())
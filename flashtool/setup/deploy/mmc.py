@@ -8,6 +8,7 @@ from flashtool.setup.deploy import Deploy
 import flashtool.utility as util
 from flashtool.setup.deploy.load import get_products_by_recipe_user_input
 from flashtool.setup.deploy.load import set_root_password
+from flashtool.setup.deploy.personalise import personalise_rootfs
 from flashtool.setup.deploy.templateloader import fstab_info
 from flashtool.setup.deploy.templateloader import generate_fstab
 from flashtool.setup.deploy.templateloader import get_fstab_fstype
@@ -42,7 +43,24 @@ class MMCDeploy(Deploy):
     '''
     This class represents all needed steps setting up a mmc device.
     '''
-    def __init__(self, recipe, actions, builds, platform, auto):
+    # name of the target in the user prompts
+    target = 'mmc device'
+    # mkfs may leave the inode tables and the journal to the kernel
+    lazy_init = True
+
+    def __init__(self, recipe, actions, builds, platform, auto, stream=False, card_params=None, device=None,
+                 load_cfg=None, confirm=True, tmp_dir='/tmp/flashtool', progress=None):
+        '''
+        :param stream: Tarballs which are extracted on a partition are streamed from the
+                       server through the tar reader instead of downloading them first.
+        :param card_params: CardParams object with the values of the card (root password,
+                            hostname, machine id). The user is asked for the root password if None.
+        :param device: device in the format of udev.get_mmc_device, it is recognized if None
+        :param load_cfg: products which were already selected, see get_products_by_recipe_user_input
+        :param confirm: ask the user before the device is overwritten
+        :param tmp_dir: directory for mount points and extracted files
+        :param progress: function(message) which is called at every step
+        '''
         # get information from recipe
         self.recipe = {
             'partition_table': recipe.partition_table,
@@ -52,11 +70,25 @@ class MMCDeploy(Deploy):
         self.platform = platform
         self.builds = builds
         self.auto = auto
-        self.__udev = udev.get_mmc_device()
+        self.stream = stream
+        self.card_params = card_params
+        self.confirm = confirm
+        self.tmp_dir = tmp_dir.rstrip('/')
+        self.progress = progress or (lambda message: None)
+        self.__udev = device or self._get_device()
         self.__partition_info = None
         self.__mounted_devs = {}
 
-        self.load_cfg = get_products_by_recipe_user_input(recipe.load, actions, builds, platform, auto)
+        if load_cfg is None:
+            load_cfg = get_products_by_recipe_user_input(recipe.load, actions, builds, platform, auto)
+        self.load_cfg = load_cfg
+
+        # download the files while the device is prepared
+        self.__fetches = {}
+        for files in self.load_cfg.values():
+            for f_info in files:
+                if not self.__is_streamed(f_info):
+                    self.__fetches[f_info['file']] = self.builds.prefetch(f_info['file'])
 
     def prepare(self):
         '''
@@ -78,25 +110,24 @@ class MMCDeploy(Deploy):
             i += 1
 
         print('')
-        answer = util.user_prompt('Do you want to continue? This will overwrite the whole mmc device', 'Answer', "YyNn")
+        if self.confirm:
+            self._confirm()
 
-        if re.match("[Nn]", answer):
-            print(Fore.RED + 'ABORT!')
-            exit(0)
-
-        check_disk(device[0]['path'])
+        self._init_device(device[0]['path'])
 
+        self.progress('partition {}'.format(device[0]['path']))
         new_partitions = partition(device[0]['path'], self.recipe['partition_table'], self.recipe['partitions'])
 
-        partitions = parted.newDisk(parted.getDevice(device[0]['path'])).partitions
+        dev_path, partitions = self._partition_paths(device[0]['path'], True)
 
         for index in range(0, len(partitions)):
-            new_partitions[index]['path'] = partitions[index].path
+            new_partitions[index]['path'] = partitions[index]
 
         print(Fore.YELLOW + '   Format partitions {}:'.format(', '.join([p['path'] for p in new_partitions])))
-        format(new_partitions)
+        self.progress('format {} partitions'.format(len(new_partitions)))
+        format(new_partitions, lazy_init=self.lazy_init)
 
-        self.__partition_info = device[0]['path'], get_load_info([part.path for part in partitions])
+        self.__partition_info = dev_path, self._get_load_info(partitions)
 
         print('')
 
@@ -112,7 +143,8 @@ class MMCDeploy(Deploy):
         print('')
 
         if not self.__partition_info:
-            self.__partition_info = self.__udev[0]['path'], get_load_info([part['path'] for part in self.__udev[1]])
+            dev_path, partitions = self._partition_paths(self.__udev[0]['path'], False)
+            self.__partition_info = dev_path, self._get_load_info(partitions)
 
         # check if existing partitions match with recipe
         if len(self.__partition_info[1]) != len(self.recipe['partitions']):
@@ -156,15 +188,26 @@ class MMCDeploy(Deploy):
         print('')
 
         load_order = ['rootfs', 'uboot', 'linux', 'misc']
+        tab_dev = None
 
         for product in load_order:
             if product in configure_chain:
                 print(Fore.YELLOW + '  [{}]:'.format(product))
+                self.progress('load {}'.format(product))
                 for f_info in self.load_cfg[product]:
+                    if self.__is_streamed(f_info):
+                        to_mount = self.__partition_info[1][f_info['yaml'].device]['path']
+                        self.__stream_to_partition(f_info['file'], to_mount)
+
+                        if product == 'rootfs':
+                            tab_dev = to_mount
+                        print('')
+                        continue
+
                     done = False
                     while not done:
                         try:
-                            src, size = self.builds.get_file(f_info['file'])
+                            src, size = self.__get_file(f_info['file'])
                         except Exception as e:
                             print(Fore.YELLOW + '   Error during Download process.')
                             print(Fore.RED    + '   {}'.format(repr(e)))
@@ -188,7 +231,7 @@ class MMCDeploy(Deploy):
 
                     if f_info['yaml'].device is not None:
                         to_mount = self.__partition_info[1][f_info['yaml'].device]['path']
-                        dest = '/tmp/flashtool/{}'.format(to_mount.split('/')[-1])
+                        dest = '{}/{}'.format(self.tmp_dir, to_mount.split('/')[-1])
 
                         if not self.__mounted_devs.get(to_mount):
                             self.__mount(to_mount, dest)
@@ -208,7 +251,7 @@ class MMCDeploy(Deploy):
                             tab_dev = to_mount
                     else: # there is a command specified
                         from string import Template
-                        dest = '/tmp/flashtool'
+                        dest = self.tmp_dir
                         if tarfile.is_tarfile(src):
                             tar = tarfile.open(src, 'r')
                             if len(list(tar.getmembers())) != 1:
@@ -233,29 +276,138 @@ class MMCDeploy(Deploy):
                         cmd = [f_info['yaml'].command[0]] + Template(t_str).safe_substitute(file=file_name, device=dev).split()
                         print('   Execute command: {}'.format(' '.join(cmd)))
                         subprocess.call(cmd)
-                        os.remove(file_name)
+                        if file_name != src:
+                            # only the extracted file, src belongs to the cache or local products
+                            os.remove(file_name)
                         if product == 'rootfs':
                             tab_dev = dev
 
                     print('')
 
         if tab_dev:
-            tab_dest = '/tmp/flashtool/{}'.format(tab_dev.split('/')[-1])
+            tab_dest = '{}/{}'.format(self.tmp_dir, tab_dev.split('/')[-1])
             if not self.__mounted_devs.get(tab_dev):
                 self.__mount(tab_dev, tab_dest)
                 self.__mounted_devs.update({
                     tab_dev: tab_dest
                 })
 
+            self.progress('generate fstab')
             generate_fstab(fstab, tab_dest)
 
-        set_root_password('/tmp/flashtool/{}'.format(tab_dev.split('/')[-1]))
+            self._personalise_rootfs(tab_dest)
+
+    def _get_device(self):
+        '''
+        Returns the target device: a tuple with a dictionary with path and size of the
+        device and a list with information about its partitions.
+        '''
+        return udev.get_mmc_device()
+
+    def _confirm(self):
+        '''
+        Asks the user before the device is overwritten.
+        '''
+        confirm_overwrite(self.target)
+
+    def _init_device(self, path):
+        '''
+        Called before the device is partitioned.
+
+        :param path: path of the device
+        '''
+        check_disk(path)
+
+    def _partition_paths(self, path, prepared):
+        '''
+        Returns the paths which are used to load the products.
+
+        :param path: path of the device
+        :param prepared: True if the device was partitioned by prepare
+        :return: tuple with the path of the whole device and a list with the paths of the partitions
+        '''
+        if prepared:
+            return path, [part.path for part in parted.newDisk(parted.getDevice(path)).partitions]
+
+        return path, [part['path'] for part in self.__udev[1]]
+
+    def _get_load_info(self, partitions):
+        '''
+        Returns information about the partitions for the load step, see get_load_info.
+        '''
+        return get_load_info(partitions)
+
+    def _personalise_rootfs(self, path):
+        '''
+        Sets the values of the card in the loaded rootfs.
+
+        :param path: mount point of the rootfs
+        '''
+        if self.card_params is None:
+            set_root_password(path)
+        else:
+            personalise_rootfs(path, self.card_params)
+
+    def _release(self):
+        '''
+        Called after the partitions were unmounted.
+        '''
+        pass
+
+    def __is_streamed(self, f_info):
+        return self.stream and f_info['yaml'].device is not None and is_tarball(f_info['file'])
+
+    def __get_file(self, file):
+        '''
+        Returns the result of the background download of a file. If there is none or
+        it failed, the file is downloaded in the foreground.
+
+        :param file: path of the file on the server
+        :return: tuple with local path and size of the file
+        '''
+        future = self.__fetches.pop(file, None)
+        if future is not None:
+            print('   Wait for download of {}'.format(file.split('/')[-1]))
+            try:
+                return future.result()
+            except Exception as e:
+                print(Fore.YELLOW + '   Background download failed: {}'.format(repr(e)))
+
+        return self.builds.get_file(file)
+
+    def __stream_to_partition(self, file, to_mount):
+        '''
+        Extracts a tarball from the server directly on a partition. The data is
+        hashed while it is extracted and verified afterwards.
+
+        :param file: path of the tarball on the server
+        :param to_mount: dev path of the partition
+        :return: None
+        '''
+        dest = '{}/{}'.format(self.tmp_dir, to_mount.split('/')[-1])
+
+        if not self.__mounted_devs.get(to_mount):
+            self.__mount(to_mount, dest)
+            self.__mounted_devs.update({
+                to_mount: dest
+            })
+
+        stream = self.builds.open_stream(file)
+        try:
+            print('   Extracting tar stream {}'.format(file.split('/')[-1]))
+            util.untar(stream, dest)
+            digest = stream.verify()
+            print(Fore.GREEN + '   Verified {} (sha256: {})'.format(file.split('/')[-1], digest))
+        finally:
+            stream.close()
 
     def finish_deployment(self):
         print(Fore.YELLOW + '   Nearly finished. Syncing device...')
+        self.progress('sync')
         subprocess.call('sync')
         print(Fore.YELLOW + '   Ready to umount devices...')
         self.__umount()
+        self._release()
         print(Fore.GREEN + '   MMC setup DONE!')
 
     def __mount(self, to_mount, dest_mount_point):
@@ -284,8 +436,31 @@ class MMCDeploy(Deploy):
             self.__umount()
         except Exception as e:
             print(Fore.RED + '   {}'.format(e.message))
+        self._release()
+
+
+
+def confirm_overwrite(target):
+    '''
+    Asks the user before a device is overwritten and exits if the user declines.
+
+    :param target: description of the device, e.g. 'mmc device'
+    :return: None
+    '''
+    answer = util.user_prompt('Do you want to continue? This will overwrite the whole {}'.format(target),
+                              'Answer', "YyNn")
+
+    if re.match("[Nn]", answer):
+        print(Fore.RED + 'ABORT!')
+        exit(0)
 
 
+def is_tarball(file):
+    '''
+    Decides by the file name if a file is a (compressed) tarball.
+    '''
+    return re.match(r'.*\.(tar|tar\.gz|tgz|tar\.bz2|tbz2?|tar\.xz|txz)$', file) is not None
+
 
 def get_load_info(partitions):
     '''
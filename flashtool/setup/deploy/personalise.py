@@ -0,0 +1,379 @@
+'''
+Personalisation of a card after an image was written to it. Everything
+which differs between cards is changed here, so the image itself can be
+shared: filesystem uuids (and fstab), the root password in /etc/shadow,
+hostname and machine-id. The values come from a card parameter file:
+
+    hostname: board-042
+    root_password: secret          # or root_password_hash: $6$...
+    machine_id: random             # random, empty (set on first boot) or 32 hex digits
+    uuids: true                    # give the filesystems new uuids
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+
+__author__ = 'mahieke'
+
+import flashtool.utility as util
+from flashtool.setup.devlayout.image import get_partition_info
+from flashtool.setup.recipe import RecipeContentException
+
+from colorama import Fore
+import crypt
+import datetime
+import getpass
+import os
+import random
+import re
+import struct
+import subprocess
+import uuid
+import yaml
+
+# offsets of the volume id in the boot sector of fat filesystems
+FAT32_VOLUME_ID = 0x43
+FAT16_VOLUME_ID = 0x27
+# fat32 keeps a backup of the boot sector in sector 6
+FAT32_BACKUP_SECTOR = 6 * 512
+# filesystems which can hold a rootfs
+ROOTFS_FS_TYPES = ('ext2', 'ext3', 'ext4', 'btrfs', 'xfs', 'f2fs')
+
+
+def renew_uuid(device, fs_type, fs_version=None):
+    '''
+    Gives the filesystem of a partition a new random uuid. Cards which were
+    written from the same image have the same uuids otherwise.
+
+    :param device: path of the partition
+    :param fs_type: filesystem type as reported by blkid
+    :param fs_version: filesystem version as reported by blkid (FAT12, FAT16, FAT32)
+    :return: the new uuid in the format of blkid, None if the filesystem is not supported
+    '''
+    if fs_type in ('ext2', 'ext3', 'ext4'):
+        # tune2fs only changes the uuid of a filesystem with metadata_csum if it was checked
+        # right before. e2fsck exits with 1 if it corrected something, that is fine here.
+        command = ['e2fsck', '-f', '-y', device]
+        returncode = subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if returncode > 1:
+            raise util.SubprocessCallException('"{}" COMMAND FAILED:'.format(' '.join(command)),
+                                               ['exit code {}'.format(returncode)])
+
+        new_uuid = str(uuid.uuid4())
+        util.os_call(['tune2fs', '-U', new_uuid, device], allow_user_interrupt=False)
+    elif fs_type == 'btrfs':
+        new_uuid = str(uuid.uuid4())
+        util.os_call(['btrfstune', '-f', '-U', new_uuid, device], allow_user_interrupt=False)
+    elif fs_type == 'vfat':
+        volume_id = random.getrandbits(32)
+        data = struct.pack('<I', volume_id)
+        fd = os.open(device, os.O_WRONLY)
+        try:
+            if fs_version == 'FAT32':
+                os.pwrite(fd, data, FAT32_VOLUME_ID)
+                os.pwrite(fd, data, FAT32_BACKUP_SECTOR + FAT32_VOLUME_ID)
+            else:
+                os.pwrite(fd, data, FAT16_VOLUME_ID)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        new_uuid = '{:04X}-{:04X}'.format(volume_id >> 16, volume_id & 0xFFFF)
+    else:
+        return None
+
+    return new_uuid
+
+
+def renew_uuids(partitions):
+    '''
+    Gives all filesystems new uuids. A filesystem whose uuid can not be changed
+    keeps it, so the fstab stays valid for it.
+
+    :param partitions: list with paths of the partitions
+    :return: dictionary {old uuid: new uuid}
+    '''
+    uuids = {}
+    for path in partitions:
+        info = get_partition_info(path)
+        if not info['uuid']:
+            continue
+
+        try:
+            new_uuid = renew_uuid(path, info['fs_type'], info['fs_version'])
+        except (util.SubprocessCallException, util.TimeoutException, OSError) as e:
+            print(Fore.RED + '   Could not give {} ({}) a new uuid, it keeps {}:'.format(path, info['fs_type'],
+                                                                                        info['uuid']))
+            print(Fore.RED + '   {}'.format(e))
+            continue
+
+        if new_uuid:
+            print('   New uuid of {} ({}): {}'.format(path, info['fs_type'], new_uuid))
+            uuids[info['uuid']] = new_uuid
+        else:
+            print(Fore.YELLOW + '   Filesystem {} of {} keeps its uuid.'.format(info['fs_type'], path))
+
+    return uuids
+
+
+def replace_uuids(path, uuids):
+    '''
+    Replaces the old uuids in a file, e.g. etc/fstab of the rootfs.
+
+    :param path: path of the file
+    :param uuids: dictionary {old uuid: new uuid}
+    :return: True if the file was changed
+    '''
+    if not os.path.isfile(path):
+        return False
+
+    with open(path, 'r') as f:
+        content = f.read()
+
+    new_content = content
+    for old, new in uuids.items():
+        new_content = new_content.replace(old, new)
+
+    if new_content == content:
+        return False
+
+    with open(path, 'w') as f:
+        f.write(new_content)
+
+    return True
+
+
+class CardParams():
+    '''
+    Parameters of one card. Attributes which are not set keep the value of the image.
+    '''
+    attr = ['hostname', 'root_password', 'root_password_hash', 'machine_id', 'uuids']
+
+    def __init__(self, attributes=None):
+        attributes = attributes or {}
+        for a in attributes.keys():
+            if a not in self.attr:
+                raise RecipeContentException('Attribute {} is not allowed for card parameters'.format(a))
+
+        self.hostname = attributes.get('hostname')
+        self.root_password = attributes.get('root_password')
+        self.root_password_hash = attributes.get('root_password_hash')
+        self.machine_id = attributes.get('machine_id', 'random')
+        self.uuids = bool(attributes.get('uuids', True))
+
+        if self.hostname is not None and not re.match(r'^[A-Za-z0-9][A-Za-z0-9.-]{0,62}$', str(self.hostname)):
+            raise RecipeContentException('Hostname {} is not valid.'.format(self.hostname))
+
+        if self.machine_id not in (None, 'random', 'empty') and not re.match(r'^[0-9a-f]{32}$', str(self.machine_id)):
+            raise RecipeContentException('Machine id {} is not valid, must be random, empty or 32 hex digits.'
+                                         .format(self.machine_id))
+
+    def __repr__(self):
+        return '{} ({})'.format(self.__class__.__name__, {k: v for k, v in self.__dict__.items()
+                                                          if k != 'root_password'})
+
+
+def load_card_params(path):
+    '''
+    Loads the parameters of a card from a yaml file.
+
+    :param path: path of the parameter file
+    :return: CardParams object
+    '''
+    with open(path, 'r') as f:
+        attributes = yaml.safe_load(f)
+
+    if attributes is not None and not isinstance(attributes, dict):
+        raise RecipeContentException('Card parameter file {} must contain a mapping.'.format(path))
+
+    return CardParams(attributes)
+
+
+def ask_root_password():
+    '''
+    Asks the user for the root password of the system.
+
+    :return: password, 'toor' if the user only presses enter
+    '''
+    while True:
+        print('')
+        print('Please set a root password for the system or press enter for default password [default \'toor\']:')
+        pw = getpass.getpass()
+
+        if pw == '':
+            return 'toor'
+
+        print('Please repeat the password')
+        if pw == getpass.getpass():
+            return pw
+
+        print('Password was not the same.')
+
+
+def set_shadow_password(path_to_rootfs, password=None, password_hash=None):
+    '''
+    Replaces the password of root in /etc/shadow of a rootfs.
+
+    :param path_to_rootfs: path to the mounted rootfs
+    :param password: password in plain text, it is hashed with sha512
+    :param password_hash: password hash in the format of crypt, used instead of password
+    :return: None
+    '''
+    path = '{}/etc/shadow'.format(path_to_rootfs.rstrip('/'))
+    if not os.path.exists(path):
+        raise FileNotFoundError('Could not find {}'.format(path))
+
+    if password_hash is None:
+        password_hash = crypt.crypt(password, crypt.mksalt(crypt.METHOD_SHA512))
+
+    days = (datetime.datetime.today() - datetime.datetime.utcfromtimestamp(0)).days
+
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+
+    entry = None
+    for i, line in enumerate(lines):
+        fields = line.split(':')
+        if fields[0] == 'root':
+            # keep the aging fields of the entry
+            fields += [''] * (9 - len(fields))
+            fields[1] = password_hash
+            fields[2] = str(days)
+            entry = lines[i] = ':'.join(fields)
+            break
+
+    if entry is None:
+        lines.insert(0, 'root:{}:{}:::::'.format(password_hash, days))
+
+    _write_file(path, '\n'.join(lines) + '\n')
+
+
+def set_hostname(path_to_rootfs, hostname):
+    '''
+    Writes /etc/hostname and the 127.0.1.1 entry of /etc/hosts.
+    '''
+    root = path_to_rootfs.rstrip('/')
+    _write_file('{}/etc/hostname'.format(root), '{}\n'.format(hostname))
+
+    hosts = '{}/etc/hosts'.format(root)
+    lines = []
+    if os.path.isfile(hosts):
+        with open(hosts, 'r') as f:
+            lines = f.read().splitlines()
+
+    entry = '127.0.1.1\t{}'.format(hostname)
+    for i, line in enumerate(lines):
+        if line.split() and line.split()[0] == '127.0.1.1':
+            lines[i] = entry
+            break
+    else:
+        lines.append(entry)
+
+    _write_file(hosts, '\n'.join(lines) + '\n')
+
+
+def set_machine_id(path_to_rootfs, machine_id='random'):
+    '''
+    Writes /etc/machine-id (and the dbus copy if it is no link).
+
+    :param machine_id: 32 hex digits, random for a new id or empty, then systemd
+                       creates the id on the first boot
+    :return: the machine id
+    '''
+    root = path_to_rootfs.rstrip('/')
+    if machine_id == 'random':
+        machine_id = uuid.uuid4().hex
+    elif machine_id == 'empty':
+        machine_id = ''
+
+    content = '{}\n'.format(machine_id) if machine_id else ''
+    _write_file('{}/etc/machine-id'.format(root), content)
+
+    dbus = '{}/var/lib/dbus/machine-id'.format(root)
+    if os.path.isfile(dbus) and not os.path.islink(dbus):
+        _write_file(dbus, content)
+
+    return machine_id
+
+
+def personalise_rootfs(path_to_rootfs, params, uuids=None):
+    '''
+    Applies the parameters of a card to a mounted rootfs.
+
+    :param path_to_rootfs: path to the mounted rootfs
+    :param params: CardParams object
+    :param uuids: dictionary {old uuid: new uuid} which is applied to /etc/fstab
+    :return: None
+    '''
+    root = path_to_rootfs.rstrip('/')
+    if uuids and replace_uuids('{}/etc/fstab'.format(root), uuids):
+        print('   Updated /etc/fstab')
+
+    if params.root_password_hash is not None or params.root_password is not None:
+        set_shadow_password(root, params.root_password, params.root_password_hash)
+        print('   Updated root password')
+
+    if params.hostname:
+        set_hostname(root, params.hostname)
+        print('   Hostname: {}'.format(params.hostname))
+
+    if params.machine_id is not None:
+        machine_id = set_machine_id(root, params.machine_id)
+        print('   Machine id: {}'.format(machine_id or '(set on first boot)'))
+
+
+def personalise_device(partitions, params, rootfs=None, ask_password=False, tmp_dir='/tmp/flashtool'):
+    '''
+    Personalises a card after an image was written to it. The filesystems get new
+    uuids, the rootfs partition is mounted and personalised.
+
+    :param partitions: list with paths of the partitions of the card
+    :param params: CardParams object
+    :param rootfs: path of the rootfs partition, it is searched on the partitions with a
+                   filesystem of ROOTFS_FS_TYPES if None
+    :param ask_password: ask the user for the root password
+    :param tmp_dir: directory for the mount points
+    :return: None
+    '''
+    uuids = renew_uuids(partitions) if params.uuids else {}
+
+    mounts = []
+    try:
+        if rootfs:
+            candidates = [rootfs]
+        else:
+            candidates = [path for path in partitions if get_partition_info(path)['fs_type'] in ROOTFS_FS_TYPES]
+
+        for path in candidates:
+            dest = '{}/{}'.format(tmp_dir.rstrip('/'), path.split('/')[-1])
+            if not os.path.exists(dest):
+                os.makedirs(dest)
+            try:
+                util.os_call(['mount', path, dest], timeout=15)
+            except (util.SubprocessCallException, util.TimeoutException) as e:
+                if rootfs:
+                    raise
+                print(Fore.YELLOW + '   Skip {}, it can not be mounted: {}'.format(path, e.message))
+                continue
+            mounts.append(path)
+
+            if os.path.isfile('{}/etc/fstab'.format(dest)):
+                if ask_password:
+                    set_shadow_password(dest, ask_root_password())
+                personalise_rootfs(dest, params, uuids)
+                return
+
+        print(Fore.YELLOW + '   Found no rootfs on {}'.format(', '.join(partitions)))
+    finally:
+        for path in mounts:
+            util.os_call(['umount', path], allow_user_interrupt=False)
+
+
+def _write_file(path, content):
+    # keep mode and owner of the existing file
+    tmp_file = '{}.flashtool'.format(path)
+    with open(tmp_file, 'w') as f:
+        f.write(content)
+    if os.path.exists(path):
+        stat = os.stat(path)
+        os.chmod(tmp_file, stat.st_mode)
+        os.chown(tmp_file, stat.st_uid, stat.st_gid)
+    os.replace(tmp_file, path)
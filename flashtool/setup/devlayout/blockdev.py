@@ -8,6 +8,7 @@ from colorama import Fore
 import parted
 from flashtool import utility as util
 from flashtool.setup.constants import mkfs_support
+from flashtool.setup.constants import mkfs_eager_init
 
 __author__ = 'mahieke'
 
@@ -77,6 +78,17 @@ def partition(dev, partition_table, partitions):
     return new_partitions
 
 
+def get_partitions(dev):
+    '''
+    Lets the kernel read the partition table of a device again, e.g. after an
+    image was written to it, and returns the paths of the partitions.
+    :param dev: /dev path of the device
+    :return: list with /dev paths of the partitions
+    '''
+    util.os_call(['blockdev', '--rereadpt', dev], allow_user_interrupt=False)
+    return [part.path for part in parted.newDisk(parted.getDevice(dev)).partitions]
+
+
 def check_disk(device):
     '''
     Does a check on the firs 1MB of the mmc device. This check must pass to make
@@ -193,13 +205,16 @@ def _add_partition(disk, free, align=None, length=None, fs_type=None, type=parte
     return partition
 
 
-def format(partitions):
+def format(partitions, lazy_init=True):
     '''
     Formats the new crated devlayout with the filesystem type which is specified in the recipe.
+    :param lazy_init: False to initialize the inode tables and the journal while formatting
     :return: None
     '''
     for part_info in partitions:
         cmd = mkfs_support[part_info['fs_type']][0:-1]
+        if not lazy_init:
+            cmd = cmd + mkfs_eager_init.get(part_info['fs_type'], [])
         if part_info['name']:
             cmd = cmd + [mkfs_support[part_info['fs_type']][-1] + '{}'.format(part_info['name'])]
 
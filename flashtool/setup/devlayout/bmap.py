@@ -0,0 +1,284 @@
+'''
+Block maps of sparse image files. A block map lists the ranges of an image
+which contain data, all other blocks are holes which read as zeros. Only
+the mapped ranges are written to a device, so the time for writing an image
+depends on the data in the filesystems and not on the size of the image.
+The holes keep the old data of a block device, so the filesystems of an
+image must not rely on zeroed blocks (see ImageDeploy). Zeroing the holes
+is optional, a card reader without a zeroing command gets the zeros written
+by the kernel and the whole size of the image is written again.
+
+The block map is stored as json file next to the image ({image}.bmap):
+
+    {
+        "version": 1,
+        "image_size": 4294967296,
+        "block_size": 4096,
+        "mapped": 52428800,
+        "ranges": [{"start": 0, "end": 1048576, "sha256": "..."}, ...]
+    }
+'''
+import errno
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+
+__author__ = 'mahieke'
+
+BMAP_VERSION = 1
+DEFAULT_BLOCK_SIZE = 4096
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+# ioctl of linux/fs.h, the device zeros a range of sectors itself
+BLKZEROOUT = 0x127f
+SECTOR_SIZE = 512
+
+
+class BmapError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
+
+
+class BmapChecksumError(BmapError):
+    pass
+
+
+def generate_bmap(image, block_size=DEFAULT_BLOCK_SIZE, checksums=True, buffer_size=DEFAULT_BUFFER_SIZE):
+    '''
+    Creates the block map of an image file. The data ranges are found with
+    SEEK_DATA and SEEK_HOLE. If the filesystem does not support them, the
+    whole image is mapped.
+
+    :param image: path of the image file
+    :param block_size: ranges are aligned to this size
+    :param checksums: compute the sha256 of each range
+    :param buffer_size: size of the read buffer
+    :return: block map as dictionary
+    '''
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        ranges = []
+        for start, end in _data_ranges(fd, size):
+            # align to whole blocks, the holes of the filesystem are never smaller
+            start = start // block_size * block_size
+            end = min(size, (end + block_size - 1) // block_size * block_size)
+
+            if ranges and start <= ranges[-1]['end']:
+                ranges[-1]['end'] = max(ranges[-1]['end'], end)
+            else:
+                ranges.append({'start': start, 'end': end})
+
+        if checksums:
+            view = memoryview(mmap.mmap(-1, buffer_size))
+            for r in ranges:
+                r['sha256'] = _hash_range(fd, r['start'], r['end'], view)
+    finally:
+        os.close(fd)
+
+    return {
+        'version': BMAP_VERSION,
+        'image_size': size,
+        'block_size': block_size,
+        'mapped': sum(r['end'] - r['start'] for r in ranges),
+        'ranges': ranges,
+    }
+
+
+def save_bmap(bmap, path):
+    '''
+    Saves a block map atomically as json file.
+    '''
+    tmp_file = '{}.tmp'.format(path)
+    with open(tmp_file, 'w') as f:
+        json.dump(bmap, f)
+    os.replace(tmp_file, path)
+
+
+def load_bmap(path):
+    '''
+    Loads a block map from a json file.
+
+    :param path: path of the block map
+    :return: block map as dictionary
+    '''
+    try:
+        with open(path, 'r') as f:
+            bmap = json.load(f)
+    except (IOError, ValueError) as e:
+        raise BmapError('Block map {} could not be read: {}'.format(path, e))
+
+    if bmap.get('version') != BMAP_VERSION:
+        raise BmapError('Block map {} has the unsupported version {}.'.format(path, bmap.get('version')))
+
+    return bmap
+
+
+def bmap_path(image):
+    '''
+    Returns the path of the block map of an image.
+    '''
+    return '{}.bmap'.format(image)
+
+
+def write_image(image, device, bmap=None, buffer_size=DEFAULT_BUFFER_SIZE, verify=True, reporthook=None,
+                zero=False):
+    '''
+    Copies the mapped ranges of an image to a device. The data is read into a
+    page aligned buffer and written at the same offset of the device. The
+    sha256 of each range is compared with the block map while it is written.
+    The unmapped ranges of a file become holes, those of a block device keep
+    their old data unless zero is set.
+
+    :param image: path of the image file
+    :param device: path of the device (or a file)
+    :param bmap: block map of the image, it is generated if None
+    :param buffer_size: size of the buffer, a multiple of the page size
+    :param verify: compare the checksums of the ranges
+    :param reporthook: function(written, mapped) which is called after each buffer
+    :param zero: zero the unmapped ranges of a block device, only needed for images
+                 whose filesystems expect zeroed blocks
+    :return: number of written bytes of the mapped ranges
+    '''
+    if bmap is None:
+        bmap = generate_bmap(image, checksums=False)
+
+    buffer_size = max(mmap.PAGESIZE, buffer_size // mmap.PAGESIZE * mmap.PAGESIZE)
+
+    src = os.open(image, os.O_RDONLY)
+    try:
+        if os.fstat(src).st_size != bmap['image_size']:
+            raise BmapError('Size of image {} does not match its block map.'.format(image))
+
+        dst = os.open(device, os.O_WRONLY | os.O_CREAT, 0o644)
+        # the anonymous mapping is page aligned
+        view = memoryview(mmap.mmap(-1, buffer_size))
+        try:
+            mode = os.fstat(dst).st_mode
+            if stat.S_ISREG(mode):
+                # a file target gets the holes of the image instead of its old content
+                os.ftruncate(dst, 0)
+                os.ftruncate(dst, bmap['image_size'])
+            elif stat.S_ISBLK(mode) and zero:
+                for start, end in unmapped_ranges(bmap):
+                    _zero_range(dst, start, end, buffer_size)
+
+            written = 0
+            for r in bmap['ranges']:
+                digest = hashlib.sha256()
+                offset = r['start']
+                while offset < r['end']:
+                    n = os.preadv(src, [view[:min(buffer_size, r['end'] - offset)]], offset)
+                    if n == 0:
+                        raise BmapError('Unexpected end of image {} at offset {}.'.format(image, offset))
+
+                    digest.update(view[:n])
+                    _write_all(dst, view[:n], offset)
+                    offset += n
+                    written += n
+
+                    if reporthook:
+                        reporthook(written, bmap['mapped'])
+
+                if verify and r.get('sha256') and digest.hexdigest() != r['sha256']:
+                    raise BmapChecksumError('Checksum of range {}-{} of image {} does not match its block map.'
+                                            .format(r['start'], r['end'], image))
+
+            os.fsync(dst)
+        finally:
+            os.close(dst)
+    finally:
+        os.close(src)
+
+    return written
+
+
+def unmapped_ranges(bmap):
+    '''
+    Yields the (start, end) offsets of the holes of an image.
+
+    :param bmap: block map of the image
+    '''
+    offset = 0
+    for r in bmap['ranges']:
+        if r['start'] > offset:
+            yield offset, r['start']
+        offset = max(offset, r['end'])
+
+    if offset < bmap['image_size']:
+        yield offset, bmap['image_size']
+
+
+def _zero_range(fd, start, end, buffer_size=DEFAULT_BUFFER_SIZE):
+    '''
+    Zeros a range of a block device. The device does it itself with BLKZEROOUT
+    (the kernel writes zeros if the device has no command for it), zeros are only
+    written here if the ioctl is not supported or the range is not sector aligned.
+    '''
+    aligned_end = end // SECTOR_SIZE * SECTOR_SIZE
+    if start % SECTOR_SIZE == 0 and aligned_end > start:
+        try:
+            fcntl.ioctl(fd, BLKZEROOUT, struct.pack('QQ', start, aligned_end - start))
+            start = aligned_end
+        except OSError as e:
+            if e.errno not in (errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+
+    if start < end:
+        # an anonymous mapping is filled with zeros
+        zeros = memoryview(mmap.mmap(-1, max(mmap.PAGESIZE, min(buffer_size, end - start))))
+        while start < end:
+            n = min(len(zeros), end - start)
+            _write_all(fd, zeros[:n], start)
+            start += n
+
+
+def _data_ranges(fd, size):
+    '''
+    Yields the (start, end) offsets of the data ranges of a file.
+    '''
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # no data behind offset
+                    return
+                raise
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            yield start, end
+            offset = end
+    except (AttributeError, OSError) as e:
+        if offset != 0 or isinstance(e, OSError) and e.errno not in (errno.EINVAL, errno.ENOTSUP):
+            raise
+        # SEEK_DATA is not supported, everything is data
+        if size:
+            yield 0, size
+
+
+def _hash_range(fd, start, end, view):
+    digest = hashlib.sha256()
+    offset = start
+    while offset < end:
+        n = os.preadv(fd, [view[:min(len(view), end - offset)]], offset)
+        if n == 0:
+            break
+        digest.update(view[:n])
+        offset += n
+
+    return digest.hexdigest()
+
+
+def _write_all(fd, data, offset):
+    while len(data):
+        n = os.pwrite(fd, data, offset)
+        data = data[n:]
+        offset += n
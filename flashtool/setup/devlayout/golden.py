@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging as log
+import os
+import time
+
+from flashtool.server.artifactcache import sha256sum
+from flashtool.setup.devlayout.bmap import bmap_path
+
+__author__ = 'mahieke'
+
+DEFAULT_GOLDEN_IMAGES = 3
+# part of the key, images are built again if the content of golden images changes
+GOLDEN_VERSION = 2
+
+
+class GoldenImageCache():
+    '''
+    Store for provisioned images of recipes ("golden images"). An image is
+    identified by a key over the recipe file, the platform, the image size and
+    the names and sha256 digests of the loaded files. Each image is kept with
+    its block map, {directory}/.golden_index records the images and the digests
+    of local files, so unchanged files are not hashed again.
+
+    Only the keep least recently used images are kept.
+    '''
+    def __init__(self, directory, keep=DEFAULT_GOLDEN_IMAGES):
+        '''
+        :param directory: directory which holds the images
+        :param keep: number of images which are kept, 0 for no limit
+        '''
+        self.directory = directory.rstrip('/')
+        self.keep = keep
+        self.index_file = '{}/.golden_index'.format(self.directory)
+        self.index = {'images': {}, 'digests': {}}
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        if os.path.isfile(self.index_file) and os.path.getsize(self.index_file) > 0:
+            try:
+                with open(self.index_file) as f:
+                    self.index.update(json.load(f))
+            except ValueError as e:
+                log.warning('Golden image index {} is corrupt and will be rebuilt: {}'.format(self.index_file, e))
+
+    @staticmethod
+    def key(recipe_digest, platform, image_size, files):
+        '''
+        Returns the key of an image.
+
+        :param recipe_digest: sha256 of the recipe file
+        :param platform: name of the platform
+        :param image_size: size of the image in bytes
+        :param files: list of tuples (file path on the server, sha256 of the file)
+        :return: key as hex string
+        '''
+        description = json.dumps({
+            'version': GOLDEN_VERSION,
+            'recipe': recipe_digest,
+            'platform': platform,
+            'image_size': image_size,
+            'files': sorted([list(f) for f in files]),
+        }, sort_keys=True)
+
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def path(self, key):
+        return '{}/{}.img'.format(self.directory, key)
+
+    def lookup(self, key):
+        '''
+        Returns the path of the image of a key if it is cached, otherwise None.
+        '''
+        entry = self.index['images'].get(key)
+        image = self.path(key)
+        if not entry or not os.path.isfile(image) or not os.path.isfile(bmap_path(image)):
+            return None
+
+        if os.path.getsize(image) != entry['size']:
+            log.warning('Golden image {} has the wrong size and is removed.'.format(image))
+            self.remove(key)
+            return None
+
+        entry['last_used'] = time.time()
+        self.save()
+        return image
+
+    def add(self, key, image, info=None):
+        '''
+        Moves a finished image and its block map into the cache.
+
+        :param key: key of the image
+        :param image: path of the image, the block map must be at bmap_path(image)
+        :param info: dictionary with information about the image (recipe, platform, files)
+        :return: path of the cached image
+        '''
+        path = self.path(key)
+        os.replace(bmap_path(image), bmap_path(path))
+        os.replace(image, path)
+
+        entry = dict(info or {})
+        entry.update({
+            'size': os.path.getsize(path),
+            'created': time.time(),
+            'last_used': time.time(),
+        })
+        self.index['images'][key] = entry
+        self.evict(keep=[key])
+        self.save()
+
+        return path
+
+    def remove(self, key):
+        image = self.path(key)
+        for path in (image, bmap_path(image)):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.index['images'].pop(key, None)
+
+    def evict(self, keep=()):
+        '''
+        Removes the least recently used images until only self.keep images are left.
+        '''
+        if not self.keep:
+            return
+
+        images = sorted(self.index['images'].items(), key=lambda e: e[1]['last_used'])
+        for key, entry in images[:max(0, len(images) - self.keep)]:
+            if key not in keep:
+                log.info('Remove golden image {}'.format(key))
+                self.remove(key)
+
+    def file_digest(self, path):
+        '''
+        Returns the sha256 of a local file. The digest is only computed again if
+        size or mtime of the file changed.
+        '''
+        stat = os.stat(path)
+        known = self.index['digests'].get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+
+        digest = sha256sum(path)
+        self.index['digests'][path] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def save(self):
+        tmp_file = '{}.tmp'.format(self.index_file)
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
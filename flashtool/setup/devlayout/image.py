@@ -0,0 +1,138 @@
+import os
+import subprocess
+
+from flashtool import utility as util
+
+__author__ = 'mahieke'
+
+# partitions are aligned to 1 MB like in blockdev.partition
+ALIGNMENT = 1024 * 1024
+SECTOR_SIZE = 512
+
+
+class ImageSizeError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
+
+
+def get_image_size(partitions, size=None):
+    '''
+    Returns the size of an image file for the partitions of a recipe. The
+    size is needed if a partition has the size max, otherwise the sum
+    of the partitions and the space for the partition table is used.
+
+    :param partitions: partitions of the recipe
+    :param size: wanted size of the image in bytes, None for the minimum size
+    :return: size in bytes, a multiple of the sector size
+    '''
+    fixed = [part.size for part in partitions if isinstance(part.size, int)]
+    # space in front of the first partition and for the backup table of gpt
+    needed = 2 * ALIGNMENT + sum(_align(s, ALIGNMENT) for s in fixed)
+
+    if size is None:
+        if len(fixed) != len(partitions):
+            raise ImageSizeError('The recipe contains partitions without a fixed size. '
+                                 'The size of the image must be given.')
+        return needed
+
+    if size < needed:
+        raise ImageSizeError('Image size of {} bytes is too small for the partitions, {} bytes are needed.'
+                             .format(size, needed))
+
+    return _align(size, SECTOR_SIZE)
+
+
+def create_sparse_image(path, size):
+    '''
+    Creates an image file which has the given size but allocates no blocks.
+    An existing file is overwritten.
+
+    :param path: path of the image file
+    :param size: size in bytes
+    :return: None
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def attach_loop(path, offset=0, size=None):
+    '''
+    Attaches a file or a part of it as loop device.
+
+    :param path: path of the image file
+    :param offset: offset in bytes of the part
+    :param size: size in bytes of the part, None for the rest of the file
+    :return: path of the loop device
+    '''
+    cmd = ['losetup', '--find', '--show']
+    if offset:
+        cmd += ['--offset', str(offset)]
+    if size:
+        cmd += ['--sizelimit', str(size)]
+
+    return subprocess.check_output(cmd + [path]).decode().strip()
+
+
+def detach_loop(device):
+    '''
+    Detaches a loop device.
+
+    :param device: path of the loop device
+    :return: None
+    '''
+    util.os_call(['losetup', '--detach', device], allow_user_interrupt=False)
+
+
+def parse_blkid(output):
+    '''
+    Parses the output of "blkid -o export".
+
+    :param output: output of blkid as string
+    :return: dictionary with the keys of blkid (TYPE, UUID, LABEL, ...)
+    '''
+    info = {}
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if sep:
+            info[key] = value
+
+    return info
+
+
+def get_partition_info(device, size=None):
+    '''
+    Retrieves information about a partition without udev, in the format of
+    udev.mmc.get_partition_information.
+
+    :param device: path of the partition or loop device
+    :param size: size of the partition in bytes
+    :return: dictionary with path, size, fs_type, fs_version, name and uuid
+    '''
+    # probe the device directly, the blkid cache does not know new loop devices
+    try:
+        output = subprocess.check_output(['blkid', '-p', '-o', 'export', device]).decode()
+    except subprocess.CalledProcessError:
+        # no filesystem on the partition
+        output = ''
+
+    info = parse_blkid(output)
+
+    return {
+        'path': device,
+        'size': size,
+        'fs_type': info.get('TYPE'),
+        'fs_version': info.get('VERSION'),
+        'name': info.get('LABEL'),
+        'uuid': info.get('UUID')
+    }
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
@@ -0,0 +1,438 @@
+'''
+Flashing station: all cards which are plugged into the card readers of a
+station are set up at once. The products are selected and downloaded once,
+then every card (slot) runs its own mmc setup in a separate process, so the
+slots are only limited by their readers. The output of a slot goes to its
+log file, the station prints the progress and a summary of all slots.
+'''
+from __future__ import unicode_literals
+from __future__ import print_function
+
+__author__ = 'mahieke'
+
+from flashtool.server.buildserver import get_buildserver, LocalBuilds, ArtifactStream
+from flashtool.setup.deploy.load import get_products_by_recipe_user_input
+from flashtool.setup.deploy.personalise import CardParams, ask_root_password
+from flashtool.setup.devlayout.golden import DEFAULT_GOLDEN_IMAGES
+from flashtool.setup.recipe import RecipeContentException
+from flashtool.setup.recipe import load_recipes
+import flashtool.utility as util
+
+from colorama import Fore, AnsiToWin32
+from concurrent.futures import Future
+import copy
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+import traceback
+
+
+class StationError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr(self.message)
+
+
+class FetchedFiles():
+    '''
+    Files which were downloaded by the station before the slots are started.
+    It provides the file methods of Buildserver, so the setup of a slot reads
+    the shared files and never downloads a file again.
+    '''
+    def __init__(self, files):
+        '''
+        :param files: dictionary {file path on the server: (local path, size)}
+        '''
+        self.files = files
+
+    def get_file(self, file_path, quiet=False, abort=None):
+        try:
+            return self.files[file_path]
+        except KeyError:
+            raise StationError('File {} was not fetched by the station.'.format(file_path))
+
+    def open_stream(self, file_path):
+        path, size = self.get_file(file_path)
+        return ArtifactStream(open(path, 'rb'), file_path, size)
+
+    def prefetch(self, file_path):
+        future = Future()
+        try:
+            future.set_result(self.get_file(file_path))
+        except StationError as e:
+            future.set_exception(e)
+        return future
+
+    def cancel_prefetch(self):
+        pass
+
+
+def assign_card_params(card_params, slots):
+    '''
+    Returns the card parameters of every slot. A single parameter set is derived for
+    every slot (see derive_card_params), otherwise the slots get the parameter sets
+    in their order.
+
+    :param card_params: list with CardParams objects
+    :param slots: number of slots
+    :return: list with a CardParams object (or None) for every slot
+    '''
+    if not card_params:
+        return [None] * slots
+
+    if len(card_params) == 1:
+        return [derive_card_params(card_params[0], slot) for slot in range(slots)]
+
+    if len(card_params) < slots:
+        raise StationError('There are {} card parameter files for {} cards.'.format(len(card_params), slots))
+
+    return list(card_params[:slots])
+
+
+def derive_card_params(card_params, slot):
+    '''
+    Returns the parameters of a slot from a parameter set which is shared by all
+    slots, so no two cards get the same identity: the hostname gets the suffix
+    -{slot}, the machine id is random unless it is created at the first boot, and
+    the filesystem uuids are renewed.
+
+    :param card_params: CardParams object
+    :param slot: number of the slot
+    :return: CardParams object
+    '''
+    params = copy.copy(card_params)
+
+    if params.hostname is not None:
+        suffix = '-{}'.format(slot)
+        params.hostname = '{}{}'.format(str(params.hostname)[:63 - len(suffix)], suffix)
+
+    if params.machine_id != 'empty':
+        params.machine_id = 'random'
+
+    params.uuids = True
+
+    return params
+
+
+def run_slots(jobs, workers=None, log_dir=None, report=None):
+    '''
+    Runs the job of every slot in its own process. A job is called with a
+    function progress(message), which reports the current step to the station.
+
+    :param jobs: list with a picklable callable job(progress) for every slot
+    :param workers: maximal number of slots which run at once, all if None
+    :param log_dir: stdout and stderr of slot n are written to {log_dir}/station-slot{n}.log,
+                    the output is not redirected if None
+    :param report: function(slot, state, message) which is called for every message of
+                   a slot, state is progress, done or failed
+    :return: list with a dictionary {slot, state, message, duration} for every slot
+    '''
+    report = report or (lambda slot, state, message: None)
+    workers = workers or len(jobs)
+    # the station runs download threads, a slot which is forked from it could inherit one
+    # of their locks in locked state. The slots are forked from a fresh server process
+    # without threads, so the jobs are pickled.
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    messages = context.Queue()
+
+    pending = list(enumerate(jobs))
+    running = {}
+    results = {}
+
+    def handle(slot, state, message):
+        report(slot, state, message)
+        if state in ('done', 'failed') and slot in running:
+            process, start = running.pop(slot)
+            process.join()
+            results[slot] = {'slot': slot, 'state': state, 'message': message, 'duration': time.time() - start}
+
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                slot, job = pending.pop(0)
+                log_file = '{}/station-slot{}.log'.format(log_dir.rstrip('/'), slot) if log_dir else None
+                process = context.Process(target=_run_slot, args=(slot, job, messages, log_file))
+                process.start()
+                running[slot] = (process, time.time())
+
+            try:
+                handle(*messages.get(timeout=0.5))
+            except queue.Empty:
+                # a slot which ended without a result was killed
+                for slot, (process, start) in list(running.items()):
+                    if not process.is_alive():
+                        while True:
+                            try:
+                                handle(*messages.get_nowait())
+                            except queue.Empty:
+                                break
+                        if slot in running:
+                            handle(slot, 'failed', 'Process ended with exit code {}'.format(process.exitcode))
+    except KeyboardInterrupt:
+        # the slots got the interrupt as well and roll back their setup
+        for process, start in running.values():
+            process.join(30)
+            if process.is_alive():
+                process.terminate()
+        raise
+
+    return [results[slot] for slot in sorted(results)]
+
+
+def _run_slot(slot, job, messages, log_file):
+    if log_file:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        # output of commands and of python, without colors
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        sys.stdout = sys.stderr = AnsiToWin32(open(1, 'w', buffering=1, closefd=False), strip=True,
+                                              autoreset=True).stream
+
+    # nobody answers a prompt of a slot
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.close(null)
+
+    try:
+        job(lambda message: messages.put((slot, 'progress', message)))
+    except BaseException as e:
+        traceback.print_exc()
+        messages.put((slot, 'failed', str(e) or e.__class__.__name__))
+    else:
+        messages.put((slot, 'done', ''))
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+class Station():
+    '''
+    Setup of all cards of a flashing station with a mmc recipe.
+    '''
+
+    def __init__(self, url, actions, recipe_file, auto, platform, devices=None, user_dest=None, working_dir=None,
+                 cache_quota=0, offline=False, golden=False, golden_keep=DEFAULT_GOLDEN_IMAGES, image_size=None,
+                 card_params=None, workers=None):
+        '''
+        :param devices: list with dev paths of the cards, all cards are recognized if None
+        :param golden: write a golden image to the cards instead of running the recipe on every card
+        :param card_params: list with CardParams objects, see assign_card_params. The user is asked
+                            once for the root password of all cards if None, every card gets a
+                            random machine id and new filesystem uuids then.
+        :param workers: maximal number of cards which are set up at once, all if None
+        '''
+        if url.get('dir'):
+            self.builds = LocalBuilds(url['dir'], platform, working_dir)
+        else:
+            self.builds = get_buildserver(url, platform, user_dest, working_dir, cache_quota, offline)
+
+        self.actions = actions
+        self.recipe_file = recipe_file
+        self.auto = auto
+        self.platform = platform
+        self.devices = devices
+        self.working_dir = (working_dir or '/tmp/flashtool').rstrip('/')
+        self.golden = golden
+        self.golden_keep = golden_keep
+        self.image_size = image_size
+        self.card_params = card_params
+        self.workers = workers
+
+        self.recipes = load_recipes(recipe_file)
+        for recipe in self.recipes:
+            if not hasattr(recipe, 'partitions'):
+                raise RecipeContentException('Recipe {} can not be deployed by a flashing station.'
+                                             .format(recipe.__class__.__name__))
+
+        self.load_cfgs = [get_products_by_recipe_user_input(recipe.load, actions, self.builds, platform, auto)
+                          for recipe in self.recipes]
+
+    def setup(self):
+        '''
+        Downloads the files, recognizes the cards and sets them up in parallel.
+
+        :return: list with the result of every slot, see run_slots
+        '''
+        try:
+            files = self.fetch()
+            devices = self.get_devices()
+            card_params = self.get_card_params(len(devices))
+            goldens = self.prepare_golden() if self.golden else None
+        finally:
+            self.builds.cancel_prefetch()
+
+        shared = FetchedFiles(files)
+        jobs = []
+        for slot, device in enumerate(devices):
+            tmp_dir = '{}/station/slot{}'.format(self.working_dir, slot)
+            if goldens:
+                jobs.append(self.__golden_job(goldens, device, card_params[slot], tmp_dir))
+            else:
+                jobs.append(self.__mmc_job(shared, device, card_params[slot], tmp_dir))
+
+        log_dir = '{}/logs'.format(self.working_dir)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        print(Fore.YELLOW + '   Set up {} cards, logs: {}/station-slot*.log'.format(len(devices), log_dir))
+        print('')
+
+        def report(slot, state, message):
+            color = {'done': Fore.GREEN, 'failed': Fore.RED}.get(state, '')
+            print(color + '   [slot {} {}] {}'.format(slot, devices[slot][0]['path'], message or state))
+
+        results = run_slots(jobs, self.workers, log_dir, report)
+        self.print_summary(devices, results)
+
+        return results
+
+    def fetch(self):
+        '''
+        Downloads all selected files once for all slots.
+
+        :return: dictionary {file path on the server: (local path, size)}
+        '''
+        infos = [f_info for load_cfg in self.load_cfgs for product in load_cfg.values() for f_info in product]
+        futures = [(f_info, self.builds.prefetch(f_info['file'])) for f_info in infos]
+
+        files = {}
+        for f_info, future in futures:
+            print('   Wait for download of {}'.format(f_info['file'].split('/')[-1]))
+            path, size = future.result()
+            if f_info['size'] is not None and size != f_info['size']:
+                raise StationError('File {} was not downloaded correctly.'.format(f_info['file']))
+            files[f_info['file']] = (path, size)
+
+        print('')
+        return files
+
+    def get_devices(self):
+        '''
+        Recognizes the cards and asks the user once before all of them are overwritten.
+        The auto mode only skips this question if the cards were given as dev paths.
+        '''
+        import flashtool.setup.udev.mmc as udev
+
+        devices = udev.get_card_devices(self.devices)
+        if not devices:
+            raise StationError('Found no cards.')
+
+        print('Found these cards:')
+        for slot, device in enumerate(devices):
+            print('  slot {}: {} ({} MB)'.format(slot, device[0]['path'], device[0]['size'] // (1024 * 1024)))
+        print('')
+
+        if not (self.auto and self.devices):
+            answer = util.user_prompt('Do you want to continue? This will overwrite all {} cards'
+                                      .format(len(devices)), 'Answer', 'YyNn')
+            if re.match('[Nn]', answer):
+                print(Fore.RED + 'ABORT!')
+                exit(0)
+
+        return devices
+
+    def get_card_params(self, slots):
+        '''
+        Returns the card parameters of every slot. The slots can not ask for the
+        root password, so it is asked once here if no parameters are given.
+        '''
+        if not self.card_params:
+            return assign_card_params([CardParams({'root_password': ask_root_password()})], slots)
+
+        return assign_card_params(self.card_params, slots)
+
+    def prepare_golden(self):
+        '''
+        Looks up or builds the golden images of the recipes once for all slots.
+        '''
+        from flashtool.setup.deploy import get_setup_step
+
+        goldens = []
+        for recipe, load_cfg in zip(self.recipes, self.load_cfgs):
+            golden = get_setup_step('golden')(recipe, self.actions, self.builds, self.platform, self.auto,
+                                              recipe_file=self.recipe_file,
+                                              golden_dir='{}/golden'.format(self.working_dir),
+                                              golden_keep=self.golden_keep, image_size=self.image_size,
+                                              load_cfg=load_cfg)
+            golden.prepare()
+            goldens.append(golden)
+
+        return goldens
+
+    def print_summary(self, devices, results):
+        print('')
+        print(Fore.YELLOW + '   {:<6}{:<16}{:<8}{:>10}'.format('Slot', 'Device', 'Result', 'Time'))
+        for result in results:
+            color = Fore.GREEN if result['state'] == 'done' else Fore.RED
+            print(color + '   {:<6}{:<16}{:<8}{:>8.1f} s  {}'.format(result['slot'],
+                                                                      devices[result['slot']][0]['path'],
+                                                                      result['state'], result['duration'],
+                                                                      result['message']))
+        print('')
+
+    def __mmc_job(self, files, device, card_params, tmp_dir):
+        return MMCSlotJob(self.recipe_file, self.actions, files, self.platform, self.auto, self.load_cfgs, device,
+                          card_params, tmp_dir)
+
+    def __golden_job(self, goldens, device, card_params, tmp_dir):
+        return GoldenSlotJob([(golden.image, golden.rootfs_device()) for golden in goldens], device, card_params,
+                             tmp_dir)
+
+
+class MMCSlotJob():
+    '''
+    Job of a slot which runs the mmc recipes on its card. The recipes are loaded
+    again in the process of the slot, the files are read from the station.
+    '''
+    def __init__(self, recipe_file, actions, files, platform, auto, load_cfgs, device, card_params, tmp_dir):
+        self.recipe_file = recipe_file
+        self.actions = actions
+        self.files = files
+        self.platform = platform
+        self.auto = auto
+        self.load_cfgs = load_cfgs
+        self.device = device
+        self.card_params = card_params
+        self.tmp_dir = tmp_dir
+
+    def __call__(self, progress):
+        from flashtool.setup.deploy.mmc import MMCDeploy
+
+        deploys = [MMCDeploy(recipe, self.actions, self.files, self.platform, self.auto,
+                             card_params=self.card_params, device=self.device, load_cfg=load_cfg, confirm=False,
+                             tmp_dir=self.tmp_dir, progress=progress)
+                   for recipe, load_cfg in zip(load_recipes(self.recipe_file), self.load_cfgs)]
+
+        for deploy in deploys:
+            deploy.prepare()
+        for deploy in deploys:
+            deploy.load()
+
+
+class GoldenSlotJob():
+    '''
+    Job of a slot which writes the golden images to its card.
+    '''
+    def __init__(self, images, device, card_params, tmp_dir):
+        '''
+        :param images: list with tuples (path of the golden image, number of the rootfs partition)
+        '''
+        self.images = images
+        self.device = device
+        self.card_params = card_params
+        self.tmp_dir = tmp_dir
+
+    def __call__(self, progress):
+        from flashtool.setup.deploy.golden import write_golden_image
+
+        for image, rootfs in self.images:
+            write_golden_image(image, self.device[0]['path'], self.card_params, rootfs, progress, self.tmp_dir)
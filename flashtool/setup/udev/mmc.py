@@ -164,6 +164,80 @@ def get_mmc_device(auto=False):
 
     return devices[selection]
 
+def get_card_devices(paths=None):
+    '''
+    Returns all cards which are plugged in, e.g. into the card readers of a
+    flashing station. SD cards in mmc slots and removable disks with a medium
+    are cards. A disk of which a partition is mounted or used as swap is never
+    recognized as card, it might hold the system. The devices are ordered by
+    their udev ID_PATH, so a slot keeps its number as long as the reader stays
+    at the same port.
+
+    :param paths: list with dev paths of the devices, they are used instead of
+                  the recognized devices and their partitions are unmounted
+    :return: list with tuples in the format of get_mmc_device
+    '''
+    context = Context()
+
+    if paths:
+        udev_devices = [Device.from_device_file(context, path) for path in paths]
+    else:
+        udev_devices = [d for d in context.list_devices(subsystem='block', DEVTYPE='disk') if _is_card(d)]
+
+    devices = []
+    for udev_device in sorted(udev_devices, key=lambda d: d.get('ID_PATH', d.sys_name)):
+        size = util.get_size_block_dev(udev_device.sys_name)
+        if size == 0:
+            log.debug('DEVICE {} HAS NO MEDIUM'.format(udev_device.sys_name))
+            continue
+
+        partitions = get_partition_information([child.sys_name for child in udev_device.children
+                                                if child.device_type == 'partition'])
+        devices.append(({'path': udev_device.device_node, 'size': size}, partitions))
+
+    for device in devices:
+        util.check_permissions(device[0]['path'])
+        ensure_unmounted([child['path'] for child in device[1]])
+
+    return devices
+
+def _is_card(udev_device):
+    name = udev_device.sys_name
+
+    if re.match(r'^mmcblk[0-9]+$', name):
+        # eMMC chips are mmc devices as well
+        card = _sysfs_attribute(name, 'device/type') == 'SD'
+    else:
+        # optical drives are removable as well
+        card = _sysfs_attribute(name, 'removable') == '1' and re.match(r'^sd[a-z]+$', name) is not None
+
+    if card and _is_in_use([udev_device.device_node] + [child.device_node for child in udev_device.children]):
+        log.info('DEVICE {} IS IN USE AND IS NOT USED AS CARD'.format(name))
+        return False
+
+    return card
+
+def _sysfs_attribute(name, attribute):
+    try:
+        with open('/sys/block/{}/{}'.format(name, attribute)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _is_in_use(paths):
+    '''
+    Checks if one of the devices is mounted or used as swap.
+    '''
+    used = set()
+    for table in ('/proc/mounts', '/proc/swaps'):
+        try:
+            with open(table) as f:
+                used.update(line.split()[0] for line in f if line.strip())
+        except OSError:
+            pass
+
+    return any(path in used for path in paths)
+
 def ensure_unmounted(devs):
     '''
     Unmount the partitions which are given by in parameter devs.
@@ -0,0 +1,213 @@
+'''
+Local stand-in for a buildbot 0.8 server with a synthetic json tree and
+artifact downloads. It is used by the tests and the benchmarks:
+
+    with MockBuildbot(builds=500, latency=0.01) as server:
+        buildserver = Buildserver(server.address, server.port, server.platforms)
+
+Builders are named arch{i} with the platforms arch{i}_board{j}, each arch
+builder has a rootfs_arch{i} builder. Every fail_every-th build failed. The
+artifacts have the paths of the buildbot upload directory:
+
+    linux/{platform}/linux_4.1_{build}_boot.tar.gz, ..._root.tar.gz
+    rootfs/{arch}_{name}/rootfs_{arch}_{name}_{build}_rootfs.tar.gz
+'''
+__author__ = 'mahieke'
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import hashlib
+import json
+import re
+import threading
+import time
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockBuildbot():
+    def __init__(self, archs=2, boards=2, builds=100, rootfs_builds=20, fail_every=3, artifact_size=64 * 1024,
+                 latency=0.0, ranges=True, etags=True):
+        '''
+        :param archs: number of architecture builders
+        :param boards: number of platforms per architecture
+        :param builds: number of builds per architecture builder
+        :param rootfs_builds: number of builds per rootfs builder
+        :param fail_every: every fail_every-th build failed, 0 for none
+        :param artifact_size: size of each artifact in bytes
+        :param latency: delay of each answer in seconds
+        :param ranges: support range requests for artifacts
+        :param etags: send ETag validators and answer conditional requests with 304
+        '''
+        self.archs = ['arch{}'.format(i) for i in range(archs)]
+        self.platforms = ['{}_board{}'.format(a, j) for a in self.archs for j in range(boards)]
+        self.builds = builds
+        self.rootfs_builds = rootfs_builds
+        self.fail_every = fail_every
+        self.artifact_size = artifact_size
+        self.latency = latency
+        self.ranges = ranges
+        self.etags = etags
+
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def address(self):
+        return 'http://127.0.0.1'
+
+    @property
+    def port(self):
+        return str(self.server.server_address[1])
+
+    @property
+    def url(self):
+        return '{}:{}'.format(self.address, self.port)
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are separate writes, avoid the delayed ack stall
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                mock.handle(self, body=True)
+
+            def do_HEAD(self):
+                mock.handle(self, body=False)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def failed(self, num):
+        return self.fail_every and num % self.fail_every == 0
+
+    def builders(self):
+        builders = {}
+        for arch in self.archs:
+            schedulers = ['default / branch: master / filter: \'.*{}.*\''.format(p)
+                          for p in self.platforms if p.startswith('{}_'.format(arch))]
+            builders[arch] = {'basedir': arch, 'schedulers': schedulers}
+            builders['rootfs_{}'.format(arch)] = {'basedir': 'rootfs_{}'.format(arch),
+                                                  'schedulers': ['rootfs / name: {}_factory / x'.format(arch)]}
+        return {'builders': builders}
+
+    def build(self, builder, num):
+        if self.failed(num):
+            return {'number': num, 'text': ['failed', 'compile'], 'properties': [], 'times': [num, num + 1]}
+
+        if builder.startswith('rootfs_'):
+            name = '{}_factory'.format(builder[len('rootfs_'):])
+            props = {'platform': name, 'upload_files': ['rootfs_{}_{}_rootfs.tar.gz'.format(name, num)]}
+        else:
+            boards = [p for p in self.platforms if p.startswith('{}_'.format(builder))]
+            props = {'platform': boards[num % len(boards)], 'product': 'linux',
+                     'upload_files': ['linux_4.1_{}_boot.tar.gz'.format(num), 'linux_4.1_{}_root.tar.gz'.format(num)]}
+
+        return {'number': num, 'text': ['build', 'successful'], 'times': [num, num + 1],
+                'properties': [[k, v, 'Build'] for k, v in props.items()]}
+
+    def artifact(self, path, start=0, end=None):
+        '''
+        Returns the deterministic content of an artifact, or of the range start:end
+        of it. The content repeats the sha256 of the path, so only the requested
+        bytes are built and the mock costs little time in a benchmark.
+        '''
+        end = self.artifact_size if end is None else min(end, self.artifact_size)
+        if start >= end:
+            return b''
+
+        seed = hashlib.sha256(path.encode()).digest()
+        first = start // len(seed) * len(seed)
+        return (seed * -(-(end - first) // len(seed)))[start - first:end - first]
+
+    def handle(self, request, body):
+        with self.lock:
+            self.requests.append((request.command, request.path))
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(request.path)
+        path = url.path.strip('/')
+        query = parse_qs(url.query)
+
+        if path == '':
+            return self.send_json(request, {}, body)
+        if path == 'json':
+            return self.send_json(request, self.builders(), body)
+
+        match = re.match(r'^json/builders/([^/]+)/builds(?:/(-?\d+))?$', path)
+        if match:
+            builder = match.group(1)
+            count = self.rootfs_builds if builder.startswith('rootfs_') else self.builds
+            if match.group(2) is not None:
+                num = int(match.group(2))
+                num = count - 1 if num == -1 else num
+                return self.send_json(request, self.build(builder, num), body)
+
+            nums = [int(n) for n in query.get('select', [])]
+            return self.send_json(request, {str(n): self.build(builder, n) for n in nums if 0 <= n < count}, body)
+
+        if re.match(r'^(linux|uboot|misc|rootfs)/[^/]+/[^/]+$', path):
+            return self.send_artifact(request, path, body)
+
+        self.send(request, 404, b'', {}, body)
+
+    def send_json(self, request, data, body):
+        content = json.dumps(data).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.etags:
+            etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+            headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                return self.send(request, 304, b'', headers, False)
+        self.send(request, 200, content, headers, body)
+
+    def send_artifact(self, request, path, body):
+        # a HEAD request is answered from the size, the content is built for the sent range only
+        size = self.artifact_size
+        start, end, status = 0, size, 200
+        headers = {'Content-Type': 'application/octet-stream'}
+        if self.ranges:
+            headers['Accept-Ranges'] = 'bytes'
+
+        match = re.match(r'^bytes=(\d+)-(\d*)$', request.headers.get('Range') or '')
+        if self.ranges and match:
+            start = int(match.group(1))
+            end = min(size, int(match.group(2)) + 1) if match.group(2) else size
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, size)
+            status = 206
+
+        content = self.artifact(path, start, end) if body else b''
+        self.send(request, status, content, headers, body, length=max(0, end - start))
+
+    def send(self, request, status, content, headers, body, length=None):
+        request.send_response(status)
+        for k, v in headers.items():
+            request.send_header(k, v)
+        request.send_header('Content-Length', str(len(content) if length is None else length))
+        request.end_headers()
+        if body and content:
+            request.wfile.write(content)
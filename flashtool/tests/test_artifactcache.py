@@ -0,0 +1,97 @@
+__author__ = 'mahieke'
+
+import os
+import sys
+
+sys.path.extend('..')
+
+import flashtool.server.artifactcache as artifactcache
+from flashtool.server.artifactcache import ArtifactCache
+
+
+def store(cache, artifact, content):
+    path = cache.path(artifact)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return cache.add(artifact)
+
+
+def test_lookup_verified_without_rehash(monkeypatch, tmpdir):
+    cache = ArtifactCache(str(tmpdir))
+    store(cache, 'linux/bbb/linux_boot.tar.gz', b'a' * 1000)
+    cache.save()
+
+    hashed = []
+    monkeypatch.setattr(artifactcache, 'sha256sum', lambda path: hashed.append(path))
+
+    cache = ArtifactCache(str(tmpdir))
+    for i in range(100):
+        assert cache.lookup('linux/bbb/linux_boot.tar.gz', 1000) == cache.path('linux/bbb/linux_boot.tar.gz')
+
+    assert hashed == []
+
+
+def test_lookup_broken(tmpdir):
+    cache = ArtifactCache(str(tmpdir))
+    path = store(cache, 'linux/bbb/linux_boot.tar.gz', b'a' * 1000)
+
+    # truncated file
+    assert cache.lookup('linux/bbb/linux_boot.tar.gz', 2000) is None
+    assert not os.path.exists(path)
+
+    # changed content
+    path = store(cache, 'linux/bbb/linux_boot.tar.gz', b'a' * 1000)
+    with open(path, 'r+b') as f:
+        f.write(b'b')
+    os.utime(path, (0, 0))
+
+    assert cache.lookup('linux/bbb/linux_boot.tar.gz', 1000) is None
+    assert not os.path.exists(path)
+
+
+def test_lookup_unknown_file(tmpdir):
+    cache = ArtifactCache(str(tmpdir))
+    os.makedirs(str(tmpdir.join('misc', 'bbb')))
+    tmpdir.join('misc', 'bbb', 'misc_boot.tar.gz').write(b'x' * 10)
+
+    assert cache.lookup('misc/bbb/misc_boot.tar.gz', 9) is None
+    tmpdir.join('misc', 'bbb', 'misc_boot.tar.gz').write(b'x' * 10)
+    assert cache.lookup('misc/bbb/misc_boot.tar.gz', 10) == cache.path('misc/bbb/misc_boot.tar.gz')
+    assert cache.digest('misc/bbb/misc_boot.tar.gz') == artifactcache.sha256sum(cache.path('misc/bbb/misc_boot.tar.gz'))
+
+
+def test_lru_eviction(tmpdir):
+    cache = ArtifactCache(str(tmpdir), quota=2500)
+    store(cache, 'a', b'a' * 1000)
+    store(cache, 'b', b'b' * 1000)
+    cache.lookup('a')
+    store(cache, 'c', b'c' * 1000)
+
+    assert os.path.exists(cache.path('a'))
+    assert not os.path.exists(cache.path('b'))
+    assert os.path.exists(cache.path('c'))
+    assert cache.size() == 2000
+
+
+def test_same_content_is_linked(tmpdir):
+    cache = ArtifactCache(str(tmpdir), quota=1500)
+    store(cache, 'rootfs/factory/a_rootfs.tar.gz', b'r' * 1000)
+    store(cache, 'rootfs/other/a_rootfs.tar.gz', b'r' * 1000)
+
+    assert os.path.samefile(cache.path('rootfs/factory/a_rootfs.tar.gz'), cache.path('rootfs/other/a_rootfs.tar.gz'))
+    assert cache.size() == 1000
+    assert cache.find(cache.digest('rootfs/other/a_rootfs.tar.gz')) is not None
+
+
+def test_eviction_of_linked_artifacts(tmpdir):
+    cache = ArtifactCache(str(tmpdir), quota=1500)
+    store(cache, 'rootfs/factory/a_rootfs.tar.gz', b'r' * 1000)
+    store(cache, 'rootfs/other/a_rootfs.tar.gz', b'r' * 1000)
+    store(cache, 'linux/bbb/linux_boot.tar.gz', b'l' * 1000)
+
+    # both links of the rootfs have to go to free its space
+    assert not os.path.exists(cache.path('rootfs/factory/a_rootfs.tar.gz'))
+    assert not os.path.exists(cache.path('rootfs/other/a_rootfs.tar.gz'))
+    assert os.path.exists(cache.path('linux/bbb/linux_boot.tar.gz'))
+    assert cache.size() == 1000
@@ -0,0 +1,93 @@
+__author__ = 'mahieke'
+
+import os
+import sys
+
+import pytest
+
+sys.path.extend('..')
+
+from flashtool.setup.devlayout.bmap import generate_bmap, save_bmap, load_bmap, write_image, BmapChecksumError
+from flashtool.setup.devlayout.bmap import unmapped_ranges, _zero_range
+
+MB = 1024 * 1024
+
+
+def sparse_image(path, size, data):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for offset, content in data:
+            f.seek(offset)
+            f.write(content)
+
+
+def test_generate_bmap(tmpdir):
+    image = str(tmpdir.join('test.img'))
+    sparse_image(image, 64 * MB, [(0, b'\x01' * 5000), (10 * MB + 100, b'\x02' * 100), (64 * MB - 512, b'\x03' * 512)])
+
+    bmap = generate_bmap(image)
+
+    assert bmap['image_size'] == 64 * MB
+    spans = [(r['start'], r['end']) for r in bmap['ranges']]
+    # ranges are aligned to blocks, the filesystem might map larger parts
+    assert spans[0][0] == 0 and spans[0][1] >= 8192
+    assert any(s <= 10 * MB and e >= 10 * MB + 4096 for s, e in spans)
+    assert spans[-1][1] == 64 * MB
+    assert bmap['mapped'] < 8 * MB
+    assert all(len(r['sha256']) == 64 for r in bmap['ranges'])
+
+    save_bmap(bmap, image + '.bmap')
+    assert load_bmap(image + '.bmap') == bmap
+
+
+def test_write_image(tmpdir):
+    image = str(tmpdir.join('test.img'))
+    data = [(4096, os.urandom(3 * MB)), (40 * MB, os.urandom(4096))]
+    sparse_image(image, 64 * MB, data)
+    bmap = generate_bmap(image)
+
+    # old content of the target is replaced by the holes of the image
+    target = str(tmpdir.join('target.img'))
+    with open(target, 'wb') as f:
+        f.write(b'\xff' * MB)
+
+    written = write_image(image, target, bmap, buffer_size=MB)
+
+    assert written == bmap['mapped']
+    with open(image, 'rb') as a, open(target, 'rb') as b:
+        assert a.read() == b.read()
+
+    # a changed image does not match the checksums of its block map
+    with open(image, 'r+b') as f:
+        f.seek(40 * MB)
+        f.write(b'changed')
+
+    with pytest.raises(BmapChecksumError):
+        write_image(image, target, bmap)
+
+
+def test_zero_unmapped(tmpdir):
+    bmap = {'image_size': 10 * MB, 'ranges': [{'start': 0, 'end': MB}, {'start': 4 * MB, 'end': 5 * MB}]}
+    assert list(unmapped_ranges(bmap)) == [(MB, 4 * MB), (5 * MB, 10 * MB)]
+
+    # a file does not support BLKZEROOUT, zeros are written
+    target = str(tmpdir.join('card'))
+    with open(target, 'wb') as f:
+        f.write(b'\xff' * 10 * MB)
+
+    fd = os.open(target, os.O_WRONLY)
+    try:
+        for start, end in unmapped_ranges(bmap):
+            _zero_range(fd, start, end, buffer_size=MB)
+        # not aligned to sectors
+        _zero_range(fd, MB - 100, MB - 10)
+    finally:
+        os.close(fd)
+
+    with open(target, 'rb') as f:
+        content = f.read()
+    assert content[:MB - 100] == b'\xff' * (MB - 100)
+    assert content[MB - 100:MB - 10] == bytes(90)
+    assert content[MB:4 * MB] == bytes(3 * MB)
+    assert content[4 * MB:5 * MB] == b'\xff' * MB
+    assert content[5 * MB:] == bytes(5 * MB)
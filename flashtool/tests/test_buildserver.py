@@ -0,0 +1,750 @@
+__author__ = 'mahieke'
+
+import copy
+from collections import OrderedDict
+import io
+import json
+import sys
+import random
+import threading
+import time
+import pytest
+
+sys.path.extend('..')
+
+import flashtool.server.buildserver as buildserver
+from flashtool.server.buildserver import Buildserver
+
+
+class FakeResponse():
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.raw = io.BytesIO(data if isinstance(data, bytes) else b'')
+
+    def json(self):
+        return copy.deepcopy(self.data)
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FlakyArtifact():
+    '''
+    Serves an artifact with range support. The first answers break off after fail_after bytes.
+    '''
+    def __init__(self, content, fail_after, failures, accept_ranges=True):
+        self.content = content
+        self.fail_after = fail_after
+        self.failures = failures
+        self.accept_ranges = accept_ranges
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def head(self, url, **kwargs):
+        headers = {'Content-Length': str(len(self.content))}
+        if self.accept_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+        return FakeResponse(None, 200, headers)
+
+    def get(self, url, headers=None, **kwargs):
+        offset, end, status = 0, len(self.content), 200
+        if headers and 'Range' in headers and self.accept_ranges:
+            status = 206
+            first, last = headers['Range'].split('=')[1].split('-')
+            offset = int(first)
+            if last:
+                end = int(last) + 1
+        with self.lock:
+            self.ranges.append(offset)
+
+        data = self.content[offset:end]
+        if self.failures:
+            with self.lock:
+                self.failures -= 1
+            artifact = self
+
+            class Broken(FakeResponse):
+                def iter_content(self, chunk_size):
+                    yield data[:artifact.fail_after]
+                    raise buildserver.ChunkedEncodingError('connection reset')
+
+            return Broken(data, status)
+
+        return FakeResponse(data, status, {'Content-Length': str(len(data))})
+
+
+def build_json(builds, num):
+    props = builds[num]
+    if props is None:
+        return {'number': num, 'text': ['failed', 'compile'], 'properties': [], 'times': [num, num + 1]}
+    return {'number': num, 'text': ['build', 'successful'], 'times': [num, num + 1],
+            'properties': [[k, v, 'Build'] for k, v in props.items()]}
+
+
+def fake_buildbot(builders, delay=0.0):
+    '''
+    Returns a replacement for requests.get which answers like a buildbot 0.8 json interface.
+
+    :param builders: {buildername: (schedulers, [build properties or None for failed builds])}
+    :param delay: maximum random delay of an answer in seconds
+    '''
+    def get(url, *args, **kwargs):
+        get.requests.append(url)
+        if delay:
+            time.sleep(random.uniform(0, delay))
+
+        path, _, query = url.split('://', 1)[1].partition('?')
+        path = path.partition('/')[2].rstrip('/')
+
+        if path == '':
+            return FakeResponse({})
+        if path == 'json':
+            return FakeResponse({'builders': {name: {'basedir': name, 'schedulers': b[0]}
+                                              for name, b in builders.items()}})
+
+        parts = path.split('/')
+        name = parts[2]
+        builds = builders[name][1]
+
+        if len(parts) == 4:
+            nums = [int(opt.split('=')[1]) for opt in query.split('&') if opt.startswith('select=')]
+            return FakeResponse({str(n): build_json(builds, n) for n in nums if n < len(builds)})
+
+        num = int(parts[4])
+        if num == -1:
+            num = len(builds) - 1
+        return FakeResponse(build_json(builds, num))
+
+    get.requests = []
+    return get
+
+
+def scheduler(platform):
+    return 'default / branch: master / filter: \'.*{}.*\''.format(platform)
+
+
+BUILDERS = {
+    'armv7a': ([scheduler('bbb'), scheduler('wandboard')], [
+        {'platform': 'bbb', 'product': 'linux', 'upload_files': ['linux_4.1_{}_boot.tar.gz'.format(i)]}
+        if i % 3 else None for i in range(40)
+    ]),
+    'rootfs_armv7a': (['rootfs / name: factory / x'], [
+        {'platform': 'factory', 'upload_files': ['rootfs_factory_{}_rootfs.tar.gz'.format(i)]} for i in range(15)
+    ]),
+}
+
+
+def builds_info(monkeypatch, workers, delay=0.0, cache_dir=None, batch_size=50):
+    get = fake_buildbot(BUILDERS, delay)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    server = Buildserver('http://buildbot', '8010', ['bbb', 'wandboard'], workers=workers,
+                         batch_size=batch_size, cache_dir=cache_dir)
+    builds = server.get_builds_info()
+    builds_info.requests = get.requests
+    return builds
+
+
+def test_builds_info_content(monkeypatch):
+    builds = builds_info(monkeypatch, 1)
+
+    assert list(builds.keys()) == ['bbb', 'wandboard']
+    assert builds['bbb']['linux'] == ['linux_4.1_{}_boot.tar.gz'.format(i) for i in range(40) if i % 3]
+    assert builds['bbb']['rootfs']['factory'] == ['rootfs_factory_{}_rootfs.tar.gz'.format(i) for i in range(15)]
+
+
+@pytest.mark.parametrize("workers", [2, 8, 32])
+def test_builds_info_deterministic(monkeypatch, workers):
+    assert builds_info(monkeypatch, 1) == builds_info(monkeypatch, workers, delay=0.002, batch_size=3)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 40, 100])
+def test_builds_info_batches(monkeypatch, batch_size):
+    builds = builds_info(monkeypatch, 4, batch_size=batch_size)
+    build_requests = [r for r in builds_info.requests if 'select=' in r]
+
+    assert builds == builds_info(monkeypatch, 1, batch_size=1)
+    # both platforms share the 40 builds of armv7a and 15 of rootfs_armv7a
+    assert len(build_requests) == -(-40 // batch_size) + -(-15 // batch_size)
+    assert len(build_requests) == len(set(build_requests))
+
+
+def test_catalog_warm_run(monkeypatch, tmpdir):
+    cold = builds_info(monkeypatch, 4, cache_dir=str(tmpdir))
+    cold_requests = len(builds_info.requests)
+
+    assert tmpdir.join('.builds').check()
+
+    warm = builds_info(monkeypatch, 4, cache_dir=str(tmpdir))
+    build_requests = [r for r in builds_info.requests if '/builds/' in r and not r.rstrip('/').endswith('/-1')]
+
+    assert warm == cold
+    assert build_requests == []
+    assert len(builds_info.requests) < cold_requests
+
+
+def test_catalog_pruned_builds(monkeypatch, tmpdir):
+    get = fake_buildbot(BUILDERS)
+
+    def pruned_get(url, **kwargs):
+        response = get(url, **kwargs)
+        if 'select=' in url and isinstance(response.data, dict):
+            # the server keeps only the newest builds (buildHorizon)
+            response.data = {n: b for n, b in response.data.items() if int(n) >= 10}
+        return response
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: pruned_get(url, **kwargs))
+    cold = Buildserver('http://buildbot', '8010', ['bbb'], cache_dir=str(tmpdir)).get_builds_info()
+
+    del get.requests[:]
+    warm = Buildserver('http://buildbot', '8010', ['bbb'], cache_dir=str(tmpdir)).get_builds_info()
+
+    assert warm == cold
+    assert 'linux_4.1_10_boot.tar.gz' in warm['bbb']['linux']
+    assert 'linux_4.1_8_boot.tar.gz' not in warm['bbb']['linux']
+    assert [r for r in get.requests if 'select=' in r] == []
+
+
+def test_shared_session(monkeypatch):
+    sessions = set()
+    get = fake_buildbot(BUILDERS)
+
+    def session_get(session, url, **kwargs):
+        sessions.add(id(session))
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', session_get)
+    server = Buildserver('http://buildbot', '8010', ['bbb'], workers=8, batch_size=5)
+    server.get_builds_info()
+
+    assert len(sessions) == 1
+    assert server.session.get_adapter('http://buildbot').poolmanager.connection_pool_kw['maxsize'] == 8
+
+
+def test_build_info_head_cache(monkeypatch, tmpdir):
+    heads = []
+
+    def session_head(session, url, **kwargs):
+        heads.append(url)
+        if url.endswith('_0_boot.tar.gz') or '_1_' in url:
+            return FakeResponse(None, 404)
+        return FakeResponse(None, 200, {'Content-Length': '1024', 'Last-Modified': 'Sat, 17 Oct 2026 10:00:00 GMT'})
+
+    monkeypatch.setattr(buildserver.requests.Session, 'head', session_head)
+    builds = builds_info(monkeypatch, 4, cache_dir=str(tmpdir))
+
+    server = Buildserver('http://buildbot', '8010', ['bbb'], cache_dir=str(tmpdir))
+    info = server.get_build_info(builds, ['linux', 'rootfs'], 'bbb')
+
+    assert 'linux_4.1_1_boot.tar.gz' not in info['bbb']['linux']
+    assert 'linux_4.1_2_boot.tar.gz' in info['bbb']['linux']
+    assert 'rootfs_factory_1_rootfs.tar.gz' not in info['bbb']['rootfs']['factory']
+    assert len(info['bbb']['rootfs']['factory']) == 14
+    assert server.get_file_size('linux/bbb/linux_4.1_2_boot.tar.gz') == 1024
+    assert len(heads) == len(set(heads)) == 26 + 15
+
+    # a new instance uses the persisted results
+    server = Buildserver('http://buildbot', '8010', ['bbb'], cache_dir=str(tmpdir))
+    assert server.get_build_info(builds, ['linux', 'rootfs'], 'bbb') == info
+    assert len(heads) == 26 + 15
+
+    # available and missing artifacts are checked again when their results expired
+    for entry in server.artifacts.data.values():
+        entry['checked'] -= server.artifacts.ttl + 1
+    server.get_build_info(builds, ['linux', 'rootfs'], 'bbb')
+    assert len(heads) == 2 * (26 + 15)
+
+
+def test_server_error(monkeypatch):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Unavailable(BaseHTTPRequestHandler):
+        def answer(self):
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_GET = do_HEAD = answer
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(('127.0.0.1', 0), Unavailable)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        server = Buildserver('http://127.0.0.1', str(httpd.server_port), ['bbb'], retries=1)
+
+        with pytest.raises(buildserver.BuildserverConnectionError):
+            server.get_builders_info()
+
+        # connection problems are not cached
+        assert server.get_file_info('linux/bbb/linux_boot.tar.gz')['available'] is False
+        assert server.artifacts.get('linux/bbb/linux_boot.tar.gz') is None
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_get_file_resume(monkeypatch, tmpdir):
+    content = bytes(range(256)) * 1000
+    artifact = FlakyArtifact(content, 100000, 2)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir), retries=3)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: artifact.get(url, **kwargs))
+    monkeypatch.setattr(buildserver.requests.Session, 'head', lambda session, url, **kwargs: artifact.head(url, **kwargs))
+    monkeypatch.setattr(buildserver.time, 'sleep', lambda s: None)
+
+    path, size = server.get_file('linux/bbb/linux_boot.tar.gz')
+
+    assert size == len(content)
+    assert open(path, 'rb').read() == content
+    assert artifact.ranges == [0, 100000, 200000]
+    assert not tmpdir.join('linux', 'bbb', 'linux_boot.tar.gz.part').check()
+
+
+def test_get_file_keeps_part(monkeypatch, tmpdir):
+    content = bytes(range(256)) * 1000
+    artifact = FlakyArtifact(content, 1000, 10)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir), retries=1)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: artifact.get(url, **kwargs))
+    monkeypatch.setattr(buildserver.requests.Session, 'head', lambda session, url, **kwargs: artifact.head(url, **kwargs))
+    monkeypatch.setattr(buildserver.time, 'sleep', lambda s: None)
+
+    with pytest.raises(buildserver.ChunkedEncodingError):
+        server.get_file('linux/bbb/linux_boot.tar.gz')
+
+    assert tmpdir.join('linux', 'bbb', 'linux_boot.tar.gz.part').size() == 2000
+    assert not tmpdir.join('linux', 'bbb', 'linux_boot.tar.gz').check()
+
+
+@pytest.mark.parametrize("accept_ranges", [True, False])
+def test_get_file_segmented(monkeypatch, tmpdir, accept_ranges):
+    content = bytes(range(256)) * 4000
+    artifact = FlakyArtifact(content, 50000, 2, accept_ranges)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir), segments=4, retries=3)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: artifact.get(url, **kwargs))
+    monkeypatch.setattr(buildserver.requests.Session, 'head', lambda session, url, **kwargs: artifact.head(url, **kwargs))
+    monkeypatch.setattr(buildserver.time, 'sleep', lambda s: None)
+    monkeypatch.setattr(buildserver, 'SEGMENT_MIN_SIZE', 1024)
+
+    path, size = server.get_file('rootfs/factory/rootfs_factory.tar.gz')
+
+    assert size == len(content)
+    assert open(path, 'rb').read() == content
+    assert not tmpdir.join('rootfs', 'factory', 'rootfs_factory.tar.gz.part.segments').check()
+    if accept_ranges:
+        assert set(artifact.ranges) >= set(len(content) * i // 4 for i in range(4))
+        assert artifact.ranges.count(0) == 1
+
+
+def test_open_stream_untar(monkeypatch, tmpdir):
+    import tarfile
+    import flashtool.utility as util
+
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode='w:gz') as tar:
+        for name in ['etc/hostname', 'boot/uImage']:
+            data = name.encode() * 100
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    content = tarball.getvalue()
+    artifact = FlakyArtifact(content, 0, 0)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir.mkdir('dest')))
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: artifact.get(url, **kwargs))
+    monkeypatch.setattr(buildserver.requests.Session, 'head', lambda session, url, **kwargs: artifact.head(url, **kwargs))
+
+    stream = server.open_stream('rootfs/factory/rootfs_factory.tar.gz')
+    util.untar(stream, str(tmpdir.join('part')))
+    stream.verify()
+    stream.close()
+
+    assert tmpdir.join('part', 'boot', 'uImage').read() == 'boot/uImage' * 100
+    assert not tmpdir.join('dest', 'rootfs').check()
+
+    # a truncated transfer is detected
+    artifact.content = content[:-10]
+    artifact.head = lambda url, **kwargs: FakeResponse(None, 200, {'Content-Length': str(len(content))})
+    server.artifacts.data.clear()
+    stream = server.open_stream('rootfs/factory/rootfs_factory.tar.gz')
+    with pytest.raises(buildserver.BuildserverPackageError):
+        stream.verify()
+
+
+def test_parse_digest():
+    import base64
+    import hashlib
+
+    digest = hashlib.sha256(b'artifact').hexdigest()
+    encoded = base64.b64encode(hashlib.sha256(b'artifact').digest()).decode()
+
+    assert buildserver.parse_digest({'Repr-Digest': 'sha-512=:abc=:, sha-256=:{}:'.format(encoded)}) == digest
+    assert buildserver.parse_digest({'Digest': 'SHA-256={}'.format(encoded)}) == digest
+    assert buildserver.parse_digest({'X-Checksum-Sha256': digest.upper()}) == digest
+    assert buildserver.parse_digest({'Digest': 'md5=abc'}) is None
+    assert buildserver.parse_digest({}) is None
+
+
+def test_stream_reference_digest(monkeypatch, tmpdir):
+    import base64
+    import hashlib
+
+    content = bytes(range(256)) * 100
+    artifact = FlakyArtifact(content, 0, 0)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir))
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: artifact.get(url, **kwargs))
+    monkeypatch.setattr(buildserver.requests.Session, 'head', lambda session, url, **kwargs: artifact.head(url, **kwargs))
+
+    # the digest of the first verified stream is recorded
+    stream = server.open_stream('linux/bbb/linux_boot.tar.gz')
+    assert stream.verify() == hashlib.sha256(content).hexdigest()
+    assert server.get_file_info('linux/bbb/linux_boot.tar.gz')['sha256'] == hashlib.sha256(content).hexdigest()
+
+    # a later download with the same size but other content is rejected
+    artifact.content = bytes(reversed(content))
+    with pytest.raises(buildserver.BuildserverPackageError):
+        server.get_file('linux/bbb/linux_boot.tar.gz')
+    assert not tmpdir.join('linux', 'bbb', 'linux_boot.tar.gz').check()
+
+    # the digest announced by the server is checked
+    head = artifact.head
+    artifact.head = lambda url, **kwargs: FakeResponse(None, 200, dict(
+        head(url).headers, Digest='sha-256={}'.format(base64.b64encode(hashlib.sha256(content).digest()).decode())))
+    server.artifacts.data.clear()
+    stream = server.open_stream('linux/bbb/linux_boot.tar.gz')
+    with pytest.raises(buildserver.BuildserverPackageError):
+        stream.verify()
+
+    artifact.content = content
+    path, size = server.get_file('linux/bbb/linux_boot.tar.gz')
+    assert server.cache.digest('linux/bbb/linux_boot.tar.gz') == hashlib.sha256(content).hexdigest()
+
+
+def test_local_products_not_evicted(tmpdir):
+    # the local products are a mirror, only the temporary download cache has a quota
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir), cache_quota=1000)
+    assert server.cache.root == str(tmpdir)
+    assert server.cache.quota == 0
+
+    server = Buildserver('http://buildbot', '8010', ['bbb'], cache_quota=1000)
+    assert server.cache.quota == 1000
+
+
+def test_prefetch(monkeypatch, tmpdir):
+    content = bytes(range(256)) * 1000
+    artifact = FlakyArtifact(content, 0, 0)
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir))
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: artifact.get(url, **kwargs))
+    monkeypatch.setattr(buildserver.requests.Session, 'head', lambda session, url, **kwargs: artifact.head(url, **kwargs))
+
+    future = server.prefetch('linux/bbb/linux_boot.tar.gz')
+    assert server.prefetch('linux/bbb/linux_boot.tar.gz') is future
+
+    path, size = future.result()
+    assert size == len(content)
+    assert open(path, 'rb').read() == content
+    assert artifact.ranges == [0]
+
+    abort = server.abort
+    server.cancel_prefetch()
+    assert abort.is_set()
+    assert server.prefetch('linux/bbb/linux_boot.tar.gz') is not future
+
+
+def test_index_versions():
+    files = ['linux/bbb/linux_4.1_1_boot.tar.gz', 'linux/bbb/linux_4.1_1_root.tar.gz',
+             'linux/bbb/linux_4.1_10_boot.tar.gz', 'linux/bbb/linux_4.1_1_boot.tar.xz']
+
+    assert buildserver.index_versions(files) == {
+        'linux/bbb/linux_4.1_1': {'boot': 'linux/bbb/linux_4.1_1_boot.tar.gz', 'root': 'linux/bbb/linux_4.1_1_root.tar.gz'},
+        'linux/bbb/linux_4.1_10': {'boot': 'linux/bbb/linux_4.1_10_boot.tar.gz'},
+    }
+
+
+def test_get_files_path(monkeypatch):
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: FakeResponse({}))
+    server = Buildserver('http://buildbot', '8010', ['bbb'])
+
+    files = ['linux_4.{}_{}_{}.tar.gz'.format(i % 3, i, t) for i in range(200) for t in ['boot', 'root'] if i != 199 or t == 'boot']
+    file_info = {'bbb': {'linux': files}}
+
+    assert server.get_files_path(file_info, '', [('linux', ['boot', 'root'])], True) == \
+        [('linux', [('boot', 'linux/bbb/linux_4.2_98_boot.tar.gz'), ('root', 'linux/bbb/linux_4.2_98_root.tar.gz')])]
+    assert server.get_versions_filterd_by_types(['linux/bbb/' + f for f in files], ['linux/bbb/linux_4.1_199', 'linux/bbb/linux_4.0_198'],
+                                                ['boot', 'root']) == ['linux/bbb/linux_4.0_198']
+
+    with pytest.raises(buildserver.BuildserverFilesNotFound):
+        server.get_files_path(file_info, 'linux_5', [('linux', ['boot', 'root'])], True)
+
+
+def test_builds_info_limit(monkeypatch):
+    get = fake_buildbot(BUILDERS)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], batch_size=10)
+
+    builds = server.get_builds_info(limit=2, products=['linux', 'rootfs'])
+
+    assert builds['bbb']['linux'] == ['linux_4.1_37_boot.tar.gz', 'linux_4.1_38_boot.tar.gz']
+    assert builds['bbb']['rootfs']['factory'] == ['rootfs_factory_13_rootfs.tar.gz', 'rootfs_factory_14_rootfs.tar.gz']
+    # only the newest batch of each builder was requested
+    selects = [r.split('?')[1] for r in get.requests if '?' in r]
+    assert sorted(selects) == sorted(['&'.join('select={}'.format(n) for n in range(5, 15)),
+                                      '&'.join('select={}'.format(n) for n in range(30, 40))])
+
+
+@pytest.mark.parametrize("api", ['0.8', '2'])
+def test_builds_info_limit_default_products(monkeypatch, tmpdir, api):
+    # the products of list_builds without product flags, the builders never build uboot and misc
+    products = ['linux', 'uboot', 'rootfs', 'misc']
+    get = fake_buildbot(BUILDERS) if api == '0.8' else fake_nine(BUILDERS)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    cfg = {'server': 'http://buildbot', 'port': '8010', 'api': api, 'batch_size': '10'}
+
+    builds = buildserver.get_buildserver(cfg, ['bbb']).get_builds_info(limit=2, products=products)
+
+    assert builds['bbb']['linux'] == ['linux_4.1_37_boot.tar.gz', 'linux_4.1_38_boot.tar.gz']
+    # only the newest batch of each builder was requested
+    assert len([r for r in get.requests if 'select=' in r or 'offset=' in r]) == 2
+
+    # wandboard never had a build, a catalog with the whole history knows it
+    server = buildserver.get_buildserver(cfg, ['bbb', 'wandboard'], cache_dir=str(tmpdir))
+    server.get_builds_info()
+    assert server._required_builds('armv7a', products) == [('bbb', 'linux')]
+
+
+def test_builds_info_shared_architecture(monkeypatch):
+    # bbb and wandboard share the builder of their architecture
+    builders = {
+        'armv7a': ([scheduler('bbb'), scheduler('wandboard')],
+                   [{'platform': p, 'product': 'linux', 'upload_files': ['linux_{}_{}_boot.tar.gz'.format(p, i)]}
+                    for i, p in enumerate(['bbb', 'wandboard', 'bbb', 'wandboard'])]),
+    }
+    get = fake_buildbot(builders)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    server = Buildserver('http://buildbot', '8010', ['bbb', 'wandboard'])
+
+    builds = server.get_builds_info()
+
+    assert builds['bbb']['linux'] == ['linux_bbb_0_boot.tar.gz', 'linux_bbb_2_boot.tar.gz']
+    assert builds['wandboard']['linux'] == ['linux_wandboard_1_boot.tar.gz', 'linux_wandboard_3_boot.tar.gz']
+
+
+def test_builds_info_limit_platforms(monkeypatch):
+    # the newest batch has only builds of bbb, the build of wandboard is older
+    builders = {
+        'armv7a': ([scheduler('bbb'), scheduler('wandboard')],
+                   [{'platform': 'wandboard', 'product': 'linux', 'upload_files': ['linux_wand_0_boot.tar.gz']}] +
+                   [{'platform': 'bbb', 'product': 'linux', 'upload_files': ['linux_bbb_{}_boot.tar.gz'.format(i)]}
+                    for i in range(1, 30)]),
+    }
+    get = fake_buildbot(builders)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    server = Buildserver('http://buildbot', '8010', ['bbb', 'wandboard'], batch_size=10)
+
+    builds = server.get_builds_info(limit=1, products=['linux'])
+
+    assert builds['bbb']['linux'] == ['linux_bbb_29_boot.tar.gz']
+    assert builds['wandboard']['linux'] == ['linux_wand_0_boot.tar.gz']
+
+    get = fake_nine(builders)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    cfg = {'server': 'http://buildbot', 'port': '8010', 'api': '2', 'batch_size': '10'}
+    builds = buildserver.get_buildserver(cfg, ['bbb', 'wandboard']).get_builds_info(limit=1, products=['linux'])
+
+    assert builds['bbb']['linux'] == ['linux_bbb_29_boot.tar.gz']
+    assert builds['wandboard']['linux'] == ['linux_wand_0_boot.tar.gz']
+
+
+def test_builds_info_max_age(monkeypatch):
+    get = fake_buildbot(BUILDERS)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    server = Buildserver('http://buildbot', '8010', ['bbb'], batch_size=10)
+    monkeypatch.setattr(buildserver.time, 'time', lambda: 1000)
+
+    builds = server.get_builds_info(max_age=970)
+
+    assert builds['bbb']['linux'] == ['linux_4.1_{}_boot.tar.gz'.format(i) for i in [29, 31, 32, 34, 35, 37, 38]]
+    assert 'rootfs' not in builds['bbb']
+
+
+def test_conditional_discovery(monkeypatch, tmpdir):
+    get = fake_buildbot(BUILDERS)
+    answers = []
+
+    def conditional_get(url, headers=None, **kwargs):
+        response = get(url, **kwargs)
+        etag = '"{}"'.format(hash(repr(response.data)))
+        if headers and headers.get('If-None-Match') == etag:
+            response = FakeResponse(None, 304)
+        response.headers['ETag'] = etag
+        answers.append((url, response.status_code))
+        return response
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: conditional_get(url, **kwargs))
+
+    cold = Buildserver('http://buildbot', '8010', ['bbb'], cache_dir=str(tmpdir)).get_builds_info()
+    assert tmpdir.join('.http_cache').check()
+
+    del answers[:]
+    warm = Buildserver('http://buildbot', '8010', ['bbb'], cache_dir=str(tmpdir)).get_builds_info()
+
+    assert warm == cold
+    assert [status for url, status in answers if '/json' in url] == [304] * 3
+
+
+def fake_nine(builders):
+    '''
+    Returns a replacement for requests.get which answers like the REST API of buildbot nine.
+    Builds of BUILDERS which are None failed. Build n completed at time n + 1, unless
+    get.complete_at says otherwise. Builds in get.running are not complete yet.
+    '''
+    names = list(builders.keys())
+
+    def get(url, *args, **kwargs):
+        get.requests.append(url)
+        path, _, query = url.split('://', 1)[1].partition('?')
+        path = path.partition('/')[2]
+        opts = [opt.split('=') for opt in query.split('&') if opt]
+        args = dict(opts)
+
+        if path == '':
+            return FakeResponse({})
+        if path == 'api/v2/builders':
+            return FakeResponse({'builders': [{'builderid': i, 'name': n} for i, n in enumerate(names)]})
+
+        name = names[int(path.split('/')[3])]
+        builds = [{'number': num, 'complete_at': get.complete_at.get((name, num), num + 1),
+                   'results': 0 if props else 2,
+                   'properties': {k: [v, 'Build'] for k, v in (props or {}).items()}}
+                  for num, props in enumerate(builders[name][1]) if (name, num) not in get.running]
+
+        assert args['complete'] == 'true' and args['order'] == '-number'
+        builds = [b for b in reversed(builds) if b['results'] == int(args['results'])
+                  and b['number'] > int(args.get('number__gt', -1))
+                  and b['complete_at'] > int(args.get('complete_at__gt', -1))
+                  and b['complete_at'] >= int(args.get('complete_at__ge', -1))]
+        offset = int(args.get('offset', 0))
+        builds = builds[offset:offset + int(args['limit'])]
+        for b in builds:
+            b.pop('results')
+        return FakeResponse({'builds': builds, 'meta': {'total': len(builds)}})
+
+    get.requests = []
+    get.complete_at = {}
+    get.running = set()
+    return get
+
+
+def test_builds_info_nine(monkeypatch, tmpdir):
+    old = builds_info(monkeypatch, 4)
+    assert list(old.keys()) == ['bbb', 'wandboard']
+
+    get = fake_nine(BUILDERS)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    cfg = {'server': 'http://buildbot', 'port': '8010', 'api': '2', 'batch_size': '10'}
+
+    server = buildserver.get_buildserver(cfg, ['bbb', 'wandboard'], cache_dir=str(tmpdir))
+    assert isinstance(server, buildserver.BuildserverNine)
+
+    # wandboard has no builds of its own
+    assert server.get_builds_info() == OrderedDict([('bbb', old['bbb'])])
+    assert server.get_platforms_info() == [('bbb', 'armv7a')]
+
+    # a warm run only asks for new builds
+    del get.requests[:]
+    server = buildserver.get_buildserver(cfg, ['bbb', 'wandboard'], cache_dir=str(tmpdir))
+    assert server.get_builds_info() == OrderedDict([('bbb', old['bbb'])])
+    assert all('complete_at__ge=' in r for r in get.requests if '/builds' in r)
+
+    server = buildserver.get_buildserver(cfg, ['bbb'])
+    builds = server.get_builds_info(limit=2)
+    assert builds['bbb']['linux'] == ['linux_4.1_37_boot.tar.gz', 'linux_4.1_38_boot.tar.gz']
+    assert builds['bbb']['rootfs']['factory'] == ['rootfs_factory_13_rootfs.tar.gz', 'rootfs_factory_14_rootfs.tar.gz']
+
+
+def test_builds_info_nine_catalog_gaps(monkeypatch, tmpdir):
+    old = builds_info(monkeypatch, 4)
+
+    get = fake_nine(BUILDERS)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    cfg = {'server': 'http://buildbot', 'port': '8010', 'api': '2', 'batch_size': '10'}
+
+    # build 38 is still running while the newer build 39 is complete
+    get.running.add(('armv7a', 38))
+    server = buildserver.get_buildserver(cfg, ['bbb'], cache_dir=str(tmpdir))
+    builds = server.get_builds_info(limit=2, products=['linux', 'rootfs'])
+    assert builds['bbb']['linux'] == ['linux_4.1_35_boot.tar.gz', 'linux_4.1_37_boot.tar.gz']
+
+    # a windowed scan leaves a gap in the catalog, a full scan fills it
+    server = buildserver.get_buildserver(cfg, ['bbb'], cache_dir=str(tmpdir))
+    builds = server.get_builds_info()
+    assert builds['bbb']['linux'] == [f for f in old['bbb']['linux'] if f != 'linux_4.1_38_boot.tar.gz']
+    assert builds['bbb']['rootfs'] == old['bbb']['rootfs']
+
+    # the next run only asks for builds which completed since, build 38 among them
+    get.running.clear()
+    get.complete_at[('armv7a', 38)] = 100
+    del get.requests[:]
+    server = buildserver.get_buildserver(cfg, ['bbb'], cache_dir=str(tmpdir))
+    assert server.get_builds_info() == OrderedDict([('bbb', old['bbb'])])
+    assert all('complete_at__ge=' in r for r in get.requests if '/builds' in r)
+
+
+def test_offline(monkeypatch, tmpdir):
+    monkeypatch.setattr(buildserver.requests.Session, 'head',
+                        lambda session, url, **kwargs: FakeResponse(None, 200, {'Content-Length': '1024'}))
+    online = builds_info(monkeypatch, 4, cache_dir=str(tmpdir))
+    server = Buildserver('http://buildbot', '8010', ['bbb', 'wandboard'], cache_dir=str(tmpdir))
+    online_files = server.get_build_info(online, ['linux', 'rootfs'], 'bbb')
+
+    def no_network(session, url, **kwargs):
+        raise AssertionError('request to {}'.format(url))
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', no_network)
+    monkeypatch.setattr(buildserver.requests.Session, 'head', no_network)
+
+    # construction does not contact the server
+    Buildserver('http://buildbot', '8010', ['bbb'])
+
+    server = Buildserver('http://buildbot', '8010', ['bbb', 'wandboard'], cache_dir=str(tmpdir), offline=True)
+    offline = server.get_builds_info()
+
+    assert offline == online
+    assert server.get_build_info(offline, ['linux', 'rootfs'], 'bbb') == online_files
+    with pytest.raises(buildserver.BuildserverConnectionError):
+        server.get_file('linux/bbb/linux_4.1_2_boot.tar.gz')
+
+
+def test_local_info(monkeypatch, tmpdir):
+    get = fake_buildbot(BUILDERS)
+    monkeypatch.setattr(buildserver.requests.Session, 'get', lambda session, url, **kwargs: get(url, **kwargs))
+    Buildserver('http://buildbot', '8010', ['bbb', 'wandboard'], dest=str(tmpdir)).get_builds_info()
+
+    assert json.loads(tmpdir.join('.platforms').read()) == {'bbb': 'armv7a', 'wandboard': 'armv7a'}
+    assert json.loads(tmpdir.join('.rootfs').read()) == {'factory': 'armv7a'}
@@ -0,0 +1,68 @@
+__author__ = 'mahieke'
+
+import os
+import sys
+
+sys.path.extend('..')
+
+from flashtool.setup.devlayout.bmap import bmap_path
+from flashtool.setup.devlayout.golden import GoldenImageCache
+
+
+def build_image(directory, name, content):
+    image = str(directory.join(name))
+    with open(image, 'wb') as f:
+        f.write(content)
+    with open(bmap_path(image), 'w') as f:
+        f.write('{}')
+    return image
+
+
+def test_key():
+    files = [('linux/bbb/linux_4.1_38_boot.tar.gz', 'a' * 64), ('rootfs/factory/rootfs_14.tar.gz', 'b' * 64)]
+    key = GoldenImageCache.key('r' * 64, 'bbb', 1024, files)
+
+    # the order of the files does not matter, every part of the key does
+    assert key == GoldenImageCache.key('r' * 64, 'bbb', 1024, list(reversed(files)))
+    assert key != GoldenImageCache.key('s' * 64, 'bbb', 1024, files)
+    assert key != GoldenImageCache.key('r' * 64, 'bbb', 2048, files)
+    assert key != GoldenImageCache.key('r' * 64, 'bbb', 1024, [files[0], (files[1][0], 'c' * 64)])
+
+
+def test_cache(tmpdir):
+    directory = tmpdir.join('golden')
+    cache = GoldenImageCache(str(directory), keep=2)
+    assert cache.lookup('k1') is None
+
+    path = cache.add('k1', build_image(tmpdir, 'build.img', b'image 1'), {'platform': 'bbb'})
+    assert path == cache.path('k1')
+    assert os.path.isfile(bmap_path(path))
+    assert not tmpdir.join('build.img').check()
+
+    # the index survives a new instance
+    cache = GoldenImageCache(str(directory), keep=2)
+    assert cache.lookup('k1') == path
+
+    # least recently used images are removed
+    cache.add('k2', build_image(tmpdir, 'build.img', b'image 2'))
+    cache.lookup('k1')
+    cache.add('k3', build_image(tmpdir, 'build.img', b'image 3'))
+    assert cache.lookup('k2') is None
+    assert not os.path.isfile(cache.path('k2'))
+    assert cache.lookup('k1') and cache.lookup('k3')
+
+
+def test_file_digest(tmpdir, monkeypatch):
+    import flashtool.setup.devlayout.golden as golden
+    path = tmpdir.join('rootfs.tar.gz')
+    path.write('content')
+    cache = GoldenImageCache(str(tmpdir.join('golden')))
+
+    digest = cache.file_digest(str(path))
+    # an unchanged file is not hashed again
+    monkeypatch.setattr(golden, 'sha256sum', lambda p: 'x')
+    assert cache.file_digest(str(path)) == digest
+
+    path.write('new content')
+    os.utime(str(path), (0, 0))
+    assert cache.file_digest(str(path)) == 'x'
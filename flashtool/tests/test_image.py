@@ -0,0 +1,48 @@
+__author__ = 'mahieke'
+
+import os
+import sys
+
+import pytest
+
+sys.path.extend('..')
+
+from flashtool.setup.devlayout.image import get_image_size, create_sparse_image, parse_blkid, ImageSizeError
+
+
+class Part():
+    def __init__(self, size):
+        self.size = size
+
+
+def test_image_size():
+    mb = 1024 * 1024
+    # partitions are aligned to 1 MB, 1 MB in front and at the end
+    assert get_image_size([Part(64 * mb), Part(100 * mb + 1)]) == (2 + 64 + 101) * mb
+    assert get_image_size([Part(64 * mb), Part('max')], 1024 * mb) == 1024 * mb
+
+    with pytest.raises(ImageSizeError):
+        get_image_size([Part(64 * mb), Part('max')])
+
+    with pytest.raises(ImageSizeError):
+        get_image_size([Part(64 * mb)], 32 * mb)
+
+
+def test_sparse_image(tmpdir):
+    path = str(tmpdir.join('images', 'bbb.img'))
+    tmpdir.join('images').ensure(dir=True).join('bbb.img').write('old content')
+
+    create_sparse_image(path, 1024 * 1024 * 1024)
+
+    stat = os.stat(path)
+    assert stat.st_size == 1024 * 1024 * 1024
+    assert stat.st_blocks * 512 < 1024 * 1024
+    with open(path, 'rb') as f:
+        assert f.read(16) == b'\0' * 16
+
+
+def test_parse_blkid():
+    output = 'DEVNAME=/dev/loop1\nLABEL=ROOTFS\nUUID=4b3c1f2e-7a1d-4f8c-9d5e-2a6b8c0d1e3f\nVERSION=1.0\nTYPE=ext4\n'
+    assert parse_blkid(output) == {'DEVNAME': '/dev/loop1', 'LABEL': 'ROOTFS',
+                                   'UUID': '4b3c1f2e-7a1d-4f8c-9d5e-2a6b8c0d1e3f', 'VERSION': '1.0', 'TYPE': 'ext4'}
+    assert parse_blkid('') == {}
@@ -0,0 +1,84 @@
+__author__ = 'mahieke'
+
+import json
+import os
+import sys
+
+sys.path.extend('..')
+
+import flashtool.server.buildserver as buildserver
+from flashtool.server.buildserver import LocalBuilds
+
+
+def product_tree(tmpdir):
+    files = {
+        'linux/bbb': ['linux_4.1_1_boot.tar.gz', 'linux_4.1_1_root.tar.gz', 'linux_4.1_2_boot.tar.gz',
+                      'linux_4.1_2_root.tar.gz', 'linux_4.1_3_boot.tar.gz.part'],
+        'linux/rpi': ['linux_4.1_1_boot.tar.gz'],
+        'uboot/bbb': ['uboot_2015_1_uboot.img'],
+        'rootfs/factory': ['rootfs_factory_1_rootfs.tar.gz'],
+        'rootfs/desktop_x86': ['rootfs_desktop_x86_1_rootfs.tar.gz'],
+        'rootfs/unknown': ['rootfs_unknown_1_rootfs.tar.gz'],
+    }
+    for directory, names in files.items():
+        for name in names:
+            tmpdir.join(directory, name).write(name, ensure=True)
+
+    tmpdir.join('.platforms').write(json.dumps({'bbb': 'armv7a', 'rpi': 'armv6'}))
+    tmpdir.join('.rootfs').write(json.dumps({'factory': 'armv7a', 'desktop_x86': 'x86'}))
+
+
+def test_builds_info(tmpdir):
+    product_tree(tmpdir)
+    builds = LocalBuilds(str(tmpdir), ['bbb']).get_builds_info()
+
+    assert builds == {
+        'bbb': {
+            'linux': ['linux_4.1_1_boot.tar.gz', 'linux_4.1_1_root.tar.gz', 'linux_4.1_2_boot.tar.gz',
+                      'linux_4.1_2_root.tar.gz'],
+            'rootfs': {'factory': ['rootfs_factory_1_rootfs.tar.gz'], 'unknown': ['rootfs_unknown_1_rootfs.tar.gz']},
+            'uboot': ['uboot_2015_1_uboot.img'],
+        }
+    }
+
+
+def test_index(monkeypatch, tmpdir):
+    product_tree(tmpdir)
+    cache = tmpdir.mkdir('cache')
+    LocalBuilds(str(tmpdir), 'bbb', str(cache)).get_builds_info()
+    assert cache.join('.local_index').check()
+
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(buildserver.os, 'scandir', counting_scandir)
+
+    # unchanged product directories are not listed again
+    LocalBuilds(str(tmpdir), 'bbb', str(cache)).get_builds_info()
+    assert sorted(listed) == sorted([str(tmpdir)] + [str(tmpdir.join(p)) for p in ['linux', 'uboot', 'rootfs']])
+
+    tmpdir.join('linux', 'bbb', 'linux_4.1_3_boot.tar.gz').write('new')
+    del listed[:]
+    builds = LocalBuilds(str(tmpdir), 'bbb', str(cache)).get_builds_info()
+    assert str(tmpdir.join('linux', 'bbb')) in listed
+    assert str(tmpdir.join('uboot', 'bbb')) not in listed
+    assert 'linux_4.1_3_boot.tar.gz' in builds['bbb']['linux']
+
+
+def test_files(tmpdir):
+    product_tree(tmpdir)
+    local = LocalBuilds(str(tmpdir), ['bbb'])
+    file_info = local.get_build_info(local.get_builds_info(), ['linux'], 'bbb')
+
+    files = local.get_files_path(file_info, '', [('linux', ['boot', 'root'])], True)
+    assert files == [('linux', [('boot', 'linux/bbb/linux_4.1_2_boot.tar.gz'),
+                                ('root', 'linux/bbb/linux_4.1_2_root.tar.gz')])]
+
+    path, size = local.prefetch('linux/bbb/linux_4.1_2_boot.tar.gz').result()
+    assert path == str(tmpdir.join('linux', 'bbb', 'linux_4.1_2_boot.tar.gz'))
+    assert size == local.get_file_size('linux/bbb/linux_4.1_2_boot.tar.gz') == len('linux_4.1_2_boot.tar.gz')
+    assert not local.is_file_available('linux/bbb/linux_4.1_3_boot.tar.gz')
@@ -0,0 +1,71 @@
+__author__ = 'mahieke'
+
+import sys
+
+sys.path.extend('..')
+
+import flashtool.server.buildserver as buildserver
+from flashtool.server.buildserver import Buildserver, LocalBuilds
+from flashtool.server.mirror import Mirror
+from flashtool.tests.test_buildserver import BUILDERS, FakeResponse, fake_buildbot
+
+
+def fake_server(monkeypatch):
+    json_get = fake_buildbot(BUILDERS)
+    downloads = []
+
+    def get(session, url, **kwargs):
+        if '/json' in url or url.rstrip('/').endswith(':8010'):
+            return json_get(url, **kwargs)
+        downloads.append(url)
+        content = url.encode()
+        return FakeResponse(content, 200, {'Content-Length': str(len(content))})
+
+    def head(session, url, **kwargs):
+        return FakeResponse(None, 200, {'Content-Length': str(len(url.encode()))})
+
+    monkeypatch.setattr(buildserver.requests.Session, 'get', get)
+    monkeypatch.setattr(buildserver.requests.Session, 'head', head)
+    return downloads
+
+
+def test_mirror(monkeypatch, tmpdir):
+    downloads = fake_server(monkeypatch)
+    dest = tmpdir.mkdir('products')
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(dest), cache_dir=str(tmpdir))
+
+    result = Mirror(server, 4).mirror(['linux', 'rootfs'], 'bbb', limit=2)
+
+    assert sorted(result['downloaded']) == ['linux/bbb/linux_4.1_37_boot.tar.gz', 'linux/bbb/linux_4.1_38_boot.tar.gz',
+                                            'rootfs/factory/rootfs_factory_13_rootfs.tar.gz',
+                                            'rootfs/factory/rootfs_factory_14_rootfs.tar.gz']
+    assert len(downloads) == 4
+
+    # the result can be used as local source
+    local = LocalBuilds(str(dest), ['bbb'], str(tmpdir))
+    assert local.get_builds_info() == {'bbb': {
+        'linux': ['linux_4.1_37_boot.tar.gz', 'linux_4.1_38_boot.tar.gz'],
+        'rootfs': {'factory': ['rootfs_factory_13_rootfs.tar.gz', 'rootfs_factory_14_rootfs.tar.gz']},
+    }}
+
+    # present files are not downloaded again, old files are pruned
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(dest), cache_dir=str(tmpdir))
+    result = Mirror(server).mirror(['linux', 'rootfs'], 'bbb', limit=1, prune=True)
+
+    assert sorted(result['present']) == ['linux/bbb/linux_4.1_38_boot.tar.gz',
+                                         'rootfs/factory/rootfs_factory_14_rootfs.tar.gz']
+    assert result['downloaded'] == []
+    assert sorted(result['pruned']) == ['linux/bbb/linux_4.1_37_boot.tar.gz',
+                                        'rootfs/factory/rootfs_factory_13_rootfs.tar.gz']
+    assert not dest.join('linux', 'bbb', 'linux_4.1_37_boot.tar.gz').check()
+    assert len(downloads) == 4
+
+
+def test_mirror_regex(monkeypatch, tmpdir):
+    fake_server(monkeypatch)
+    server = Buildserver('http://buildbot', '8010', ['bbb'], dest=str(tmpdir))
+
+    paths, directories = Mirror(server).select(['linux', 'rootfs'], limit=None, regex='_3[0-9]_')
+
+    assert paths == ['linux/bbb/linux_4.1_{}_boot.tar.gz'.format(i) for i in range(31, 39) if i % 3]
+    assert directories == {'linux/bbb', 'rootfs/factory'}
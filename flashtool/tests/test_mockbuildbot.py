@@ -0,0 +1,52 @@
+__author__ = 'mahieke'
+
+import sys
+
+sys.path.extend('..')
+
+import flashtool.server.buildserver as buildserver
+from flashtool.server.buildserver import Buildserver
+from flashtool.tests.mockbuildbot import MockBuildbot
+
+
+def test_discovery(tmpdir):
+    with MockBuildbot(archs=2, boards=2, builds=30, rootfs_builds=5) as mock:
+        server = Buildserver(mock.address, mock.port, mock.platforms, cache_dir=str(tmpdir), batch_size=10)
+        builds = server.get_builds_info()
+
+        assert sorted(builds.keys()) == sorted(mock.platforms)
+        # every third build failed, the boards of an architecture take turns
+        assert builds['arch0_board0']['linux'][:4] == ['linux_4.1_2_boot.tar.gz', 'linux_4.1_2_root.tar.gz',
+                                                       'linux_4.1_4_boot.tar.gz', 'linux_4.1_4_root.tar.gz']
+        assert builds['arch1_board1']['rootfs'] == {'arch1_factory': ['rootfs_arch1_factory_1_rootfs.tar.gz',
+                                                                      'rootfs_arch1_factory_2_rootfs.tar.gz',
+                                                                      'rootfs_arch1_factory_4_rootfs.tar.gz']}
+
+        # a warm run is answered from the catalogs and 304 answers
+        del mock.requests[:]
+        server = Buildserver(mock.address, mock.port, mock.platforms, cache_dir=str(tmpdir), batch_size=10)
+        assert server.get_builds_info() == builds
+        assert not any('select=' in path for _, path in mock.requests)
+
+
+def test_download(tmpdir, monkeypatch):
+    monkeypatch.setattr(buildserver, 'SEGMENT_MIN_SIZE', 1024)
+    with MockBuildbot(builds=10, artifact_size=1024 * 1024) as mock:
+        server = Buildserver(mock.address, mock.port, mock.platforms, dest=str(tmpdir), segments=4)
+        path, size = server.get_file('linux/arch0_board0/linux_4.1_2_boot.tar.gz')
+
+        assert size == 1024 * 1024
+        assert open(path, 'rb').read() == mock.artifact('linux/arch0_board0/linux_4.1_2_boot.tar.gz')
+        assert len([p for m, p in mock.requests if m == 'GET' and p.startswith('/linux/')]) == 4
+
+
+def test_artifact_head():
+    import requests
+    with MockBuildbot(builds=10, artifact_size=1024 * 1024) as mock:
+        path = 'linux/arch0_board0/linux_4.1_2_boot.tar.gz'
+        head = requests.head('{}/{}'.format(mock.url, path))
+        assert head.headers['Content-Length'] == str(1024 * 1024)
+
+        part = requests.get('{}/{}'.format(mock.url, path), headers={'Range': 'bytes=1000-1999'})
+        assert part.status_code == 206
+        assert part.content == mock.artifact(path)[1000:2000]
@@ -0,0 +1,147 @@
+__author__ = 'mahieke'
+
+import crypt
+import os
+import sys
+
+import pytest
+
+sys.path.extend('..')
+
+from flashtool.setup.deploy.personalise import CardParams, load_card_params, personalise_rootfs, set_shadow_password
+from flashtool.setup.recipe import RecipeContentException
+
+
+def rootfs(tmpdir):
+    etc = tmpdir.mkdir('rootfs').mkdir('etc')
+    etc.join('shadow').write('daemon:*:16000:0:99999:7:::\nroot:*:16000:0:99999:7:::\nuser:!:16000::::::\n')
+    etc.join('hosts').write('127.0.0.1\tlocalhost\n127.0.1.1\tdefault\n')
+    etc.join('hostname').write('default\n')
+    etc.join('machine-id').write('0123456789abcdef0123456789abcdef\n')
+    etc.join('fstab').write('UUID=1111-2222 /boot vfat defaults 0 0\n'
+                            'UUID=aaaa-bbbb / ext4 defaults 0 0\n')
+    tmpdir.join('rootfs').mkdir('var').mkdir('lib').mkdir('dbus').join('machine-id').write('old\n')
+    return tmpdir.join('rootfs')
+
+
+def test_personalise_rootfs(tmpdir):
+    root = rootfs(tmpdir)
+    params = CardParams({'hostname': 'board-042', 'root_password': 'secret'})
+
+    personalise_rootfs(str(root), params, {'1111-2222': 'ABCD-EF01', 'aaaa-bbbb': 'cccc-dddd'})
+
+    etc = root.join('etc')
+    assert etc.join('fstab').read() == 'UUID=ABCD-EF01 /boot vfat defaults 0 0\nUUID=cccc-dddd / ext4 defaults 0 0\n'
+    assert etc.join('hostname').read() == 'board-042\n'
+    assert etc.join('hosts').read() == '127.0.0.1\tlocalhost\n127.0.1.1\tboard-042\n'
+
+    # only the entry of root is changed
+    shadow = etc.join('shadow').read().splitlines()
+    assert shadow[0] == 'daemon:*:16000:0:99999:7:::'
+    assert shadow[2] == 'user:!:16000::::::'
+    fields = shadow[1].split(':')
+    assert fields[0] == 'root' and fields[3:] == ['0', '99999', '7', '', '', '']
+    assert crypt.crypt('secret', fields[1]) == fields[1]
+
+    machine_id = etc.join('machine-id').read().strip()
+    assert len(machine_id) == 32 and machine_id != '0123456789abcdef0123456789abcdef'
+    assert root.join('var', 'lib', 'dbus', 'machine-id').read().strip() == machine_id
+
+
+def test_generic_image(tmpdir):
+    root = rootfs(tmpdir)
+    personalise_rootfs(str(root), CardParams({'machine_id': 'empty'}))
+
+    # nothing but the machine id is changed
+    assert root.join('etc', 'machine-id').read() == ''
+    assert root.join('etc', 'hostname').read() == 'default\n'
+    assert 'root:*:16000' in root.join('etc', 'shadow').read()
+
+
+def test_shadow_without_root(tmpdir):
+    root = tmpdir.mkdir('rootfs')
+    root.mkdir('etc').join('shadow').write('daemon:*:16000:0:99999:7:::\n')
+
+    set_shadow_password(str(root), password_hash='$6$salt$hash')
+
+    assert root.join('etc', 'shadow').read().splitlines()[0].startswith('root:$6$salt$hash:')
+
+
+def test_card_params(tmpdir):
+    card = tmpdir.join('card.yml')
+    card.write('hostname: board-042\nroot_password_hash: $6$salt$hash\nmachine_id: empty\nuuids: false\n')
+
+    params = load_card_params(str(card))
+    assert params.hostname == 'board-042'
+    assert params.root_password_hash == '$6$salt$hash'
+    assert params.machine_id == 'empty'
+    assert params.uuids is False
+
+    # defaults
+    params = CardParams()
+    assert params.machine_id == 'random' and params.uuids and params.hostname is None
+
+    with pytest.raises(RecipeContentException):
+        CardParams({'hostnam': 'board'})
+    with pytest.raises(RecipeContentException):
+        CardParams({'hostname': 'board_042'})
+    with pytest.raises(RecipeContentException):
+        CardParams({'machine_id': 'xyz'})
+
+
+def test_renew_uuids(monkeypatch):
+    import flashtool.setup.deploy.personalise as personalise
+    import flashtool.utility as util
+
+    infos = {
+        '/dev/sdx1': {'uuid': 'aaaa-bbbb', 'fs_type': 'ext4', 'fs_version': '1.0'},
+        '/dev/sdx2': {'uuid': 'cccc-dddd', 'fs_type': 'ext4', 'fs_version': '1.0'},
+    }
+    calls = []
+
+    def os_call(command, timeout=None, allow_user_interrupt=True):
+        calls.append(command[0])
+        if command[-1] == '/dev/sdx2':
+            raise util.SubprocessCallException('"tune2fs" COMMAND FAILED:', ['requires a freshly checked filesystem'])
+
+    monkeypatch.setattr(personalise, 'get_partition_info', lambda path: infos[path])
+    monkeypatch.setattr(personalise.subprocess, 'call', lambda command, **kwargs: calls.append(command[0]) or 1)
+    monkeypatch.setattr(util, 'os_call', os_call)
+
+    uuids = personalise.renew_uuids(['/dev/sdx1', '/dev/sdx2'])
+
+    # the filesystem is checked before its uuid is changed, a failure keeps the old uuid
+    assert calls == ['e2fsck', 'tune2fs', 'e2fsck', 'tune2fs']
+    assert list(uuids.keys()) == ['aaaa-bbbb']
+
+
+def test_personalise_device_search_rootfs(tmpdir, monkeypatch):
+    import flashtool.setup.deploy.personalise as personalise
+    import flashtool.utility as util
+
+    infos = {
+        '/dev/sdx1': {'uuid': None, 'fs_type': None, 'fs_version': None},
+        '/dev/sdx2': {'uuid': None, 'fs_type': 'swap', 'fs_version': None},
+        '/dev/sdx3': {'uuid': None, 'fs_type': 'ext4', 'fs_version': '1.0'},
+        '/dev/sdx4': {'uuid': None, 'fs_type': 'ext4', 'fs_version': '1.0'},
+    }
+    mounted = []
+
+    def os_call(command, timeout=None, allow_user_interrupt=True):
+        if command[0] == 'mount':
+            mounted.append(command[1])
+            if command[1] == '/dev/sdx3':
+                raise util.SubprocessCallException('"mount" COMMAND FAILED:', ['wrong fs type'])
+            rootfs(tmpdir)
+            os.rmdir(command[2])
+            os.symlink(str(tmpdir.join('rootfs')), command[2])
+
+    monkeypatch.setattr(personalise, 'get_partition_info', lambda path: infos[path])
+    monkeypatch.setattr(util, 'os_call', os_call)
+
+    personalise.personalise_device(sorted(infos), CardParams({'hostname': 'board-042'}),
+                                   tmp_dir=str(tmpdir.join('mnt')))
+
+    # only partitions which can hold a rootfs are mounted, a failed mount is skipped
+    assert mounted == ['/dev/sdx3', '/dev/sdx4']
+    assert tmpdir.join('rootfs', 'etc', 'hostname').read() == 'board-042\n'
@@ -0,0 +1,131 @@
+__author__ = 'mahieke'
+
+import os
+import pickle
+import sys
+import time
+
+import pytest
+
+sys.path.extend('..')
+
+from flashtool.setup.deploy.personalise import CardParams
+from flashtool.setup.station import FetchedFiles, GoldenSlotJob, StationError, assign_card_params, run_slots
+
+
+# the slots are spawned, so their jobs must be picklable
+def job(progress):
+    progress('write')
+    print('output of the slot')
+
+
+def failing(progress):
+    raise Exception('no medium')
+
+
+def killed(progress):
+    os._exit(3)
+
+
+def sleeping(progress):
+    time.sleep(0.5)
+
+
+def test_fetched_files(tmpdir):
+    path = tmpdir.join('rootfs.tar.gz')
+    path.write('content')
+    files = FetchedFiles({'rootfs/factory/rootfs.tar.gz': (str(path), 7)})
+
+    assert files.get_file('rootfs/factory/rootfs.tar.gz') == (str(path), 7)
+    assert files.prefetch('rootfs/factory/rootfs.tar.gz').result() == (str(path), 7)
+
+    # a slot never downloads a file
+    with pytest.raises(StationError):
+        files.get_file('linux/bbb/linux.tar.gz')
+    with pytest.raises(StationError):
+        files.prefetch('linux/bbb/linux.tar.gz').result()
+
+
+def test_assign_card_params():
+    cards = [CardParams({'hostname': 'board-{}'.format(i)}) for i in range(3)]
+
+    assert assign_card_params(None, 2) == [None, None]
+    assert assign_card_params(cards, 2) == cards[:2]
+
+    # a single parameter set gives every card its own identity
+    single = CardParams({'hostname': 'board', 'machine_id': '0' * 32, 'uuids': False})
+    params = assign_card_params([single], 3)
+    assert [p.hostname for p in params] == ['board-0', 'board-1', 'board-2']
+    assert all(p.machine_id == 'random' and p.uuids for p in params)
+    assert single.hostname == 'board'
+
+    params = assign_card_params([CardParams({'hostname': 'b' * 63, 'machine_id': 'empty'})], 12)
+    assert params[11].hostname == 'b' * 60 + '-11'
+    assert params[11].machine_id == 'empty'
+
+    with pytest.raises(StationError):
+        assign_card_params(cards[:2], 3)
+
+
+def test_run_slots(tmpdir):
+    messages = []
+    results = run_slots([job, failing, killed], log_dir=str(tmpdir),
+                        report=lambda slot, state, message: messages.append((slot, state, message)))
+
+    assert [r['state'] for r in results] == ['done', 'failed', 'failed']
+    assert results[1]['message'] == 'no medium'
+    assert 'exit code 3' in results[2]['message']
+    assert (0, 'progress', 'write') in messages
+
+    # the output of a slot goes to its log file
+    assert 'output of the slot' in tmpdir.join('station-slot0.log').read()
+    assert 'no medium' in tmpdir.join('station-slot1.log').read()
+
+
+def test_slots_run_in_parallel():
+    # one after another the slots would take 2 seconds
+    start = time.time()
+    results = run_slots([sleeping] * 4)
+    assert all(r['state'] == 'done' for r in results)
+    assert time.time() - start < 2.0
+
+    # at most two slots at once
+    start = time.time()
+    run_slots([sleeping] * 4, workers=2)
+    assert time.time() - start >= 1.0
+
+
+def test_slot_job_picklable():
+    device = ({'path': '/dev/sdb', 'size': 4 << 30}, [{'path': '/dev/sdb1'}])
+    job = GoldenSlotJob([('/tmp/golden/a.img', 1)], device, CardParams({'hostname': 'board-0'}), '/tmp/slot0')
+
+    copy = pickle.loads(pickle.dumps(job))
+    assert copy.images == job.images
+    assert copy.card_params.hostname == 'board-0'
+
+
+class FakeDisk():
+    def __init__(self, sys_name, partitions=0):
+        self.sys_name = sys_name
+        self.device_node = '/dev/{}'.format(sys_name)
+        self.children = [FakeDisk('{}p{}'.format(sys_name, i + 1)) for i in range(partitions)]
+
+
+def test_card_recognition(monkeypatch):
+    import flashtool.setup.udev.mmc as udev
+
+    sysfs = {
+        ('mmcblk0', 'device/type'): 'MMC',
+        ('mmcblk1', 'device/type'): 'SD',
+        ('sda', 'removable'): '0',
+        ('sdb', 'removable'): '1',
+        ('sdc', 'removable'): '1',
+        ('sr0', 'removable'): '1',
+    }
+    monkeypatch.setattr(udev, '_sysfs_attribute', lambda name, attribute: sysfs.get((name, attribute)))
+    monkeypatch.setattr(udev, '_is_in_use', lambda paths: '/dev/sdcp1' in paths)
+
+    # no eMMC, fixed disk, optical drive or disk with a mounted partition
+    cards = [d.sys_name for d in [FakeDisk('mmcblk0', 2), FakeDisk('mmcblk1', 2), FakeDisk('sda', 1),
+                                  FakeDisk('sdb', 1), FakeDisk('sdc', 1), FakeDisk('sr0')] if udev._is_card(d)]
+    assert cards == ['mmcblk1', 'sdb']
@@ -0,0 +1,52 @@
+__author__ = 'mahieke'
+
+import sys
+
+sys.path.extend('..')
+
+from flashtool.server.buildserver import Buildserver
+from flashtool.server.watch import Watcher
+from flashtool.tests.mockbuildbot import MockBuildbot
+
+
+def test_watch(tmpdir):
+    dest = tmpdir.mkdir('products')
+    with MockBuildbot(archs=1, boards=1, builds=20, rootfs_builds=5) as mock:
+        server = Buildserver(mock.address, mock.port, mock.platforms, dest=str(dest), cache_dir=str(tmpdir),
+                             batch_size=10)
+        watcher = Watcher(server, ['linux', 'rootfs'], limit=1, interval=0)
+
+        result = watcher.poll()
+        assert sorted(result['downloaded']) == ['linux/arch0_board0/linux_4.1_19_boot.tar.gz',
+                                                'linux/arch0_board0/linux_4.1_19_root.tar.gz',
+                                                'rootfs/arch0_factory/rootfs_arch0_factory_4_rootfs.tar.gz']
+
+        # nothing changed: no build documents and no artifacts are requested
+        del mock.requests[:]
+        result = watcher.poll()
+        assert result['downloaded'] == []
+        assert len(result['present']) == 3
+        assert not any('select=' in path or not path.startswith('/json') and path != '/' for _, path in mock.requests)
+
+        # a new build is found and downloaded, build 21 failed
+        mock.builds = 23
+        watcher.run(rounds=1)
+        assert dest.join('linux', 'arch0_board0', 'linux_4.1_22_root.tar.gz').check()
+        assert not dest.join('linux', 'arch0_board0', 'linux_4.1_21_root.tar.gz').check()
+
+
+def test_watch_without_limit(tmpdir):
+    dest = tmpdir.mkdir('products')
+    with MockBuildbot(archs=1, boards=1, builds=5, rootfs_builds=1, fail_every=0) as mock:
+        server = Buildserver(mock.address, mock.port, mock.platforms, dest=str(dest), cache_dir=str(tmpdir))
+        # --limit 0 keeps all builds
+        watcher = Watcher(server, ['linux'], limit=None, interval=0)
+
+        result = watcher.poll()
+        assert len(result['downloaded']) == 10
+
+        # the build of the second poll is found, not the builds of the first poll again
+        mock.builds = 6
+        result = watcher.poll()
+        assert sorted(result['downloaded']) == ['linux/arch0_board0/linux_4.1_5_boot.tar.gz',
+                                                'linux/arch0_board0/linux_4.1_5_root.tar.gz']
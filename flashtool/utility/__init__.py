@@ -76,6 +76,22 @@ def create_regex_allowed(chk):
     return "(^" + "$)|(^".join(chk) + "$)"
 
 
+def to_byte(string):
+    '''
+    Converts a size string like "500", "300kb", "20 MB" or "4G" to bytes.
+
+    :param string: size with optional unit (k, m, g, t with optional b)
+    :return: size in bytes
+    '''
+    units = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+    match = re.match('^([0-9]+) *([kmgt]?)b?$', str(string).strip().lower())
+    if not match:
+        raise ValueError('Size "{}" is not valid. Allowed: #num( ,kb,mb,gb,tb)'.format(string))
+
+    return int(match.group(1)) * units[match.group(2)]
+
+
 def get_size_block_dev(dev_name, partition=None):
     '''
     Function to determine the size of a partition or a whole block device.
@@ -174,9 +190,11 @@ def os_call(command, timeout=None, allow_user_interrupt=True):
 def untar(tar, target):
     '''
     Unpack a tarball to a target location using tarfile. The
-    progress of the unpack procedure will be shown.
+    progress of the unpack procedure will be shown. If tar is a file
+    object, it is read as a stream (any compression), so it can be
+    unpacked while it is downloaded.
 
-    :param tar: tarball file
+    :param tar: tarball file or file object
     :param target: target location
     :return: None
     '''
@@ -222,10 +240,13 @@ def untar(tar, target):
                 yield member
 
     try:
-        tarball = tarfile.open(tar, 'r')
-        tarfile.open()
+        if hasattr(tar, 'read'):
+            tarball = tarfile.open(fileobj=tar, mode='r|*')
+        else:
+            tarball = tarfile.open(tar, 'r')
     except Exception as e:
         print(Fore.RED + '   {}'.format(str(e)))
+        raise
 
     try:
         tarball.extractall(path=target, members=tracker(tarball).track_progress())